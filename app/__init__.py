@@ -38,13 +38,23 @@ def create_app(config_class=Config):
     app.register_blueprint(api)
     app.register_blueprint(super_admin)
 
+    # Audit events are queued and bulk-inserted by a background writer
+    from app.activity import writer as activity_writer
+    activity_writer.init_app(app)
+
     # Activity Tracking Middleware
-    from datetime import datetime
+    # Presence goes through a write-behind buffer instead of a commit per request
+    from flask import request
     from flask_login import current_user
+    from app.presence import buffer as presence_buffer
+    presence_buffer.init_app(app)
+
     @app.before_request
     def update_last_active():
+        # Signed file links are served without loading the user
+        if request.endpoint in ('static', 'notes.signed_file'):
+            return
         if current_user.is_authenticated:
-            current_user.last_active = datetime.utcnow()
-            db.session.commit()
+            presence_buffer.record(current_user.id, current_user.last_active)
 
     return app
@@ -0,0 +1,347 @@
+"""Batched, asynchronous writer for ActivityLog rows.
+
+log_activity() hands events to the writer instead of committing them itself.
+Each event is appended to a per-process spool file first, then a daemon thread
+bulk-inserts the queue when it reaches ACTIVITY_LOG_BATCH_SIZE events or every
+ACTIVITY_LOG_FLUSH_INTERVAL seconds, whichever comes first. A spool segment is
+only deleted once its rows are committed, and spool files left behind by a
+worker that died are replayed by the next process to start, so a restart does
+not lose audit events.
+
+Set ACTIVITY_LOG_SYNC to write each event in the request's own transaction, as
+tests expect.
+"""
+import atexit
+import glob
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from flask import request, url_for
+from app import db
+from app import identity
+from app.models import ActivityLog, College, User
+
+LOG_PAGE_SIZE = 50
+MAX_LOG_PAGE_SIZE = 200
+EXPORT_BATCH_SIZE = 1000
+
+# Whose activity each role browses, and whether that is limited to the viewer's own college
+LOG_AUDIENCES = {
+    'Admin': ('Teacher', True),
+    'Teacher': ('Student', True),
+    'Super Admin': ('Admin', False),
+}
+
+
+class ActivityWriter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held for a whole flush, so the daemon thread and the atexit flush never commit or
+        # delete each other's spool segments
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._queue = []
+        self._spool = None
+        self._spool_pid = None
+        self._segment = 0
+        self._sealed = []  # spool segments whose events are not committed yet
+        self._app = None
+        self._thread = None
+
+    def init_app(self, app):
+        if self._app is None:
+            atexit.register(self.flush)
+        self._app = app
+        if not app.config.get('ACTIVITY_LOG_SYNC'):
+            os.makedirs(self.spool_dir, exist_ok=True)
+            self.recover()
+
+    @property
+    def spool_dir(self):
+        return self._app.config.get('ACTIVITY_LOG_SPOOL_DIR') or os.path.join(self._app.instance_path, 'activity_spool')
+
+    def record(self, event):
+        """Queues one event dict (user_id, action, details, timestamp, ...)."""
+        event.setdefault('timestamp', datetime.utcnow())
+        if self._app.config.get('ACTIVITY_LOG_SYNC'):
+            db.session.add(ActivityLog(**event))
+            db.session.commit()
+            return
+
+        with self._lock:
+            self._spool_file().write(json.dumps(_encode(event)) + '\n')
+            self._spool.flush()
+            self._queue.append(event)
+            full = len(self._queue) >= self._app.config.get('ACTIVITY_LOG_BATCH_SIZE', 200)
+        self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """Bulk-inserts everything queued so far. Returns the number of rows written."""
+        if self._app is None:
+            return 0
+        with self._flush_lock:
+            with self._lock:
+                if not self._queue:
+                    return 0
+                events, self._queue = self._queue, []
+                # Seal the current spool segment; it is removed once these rows are committed.
+                # Segments of an earlier failed flush are still listed: their events were requeued.
+                self._seal_spool()
+                segments = list(self._sealed)
+
+            if not self._insert(events):
+                with self._lock:
+                    self._queue[:0] = events
+                return 0
+            with self._lock:
+                for segment in segments:
+                    self._sealed.remove(segment)
+                    os.remove(segment)
+            return len(events)
+
+    def recover(self):
+        """Replays spool files of processes that are no longer running."""
+        replayed = 0
+        for path in sorted(glob.glob(os.path.join(self.spool_dir, 'activity-*.jsonl*'))):
+            pid = _spool_pid(path)
+            if pid is not None and pid != os.getpid() and _alive(pid):
+                continue
+            # Claim the file first so two starting workers never replay it twice
+            claimed = f"{path}.recovering-{os.getpid()}"
+            try:
+                os.rename(path, claimed)
+            except OSError:
+                continue
+            with open(claimed) as f:
+                events = [_decode(json.loads(line)) for line in f if line.strip()]
+            if not events or self._insert(events):
+                os.remove(claimed)
+                replayed += len(events)
+        return replayed
+
+    def _insert(self, events):
+        try:
+            with self._app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(ActivityLog.__table__.insert(), events)
+            return True
+        except Exception as e:
+            # Events stay queued and their spool segments stay on disk for the next attempt
+            self._app.logger.warning(f"Activity log flush failed, kept in spool: {e}")
+            return False
+
+    def _spool_file(self):
+        if self._spool is None or self._spool_pid != os.getpid():
+            self._spool_pid = os.getpid()
+            self._spool = open(os.path.join(self.spool_dir, f"activity-{self._spool_pid}.jsonl"), 'a')
+        return self._spool
+
+    def _seal_spool(self):
+        if self._spool is None or self._spool_pid != os.getpid():
+            return
+        self._spool.close()
+        self._spool = None
+        self._segment += 1
+        current = os.path.join(self.spool_dir, f"activity-{self._spool_pid}.jsonl")
+        sealed = f"{current}.{self._segment}"
+        os.rename(current, sealed)
+        self._sealed.append(sealed)
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='activity-log-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self._app.config.get('ACTIVITY_LOG_FLUSH_INTERVAL', 2))
+            self._wake.clear()
+            self.flush()
+
+
+def parse_log_filters(args):
+    """Reads the user, action and date range filters of the log pages from request args."""
+    filters = {
+        'user_id': args.get('user_id', type=int),
+        'action': (args.get('action') or '').strip() or None,
+    }
+    for key in ('start', 'end'):
+        try:
+            filters[key] = datetime.strptime(args.get(key, ''), '%Y-%m-%d')
+        except ValueError:
+            filters[key] = None
+    return filters
+
+
+def log_page(role_name, college_id=None, filters=None, cursor=None, per_page=LOG_PAGE_SIZE):
+    """One page of entries logged by users of `role_name`, newest first.
+
+    Only log columns are selected and every filter is a predicate on ActivityLog, so a page
+    is one range scan of an activity_log index. Usernames and emails are looked up for the
+    users on the page alone. Returns (rows, next_cursor); rows are plain dicts.
+    """
+    from app.utils import keyset_paginate
+
+    filters = filters or {}
+    query = db.session.query(
+        ActivityLog.id, ActivityLog.timestamp, ActivityLog.user_id, ActivityLog.action, ActivityLog.details
+    ).filter(ActivityLog.role_id == identity.role_id_for(role_name))
+    if college_id is not None:
+        query = query.filter(ActivityLog.college_id == college_id)
+    if filters.get('user_id'):
+        query = query.filter(ActivityLog.user_id == filters['user_id'])
+    if filters.get('action'):
+        query = query.filter(ActivityLog.action == filters['action'])
+    if filters.get('start'):
+        query = query.filter(ActivityLog.timestamp >= filters['start'])
+    if filters.get('end'):
+        # The end date is inclusive
+        query = query.filter(ActivityLog.timestamp < filters['end'] + timedelta(days=1))
+
+    page_keys = [ActivityLog.timestamp, ActivityLog.id]
+    per_page = max(1, min(per_page, MAX_LOG_PAGE_SIZE))
+    items, next_cursor = keyset_paginate(query, page_keys, cursor=cursor, per_page=per_page)
+
+    user_ids = {item[2] for item in items}
+    users = {}
+    if user_ids:
+        users = {row.id: row for row in db.session.query(User.id, User.username, User.email).filter(User.id.in_(user_ids))}
+    rows = []
+    for log_id, timestamp, user_id, action, details in items:
+        user = users.get(user_id)
+        rows.append({
+            'id': log_id,
+            'timestamp': timestamp,
+            'username': user.username if user else 'Deleted user',
+            'email': user.email if user else '',
+            'action': action,
+            'details': details,
+        })
+    return rows, next_cursor
+
+
+def log_users(role_name, college_id=None):
+    """(id, username) of the users whose logs a viewer can filter by."""
+    query = db.session.query(User.id, User.username).filter(User.role_id == identity.role_id_for(role_name))
+    if college_id is not None:
+        query = query.filter(User.college_id == college_id)
+    return query.order_by(User.username).all()
+
+
+def log_view(role_name, college_id, endpoint):
+    """Template context for a log page: the requested page plus the filter state."""
+    cursor = request.args.get('cursor')
+    logs, next_cursor = log_page(role_name, college_id, parse_log_filters(request.args), cursor=cursor)
+    args = {k: v for k, v in request.args.items() if k != 'cursor' and v}
+    return {
+        'logs': logs,
+        'role_name': role_name,
+        'filters': args,
+        'log_users': log_users(role_name, college_id),
+        'is_first_page': not cursor,
+        'first_url': url_for(endpoint, **args),
+        'next_url': url_for(endpoint, **args, cursor=next_cursor) if next_cursor else None,
+        'next_cursor': next_cursor,
+        'feed_url': url_for('api.get_logs', **args),
+    }
+
+
+def _export_query(role_name, college_id=None):
+    query = db.session.query(
+        ActivityLog.timestamp, User.username, User.email, College.name, ActivityLog.action, ActivityLog.details
+    ).join(User, User.id == ActivityLog.user_id).outerjoin(College, College.id == User.college_id).filter(
+        ActivityLog.role_id == identity.role_id_for(role_name)
+    )
+    if college_id is not None:
+        query = query.filter(ActivityLog.college_id == college_id)
+    return query
+
+
+def export_rows(role_name, college_id=None, batched=False):
+    """(timestamp, username, email, college, action, details) for every entry logged by users
+    of `role_name`, newest first, EXPORT_BATCH_SIZE rows at a time.
+
+    By default one query is read with yield_per. With batched=True each batch is its own
+    short keyset query, so the caller can commit between batches (the export worker does).
+    """
+    from app.utils import iter_keyset
+
+    query = _export_query(role_name, college_id)
+    keys = [ActivityLog.timestamp, ActivityLog.id]
+    if batched:
+        return iter_keyset(query, keys, batch_size=EXPORT_BATCH_SIZE)
+    return query.order_by(*[k.desc() for k in keys]).yield_per(EXPORT_BATCH_SIZE)
+
+
+def log_export_lines(role_name, college_id=None, user_label='User', with_college=False, title=None, batched=False):
+    """The lines of a bulk log export: an optional title block, the header, then one line per entry."""
+    yield from title or []
+    yield ['Timestamp', user_label, 'Email'] + (['College'] if with_college else []) + ['Action', 'Details']
+    for timestamp, username, email, college, action, details in export_rows(role_name, college_id, batched):
+        line = [timestamp.strftime('%Y-%m-%d %H:%M:%S'), username, email]
+        if with_college:
+            line.append(college or 'N/A')
+        yield line + [action, details or '']
+
+
+def count_logs(role_name, college_id=None, **_):
+    """Number of entries a bulk log export of `role_name` will contain."""
+    query = db.session.query(db.func.count(ActivityLog.id)).filter(ActivityLog.role_id == identity.role_id_for(role_name))
+    if college_id is not None:
+        query = query.filter(ActivityLog.college_id == college_id)
+    return query.scalar()
+
+
+def user_export_rows(user_id):
+    """(timestamp, action, details) for every entry of one user, newest first, in batches."""
+    return db.session.query(ActivityLog.timestamp, ActivityLog.action, ActivityLog.details).filter(
+        ActivityLog.user_id == user_id
+    ).order_by(ActivityLog.timestamp.desc(), ActivityLog.id.desc()).yield_per(EXPORT_BATCH_SIZE)
+
+
+def backfill_actor_scope():
+    """Fills role_id and college_id on log rows written before they were recorded."""
+    log = ActivityLog.__table__
+    user = User.__table__
+    stmt = update(log).where(log.c.role_id.is_(None)).values(
+        role_id=select(user.c.role_id).where(user.c.id == log.c.user_id).scalar_subquery(),
+        college_id=select(user.c.college_id).where(user.c.id == log.c.user_id).scalar_subquery(),
+    )
+    return db.session.execute(stmt).rowcount
+
+
+def _encode(event):
+    return {k: v.isoformat() if isinstance(v, datetime) else v for k, v in event.items()}
+
+
+def _decode(event):
+    event['timestamp'] = datetime.fromisoformat(event['timestamp'])
+    return event
+
+
+def _spool_pid(path):
+    try:
+        return int(os.path.basename(path).split('-')[1].split('.')[0])
+    except (IndexError, ValueError):
+        return None
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+writer = ActivityWriter()
@@ -0,0 +1,181 @@
+"""Content-addressed storage for uploaded note files.
+
+Uploads are hashed while they stream to disk and kept once per content under
+BLOB_STORE/ab/cdef..., whatever their name. The store sits outside the static
+folder, so files and previews are only served by the routes that check access. Each Note points at its Blob
+and the Blob counts its notes, so identical uploads share one file (and one CDN
+copy) and the file is only deleted when the last note referencing it goes away.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from flask import current_app
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from werkzeug.security import safe_join
+from app import db
+from app import search
+from app.models import Blob, CdnPush, LshBucket, Note
+
+CHUNK_SIZE = 1024 * 1024  # Bytes read per step while hashing
+
+
+def store_root():
+    return current_app.config.get('BLOB_STORE') or os.path.join(current_app.instance_path, 'blobs')
+
+
+def blob_path(sha256):
+    return os.path.join(store_root(), sha256[:2], sha256[2:])
+
+
+def preview_dir(sha256):
+    """Rendered preview images of a blob live next to it."""
+    return blob_path(sha256) + '.preview'
+
+
+def note_path(note):
+    """Where a local note's file is, for notes stored before blobs too (None if the legacy name is unsafe)."""
+    if note.blob_id:
+        return blob_path(note.blob.sha256)
+    return safe_join(current_app.config['UPLOAD_FOLDER'], note.filename)
+
+
+def acquire(sha256, size):
+    """Adds a reference to the blob for this content, creating its row if needed. The caller commits."""
+    blob = Blob.query.filter_by(sha256=sha256).first()
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                blob = Blob(sha256=sha256, size=size, refcount=1)
+                db.session.add(blob)
+            return blob
+        except IntegrityError:
+            # Another upload of the same content created it first
+            blob = Blob.query.filter_by(sha256=sha256).one()
+    db.session.execute(update(Blob).where(Blob.id == blob.id).values(refcount=Blob.refcount + 1))
+    return blob
+
+
+def temp_dir():
+    """Scratch space on the same filesystem as the store, so finished files are renamed in."""
+    path = os.path.join(store_root(), 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def store_temp(tmp_path, sha256, size):
+    """Moves a fully written temp file with a known digest into the store and returns its
+    referenced Blob. Content that is already stored is not kept twice: the temp file is dropped."""
+    blob = acquire(sha256, size)
+    path = blob_path(sha256)
+    if os.path.exists(path):
+        os.remove(tmp_path)
+        # Fresh mtime: the orphan sweeper leaves files younger than ORPHAN_MIN_AGE alone
+        os.utime(path)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+    return blob
+
+
+def save(file):
+    """Streams an uploaded file to disk while hashing it and returns its referenced Blob."""
+    fd, tmp_path = tempfile.mkstemp(dir=temp_dir())
+    try:
+        digest = hashlib.sha256()
+        size = 0
+        with os.fdopen(fd, 'wb') as out:
+            for block in iter(lambda: file.stream.read(CHUNK_SIZE), b''):
+                digest.update(block)
+                out.write(block)
+                size += len(block)
+        return store_temp(tmp_path, digest.hexdigest(), size)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def release(blob_id):
+    """Drops one reference. Returns the path of a file that is no longer referenced, for the
+    caller to pass to remove_file() after committing, or None."""
+    if blob_id is None:
+        return None
+    db.session.execute(update(Blob).where(Blob.id == blob_id).values(refcount=Blob.refcount - 1))
+    sha256 = db.session.query(Blob.sha256).filter(Blob.id == blob_id, Blob.refcount <= 0).scalar()
+    if sha256 is None:
+        return None
+    db.session.execute(delete(CdnPush).where(CdnPush.blob_id == blob_id))
+    search.remove_content(blob_id)
+    db.session.execute(delete(LshBucket).where(LshBucket.blob_id == blob_id))
+    db.session.execute(delete(Blob).where(Blob.id == blob_id, Blob.refcount <= 0))
+    return blob_path(sha256)
+
+
+def remove_file(path):
+    """Deletes a released blob file and its preview images."""
+    if path and os.path.exists(path):
+        os.remove(path)
+    if path:
+        shutil.rmtree(path + '.preview', ignore_errors=True)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def move_static_store():
+    """Moves a store kept under UPLOAD_FOLDER/sha256, where the static route served it
+    to anyone, into store_root(). Returns how many files and preview folders moved."""
+    old_root = os.path.join(current_app.config['UPLOAD_FOLDER'], 'sha256')
+    root = store_root()
+    if not os.path.isdir(old_root) or os.path.abspath(old_root) == os.path.abspath(root):
+        return 0
+    count = 0
+    for shard in os.listdir(old_root):
+        for name in os.listdir(os.path.join(old_root, shard)):
+            source, target = os.path.join(old_root, shard, name), os.path.join(root, shard, name)
+            if os.path.lexists(target):
+                # Same name, same content: the copy already in the store wins
+                shutil.rmtree(source) if os.path.isdir(source) else os.remove(source)
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(source, target)
+            count += 1
+    shutil.rmtree(old_root)
+    return count
+
+
+def adopt_legacy_files():
+    """Moves notes saved under UPLOAD_FOLDER/<filename> onto blobs.
+
+    The store gets a hard link (or a copy) of each file; the old names stay in place
+    until the orphan sweeper removes them.
+    """
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    notes = Note.query.filter(Note.blob_id.is_(None), Note.file_url.is_(None), Note.filename.isnot(None)).all()
+    hashes = {}
+    count = 0
+    for note in notes:
+        legacy = os.path.join(upload_folder, note.filename)
+        if not os.path.isfile(legacy):
+            continue
+        if note.filename not in hashes:
+            hashes[note.filename] = hash_file(legacy)
+        sha256 = hashes[note.filename]
+        blob = acquire(sha256, os.path.getsize(legacy))
+        path = blob_path(sha256)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(legacy, path)
+            except OSError:
+                shutil.copyfile(legacy, path)
+        note.blob_id = blob.id
+        count += 1
+    return count
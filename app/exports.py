@@ -0,0 +1,194 @@
+"""Database-backed queue for exports too large to build inside a request.
+
+A route calls enqueue() and returns the job id at once. bin/worker.py claims queued
+jobs, writes the file into EXPORT_FOLDER as CSV, gzip CSV or XLSX, and records
+progress on the job row so the page can poll /api/exports/<id>. Finished files are
+deleted EXPORT_TTL seconds after they were written.
+"""
+import csv
+import gzip
+import json
+import os
+from datetime import datetime, timedelta
+from flask import current_app, jsonify, request, url_for
+from flask_login import current_user
+from sqlalchemy import update
+from app import db
+from app import activity
+from app.models import ExportJob
+
+# export name -> (function yielding the rows of the file, function counting its data rows)
+EXPORTS = {
+    'activity_logs': (activity.log_export_lines, activity.count_logs),
+}
+FORMATS = {'csv': 'text/csv', 'csv.gz': 'application/gzip',
+           'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
+XLSX_MAX_ROWS = 1048576  # Excel's sheet limit; longer exports continue on a new sheet
+
+
+def export_folder():
+    folder = current_app.config.get('EXPORT_FOLDER') or os.path.join(current_app.instance_path, 'exports')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def enqueue(export, fmt, user_id, filename, **params):
+    """Queues an export and returns the committed job."""
+    if export not in EXPORTS:
+        raise ValueError(f"Unknown export {export!r}")
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format {fmt!r}")
+    job = ExportJob(user_id=user_id, export=export, format=fmt, filename=filename, params=json.dumps(params))
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def enqueue_request(export, filename, **params):
+    """Queues an export for the current user in the format posted by the page.
+
+    Returns a 202 response carrying the job status, or a 400 for an unknown format.
+    """
+    fmt = request.form.get('format', 'csv')
+    if fmt not in FORMATS:
+        return jsonify({'error': f'Unsupported format {fmt}'}), 400
+    job = enqueue(export, fmt, current_user.id, filename, **params)
+    return jsonify(status(job)), 202
+
+
+def status(job):
+    """What the polling endpoint reports for a job."""
+    data = {
+        'id': job.id,
+        'status': job.status,
+        'format': job.format,
+        'rows_done': job.rows_done,
+        'rows_total': job.rows_total,
+        'progress': min(1.0, round(job.rows_done / job.rows_total, 3)) if job.rows_total else None,
+        'status_url': url_for('api.export_status', job_id=job.id),
+        'download_url': None,
+        'expires_at': job.expires_at.isoformat() if job.expires_at else None,
+        'error': job.error,
+    }
+    if job.status == 'done':
+        data['download_url'] = url_for('api.download_export', job_id=job.id)
+    return data
+
+
+def artifact_path(job):
+    return os.path.join(export_folder(), job.artifact)
+
+
+def claim_next():
+    """Marks the oldest queued job as running and returns it, or None if the queue is empty.
+
+    The claim is a conditional UPDATE, so several workers can poll the same table safely.
+    """
+    while True:
+        job_id = db.session.query(ExportJob.id).filter_by(status='queued').order_by(ExportJob.created_at, ExportJob.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        now = datetime.utcnow()
+        claimed = db.session.execute(
+            update(ExportJob).where(ExportJob.id == job_id, ExportJob.status == 'queued')
+            .values(status='running', updated_at=now)
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(ExportJob, job_id)
+
+
+def run(job):
+    """Writes the job's file, updating progress every EXPORT_PROGRESS_EVERY rows."""
+    lines, count = EXPORTS[job.export]
+    params = json.loads(job.params)
+    every = current_app.config.get('EXPORT_PROGRESS_EVERY', 5000)
+    artifact = f"export-{job.id}-{job.filename}.{job.format}"
+    path = os.path.join(export_folder(), artifact)
+    part = path + '.part'
+
+    try:
+        job.rows_total = count(**params)
+        db.session.commit()
+
+        def progress(done):
+            job.rows_done = done
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+
+        # Batched reads leave no cursor open, so progress can be committed mid-export
+        rows = lines(batched=True, **params)
+        if job.format == 'xlsx':
+            _write_xlsx(part, rows, progress, every)
+        else:
+            _write_csv(part, rows, progress, every, compress=job.format == 'csv.gz')
+        os.replace(part, path)
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(part):
+            os.remove(part)
+        job.status = 'failed'
+        job.error = str(e)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+        return False
+
+    job.status = 'done'
+    job.artifact = artifact
+    job.rows_done = job.rows_total
+    job.updated_at = datetime.utcnow()
+    job.expires_at = job.updated_at + timedelta(seconds=current_app.config.get('EXPORT_TTL', 86400))
+    db.session.commit()
+    return True
+
+
+def _write_csv(path, rows, progress, every, compress=False):
+    opener = gzip.open if compress else open
+    with opener(path, 'wt', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        for done, row in enumerate(rows, 1):
+            writer.writerow(row)
+            if done % every == 0:
+                progress(done)
+
+
+def _write_xlsx(path, rows, progress, every):
+    from openpyxl import Workbook
+
+    # Write-only mode streams rows to disk instead of keeping the sheet in memory
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Export')
+    sheet_rows = 0
+    for done, row in enumerate(rows, 1):
+        if sheet_rows == XLSX_MAX_ROWS:
+            sheet = workbook.create_sheet(f'Export {len(workbook.worksheets) + 1}')
+            sheet_rows = 0
+        sheet.append(row)
+        sheet_rows += 1
+        if done % every == 0:
+            progress(done)
+    workbook.save(path)
+
+
+def requeue_stale():
+    """Puts running jobs whose worker stopped reporting back in the queue. Returns the count."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_STALE_AFTER', 600))
+    count = db.session.execute(
+        update(ExportJob).where(ExportJob.status == 'running', ExportJob.updated_at < cutoff)
+        .values(status='queued', rows_done=0)
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def cleanup_expired():
+    """Deletes artifacts past their TTL and marks their jobs expired. Returns the count."""
+    jobs = ExportJob.query.filter(ExportJob.status == 'done', ExportJob.expires_at < datetime.utcnow()).all()
+    for job in jobs:
+        path = artifact_path(job)
+        if os.path.exists(path):
+            os.remove(path)
+        job.status = 'expired'
+        job.artifact = None
+    db.session.commit()
+    return len(jobs)
@@ -0,0 +1,166 @@
+"""Body text of uploaded PDF and DOCX files, for content search.
+
+upload_note marks new PDF/DOCX blobs as queued. bin/worker.py claims them a batch
+at a time, extracts and normalizes their text in the shared process pool and writes
+it to the content index in app/search.py, along with the MinHash signature of the
+text for near-duplicate detection (app/similarity.py). Extraction is keyed by content hash:
+re-uploads of a file that was already read are not queued again, and a changed
+file is a new blob that gets read once.
+"""
+import re
+import unicodedata
+import zipfile
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from xml.etree import ElementTree
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from app import blobs, search, similarity
+from app.models import Blob, Note
+from app.utils import process_pool, reset_process_pool
+
+TEXT_TYPES = ('pdf', 'docx')
+WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def enqueue(blob, material_type):
+    """Queues a document blob whose text has never been extracted. The caller commits."""
+    if material_type in TEXT_TYPES and blob.text_status is None:
+        blob.text_status = 'queued'
+        blob.text_at = datetime.utcnow()
+
+
+def normalize(text):
+    """NFKC-folds the text and collapses whitespace, so hyphen and ligature variants index alike."""
+    return WHITESPACE_RE.sub(' ', unicodedata.normalize('NFKC', text)).strip()
+
+
+def _pdf_text(path, max_chars):
+    import pymupdf
+
+    parts, size = [], 0
+    with pymupdf.open(path) as doc:
+        for page in doc:
+            part = page.get_text()
+            parts.append(part)
+            size += len(part)
+            if size >= max_chars:
+                break
+    return ' '.join(parts)
+
+
+def _docx_text(path, max_chars):
+    # A DOCX is a zip of XML parts; paragraphs are w:p elements holding w:t runs
+    parts, size = [], 0
+    with zipfile.ZipFile(path) as archive, archive.open('word/document.xml') as document:
+        for _, element in ElementTree.iterparse(document):
+            if element.tag == f'{WORD_NS}t' and element.text:
+                parts.append(element.text)
+                size += len(element.text)
+            elif element.tag == f'{WORD_NS}p':
+                parts.append('\n')
+                element.clear()
+            if size >= max_chars:
+                break
+    return ''.join(parts)
+
+
+def extract(path, max_chars):
+    """Returns the normalized text of one file. Runs in a pool process, so it must not touch
+    the app or database. The file type is sniffed, since blobs carry no extension."""
+    with open(path, 'rb') as f:
+        head = f.read(4)
+    if head.startswith(b'%PDF'):
+        text = _pdf_text(path, max_chars)
+    elif head.startswith(b'PK'):
+        text = _docx_text(path, max_chars)
+    else:
+        raise ValueError('Not a PDF or DOCX file')
+    return normalize(text)[:max_chars]
+
+
+def read(path, max_chars, sample_bytes):
+    """Returns (text, signature) of one file in a pool process. Documents without a text
+    layer are signed by their bytes instead."""
+    text = extract(path, max_chars)
+    signature = similarity.text_signature(text) if text else similarity.byte_signature(path, sample_bytes)
+    return text, signature
+
+
+def sign(path, max_chars, sample_bytes):
+    """Returns the signature of any stored file, by its text when it is a readable document.
+    Used to sign files uploaded before near-duplicate detection."""
+    try:
+        return read(path, max_chars, sample_bytes)[1]
+    except Exception:
+        return similarity.byte_signature(path, sample_bytes)
+
+
+def claim_batch():
+    """Marks up to one batch (two per pool process) of queued blobs as running and returns their ids."""
+    size = 2 * current_app.config.get('WORKER_PROCESSES', 2)
+    candidates = [blob_id for (blob_id,) in db.session.query(Blob.id).filter(
+        Blob.text_status == 'queued').order_by(Blob.text_at, Blob.id).limit(size)]
+    claimed = []
+    for blob_id in candidates:
+        if db.session.execute(
+            update(Blob).where(Blob.id == blob_id, Blob.text_status == 'queued')
+            .values(text_status='running', text_at=datetime.utcnow())
+        ).rowcount:
+            claimed.append(blob_id)
+    db.session.commit()
+    return claimed
+
+
+def run_batch(blob_ids):
+    """Extracts the claimed blobs in parallel and indexes their text. Returns how many succeeded."""
+    max_chars = current_app.config.get('CONTENT_MAX_CHARS', 200000)
+    sample_bytes = current_app.config.get('SIMILARITY_SAMPLE_BYTES', 1024 * 1024)
+    futures = {}
+    for blob in Blob.query.filter(Blob.id.in_(blob_ids)):
+        futures[process_pool().submit(read, blobs.blob_path(blob.sha256), max_chars, sample_bytes)] = blob
+
+    done = 0
+    for future in as_completed(futures):
+        blob = futures[future]
+        try:
+            text, signature = future.result()
+            # Scanned documents have no text layer; they are done, just not searchable
+            if text:
+                search.index_content(blob.id, text)
+            similarity.index(blob, signature)
+            blob.text_status = 'done'
+            done += 1
+        except BrokenProcessPool:
+            reset_process_pool()
+            blob.text_status = 'queued'
+        except Exception as e:
+            current_app.logger.warning(f"Text extraction of blob {blob.id} failed: {e}")
+            blob.text_status = 'failed'
+        blob.text_at = datetime.utcnow()
+    db.session.commit()
+    return done
+
+
+def requeue_stale():
+    """Queues extractions whose worker stopped. Returns the count."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_STALE_AFTER', 600))
+    count = db.session.execute(
+        update(Blob).where(Blob.text_status == 'running', Blob.text_at < cutoff)
+        .values(text_status='queued')
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def queue_missing():
+    """Queues every PDF/DOCX blob whose text was never extracted, for uploads made before content search."""
+    document_blobs = db.session.query(Note.blob_id).filter(
+        Note.material_type.in_(TEXT_TYPES), Note.blob_id.isnot(None))
+    return db.session.execute(
+        update(Blob).where(Blob.id.in_(document_blobs), Blob.text_status.is_(None))
+        .values(text_status='queued', text_at=datetime.utcnow())
+    ).rowcount
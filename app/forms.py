@@ -1,9 +1,11 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, SelectField, IntegerField
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, SelectField, IntegerField, HiddenField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional, NumberRange
 from flask_wtf.file import FileField, FileAllowed
 from app.models import User
 
+NOTE_FILE_EXTENSIONS = ['pdf', 'docx', 'pptx', 'ppt', 'mp4', 'mkv']
+
 class RegistrationForm(FlaskForm):
     role = SelectField('Role', choices=[('Student', 'Student'), ('Teacher', 'Teacher'), ('Admin', 'Admin')], validators=[DataRequired()])
     college = SelectField('College', coerce=int, validators=[Optional()]) # Used for Admin
@@ -77,6 +79,7 @@ class SuperAdminRegistrationForm(FlaskForm):
 
 class CSVUploadForm(FlaskForm):
     file = FileField('Upload Student Registry (CSV/Excel)', validators=[DataRequired(), FileAllowed(['csv', 'xlsx'], 'CSV or Excel only!')])
+    mode = SelectField('Mode', choices=[('append', 'Add new students'), ('sync', 'Sync full list (preview changes)')], default='append')
     submit = SubmitField('Upload')
 
 class LoginForm(FlaskForm):
@@ -140,7 +143,8 @@ class NoteUploadForm(FlaskForm):
         ('video', 'Video (MP4/MKV)'),
         ('url', 'External URL / Link')
     ], default='pdf', validators=[DataRequired()])
-    file = FileField('Upload File', validators=[Optional(), FileAllowed(['pdf', 'docx', 'pptx', 'ppt', 'mp4', 'mkv'], 'Allowed formats: PDF, DOCX, PPT, MP4, MKV')])
+    file = FileField('Upload File', validators=[Optional(), FileAllowed(NOTE_FILE_EXTENSIONS, 'Allowed formats: PDF, DOCX, PPT, MP4, MKV')])
+    upload_id = HiddenField() # Set by upload.js when the file went through /api/uploads instead
     file_url = StringField('External URL', validators=[Optional()])
     submit = SubmitField('Upload Study Material')
 
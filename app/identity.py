@@ -0,0 +1,103 @@
+"""Per-worker cache behind the Flask-Login user loader.
+
+current_user is a UserIdentity built from a cached (id, username, role, college,
+verification, last_active) tuple, so authorizing a request needs no query once the
+cache is warm. The Role table is read once per process. Anything else a page asks
+for (email, college, register_number, ...) falls through to the full User row.
+
+Routes that verify, delete or edit a user must call invalidate(user_id). Other
+workers pick the change up when their entry expires after USER_CACHE_TTL seconds.
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app
+from flask_login import UserMixin
+from app import db
+from app.models import Role, User
+
+RoleInfo = namedtuple('RoleInfo', 'id name')
+
+_roles = {}
+_lock = threading.Lock()
+_users = OrderedDict()  # user_id -> (loaded_at, row)
+
+IDENTITY_COLUMNS = (User.id, User.username, User.role_id, User.college_id, User.is_verified, User.last_active)
+
+
+def _load_roles():
+    # Roles are fixed at setup, so this only runs once per process (or for a brand new role)
+    for r_id, name in db.session.query(Role.id, Role.name):
+        _roles[r_id] = RoleInfo(r_id, name)
+
+
+def role_for(role_id):
+    if role_id not in _roles:
+        _load_roles()
+    return _roles.get(role_id)
+
+
+def role_id_for(name):
+    """Id of the role with this name, or None if there is no such role."""
+    by_name = {role.name: role.id for role in _roles.values()}
+    if name not in by_name:
+        _load_roles()
+        by_name = {role.name: role.id for role in _roles.values()}
+    return by_name.get(name)
+
+
+class UserIdentity(UserMixin):
+    def __init__(self, id, username, role_id, college_id, is_verified, last_active):
+        self.id = id
+        self.username = username
+        self.role_id = role_id
+        self.college_id = college_id
+        self.is_verified = is_verified
+        self.last_active = last_active
+
+    @property
+    def role(self):
+        return role_for(self.role_id)
+
+    @property
+    def user(self):
+        """The full User row, loaded on first use within the request."""
+        if '_user' not in self.__dict__:
+            self.__dict__['_user'] = db.session.get(User, self.id)
+        return self.__dict__['_user']
+
+    def __getattr__(self, name):
+        # Only reached for attributes the identity does not carry
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __repr__(self):
+        return f"UserIdentity('{self.username}')"
+
+
+def load_identity(user_id):
+    ttl = current_app.config.get('USER_CACHE_TTL', 60)
+    now = time.monotonic()
+    with _lock:
+        entry = _users.get(user_id)
+        if entry and now - entry[0] < ttl:
+            _users.move_to_end(user_id)
+            return UserIdentity(*entry[1])
+
+    row = db.session.query(*IDENTITY_COLUMNS).filter(User.id == user_id).first()
+    if row is None:
+        invalidate(user_id)
+        return None
+    row = tuple(row)
+    with _lock:
+        _users[user_id] = (now, row)
+        _users.move_to_end(user_id)
+        while len(_users) > current_app.config.get('USER_CACHE_SIZE', 2048):
+            _users.popitem(last=False)
+    return UserIdentity(*row)
+
+
+def invalidate(user_id):
+    with _lock:
+        _users.pop(user_id, None)
@@ -0,0 +1,62 @@
+"""Signed, expiring links to note files.
+
+Pages that list notes sign one link per file for the viewer. Each link carries the
+note id, the user, what it permits (view or download), the blob's content hash and an
+expiry, under an HMAC keyed by SECRET_KEY. notes.signed_file checks all of this in
+memory and streams the blob, so a download does not query the note, the user or the
+file's location. Expiries are rounded up to whole NOTE_LINK_TTL periods, which keeps
+a note's link the same across page loads (and cacheable by the browser) for a while.
+
+Files not in the blob store (legacy uploads, files served from the CDN) and expired
+or foreign links go to the note-id routes, which check access in the database.
+"""
+import base64
+import hashlib
+import hmac
+import time
+from flask import current_app, url_for
+
+
+def _signature(payload, filename):
+    key = current_app.secret_key.encode()
+    digest = hmac.new(key, f'{payload}/{filename}'.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def can_access(note, user):
+    # Unverified notes are only open to staff and their uploader
+    if not user.is_authenticated:
+        return note.is_verified
+    return note.is_verified or user.role.name != 'Student' or user.id == note.user_id
+
+
+def sign(note, user, permission):
+    """Returns a token for one note file, or None if the note cannot have a signed link
+    (anonymous viewers get the note-id routes, which send them to log in)."""
+    if not user.is_authenticated or not note.blob_id or note.file_url or not can_access(note, user):
+        return None
+    ttl = current_app.config.get('NOTE_LINK_TTL', 3600)
+    expires = (int(time.time()) // ttl + 2) * ttl
+    payload = f'{note.id}.{user.id}.{permission}.{note.blob.sha256}.{expires}'
+    return f'{payload}.{_signature(payload, note.filename)}'
+
+
+def verify(token, filename):
+    """Returns (note id, user id, permission, sha256, expired) of a token signed for this
+    filename, or None if it was not signed here."""
+    parts = token.split('.')
+    if len(parts) != 6:
+        return None
+    note_id, user_id, permission, sha256, expires, signature = parts
+    if not hmac.compare_digest(signature, _signature('.'.join(parts[:5]), filename)):
+        return None
+    return int(note_id), int(user_id), permission, sha256, int(expires) < time.time()
+
+
+def file_url(note, user, permission):
+    """The link a page should show for a note file: signed when possible."""
+    endpoint = 'notes.download_file' if permission == 'download' else 'notes.view_file'
+    token = sign(note, user, permission)
+    if token is None:
+        return url_for(endpoint, note_id=note.id, filename=note.filename)
+    return url_for('notes.signed_file', token=token, filename=note.filename)
@@ -5,7 +5,9 @@ from werkzeug.security import generate_password_hash, check_password_hash
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    # Served from a per-worker identity cache, see app/identity.py
+    from app.identity import load_identity
+    return load_identity(int(user_id))
 
 # --- Auth Models ---
 class Role(db.Model):
@@ -19,6 +21,8 @@ class Role(db.Model):
 class College(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
+    # Bumped on every syllabus change in this college; used as the /api/syllabus ETag
+    syllabus_version = db.Column(db.Integer, default=0, nullable=False, server_default='0')
     users = db.relationship('User', backref='college', lazy=True)
     student_registries = db.relationship('StudentRegistry', backref='college', lazy=True)
 
@@ -37,6 +41,26 @@ class StudentRegistry(db.Model):
     # but usually reg num is unique per university. Let's assume unique per college for safety.
     __table_args__ = (db.UniqueConstraint('register_number', 'college_id', name='_college_regnum_uc'),)
 
+class RegistryImport(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    college_id = db.Column(db.Integer, db.ForeignKey('college.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(200), nullable=False) # Name as uploaded
+    path = db.Column(db.String(300), nullable=False) # Saved copy, removed once the import is done
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, done, failed
+    rows_done = db.Column(db.Integer, nullable=False, default=0) # Data rows committed; a resume starts here
+    rows_total = db.Column(db.Integer, nullable=True) # Estimate, for progress only
+    inserted = db.Column(db.Integer, nullable=False, default=0)
+    duplicates = db.Column(db.Integer, nullable=False, default=0)
+    invalid = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Heartbeat while running
+
+    __table_args__ = (
+        db.Index('ix_registry_import_queue', 'status', 'created_at'),
+    )
+
 class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(120), unique=True, nullable=False)
@@ -83,27 +107,90 @@ class Semester(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     number = db.Column(db.Integer, nullable=False) # 1, 2, etc.
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    college_id = db.Column(db.Integer, db.ForeignKey('college.id'), nullable=True, index=True) # Owner, copied from course
     subjects = db.relationship('Subject', backref='semester', lazy=True, cascade="all, delete-orphan")
 
 class Subject(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     semester_id = db.Column(db.Integer, db.ForeignKey('semester.id'), nullable=False)
+    college_id = db.Column(db.Integer, db.ForeignKey('college.id'), nullable=True, index=True) # Owner, copied from semester
     units = db.relationship('Unit', backref='subject', lazy=True, cascade="all, delete-orphan")
 
 class Unit(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     number = db.Column(db.Integer, nullable=False) # 1, 2, etc.
     subject_id = db.Column(db.Integer, db.ForeignKey('subject.id'), nullable=False)
+    college_id = db.Column(db.Integer, db.ForeignKey('college.id'), nullable=True, index=True) # Owner, copied from subject
     topics = db.relationship('Topic', backref='unit', lazy=True, cascade="all, delete-orphan")
 
 class Topic(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     unit_id = db.Column(db.Integer, db.ForeignKey('unit.id'), nullable=False)
+    college_id = db.Column(db.Integer, db.ForeignKey('college.id'), nullable=True, index=True) # Owner, copied from unit
     notes = db.relationship('Note', backref='topic', lazy=True, cascade="all, delete-orphan")
 
 # --- Note Models ---
+class Blob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False) # Hex digest; the file lives at BLOB_STORE/ab/cdef...
+    size = db.Column(db.BigInteger, nullable=False)
+    refcount = db.Column(db.Integer, nullable=False, default=0) # Notes pointing at this content
+    cdn_url = db.Column(db.String(500), nullable=True) # Set once this content has been pushed to the CDN
+    preview_status = db.Column(db.String(20), nullable=True) # PDFs only: queued, running, done, failed
+    preview_pages = db.Column(db.Integer, nullable=True) # Page images rendered next to the file
+    preview_at = db.Column(db.DateTime, nullable=True) # Last preview status change, for stale claims
+    text_status = db.Column(db.String(20), nullable=True) # PDF/DOCX only: queued, running, done, failed
+    text_at = db.Column(db.DateTime, nullable=True) # Last text extraction status change
+    minhash = db.Column(db.LargeBinary, nullable=True) # MinHash signature for near-duplicate lookups (app/similarity.py)
+    sign_status = db.Column(db.String(20), nullable=True) # Non-documents only: byte signature queued, running, done, failed
+    sign_at = db.Column(db.DateTime, nullable=True) # Last signing status change
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_blob_preview', 'preview_status'),
+        db.Index('ix_blob_text', 'text_status'),
+        db.Index('ix_blob_sign', 'sign_status'),
+    )
+
+class LshBucket(db.Model):
+    # One row per band of a blob's MinHash; blobs sharing any (band, bucket) are near-duplicate candidates
+    band = db.Column(db.SmallInteger, primary_key=True)
+    bucket = db.Column(db.BigInteger, primary_key=True)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), primary_key=True, index=True)
+
+class CdnPush(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), unique=True, nullable=False)
+    material_type = db.Column(db.String(20), nullable=False) # Picks the CDN resource type
+    extension = db.Column(db.String(10), nullable=True) # Of the uploaded filename, kept on the CDN copy
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Retries back off
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_cdn_push_queue', 'status', 'next_attempt_at'),
+    )
+
+class ChunkedUpload(db.Model):
+    id = db.Column(db.String(32), primary_key=True) # Random hex token, also the temp file name
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    filename = db.Column(db.String(200), nullable=False) # secure_filename of the original
+    size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True) # Set by finalize once every chunk is in
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+class UploadChunk(db.Model):
+    # One row per received chunk; parallel PUTs each insert their own row, so nothing is overwritten
+    upload_id = db.Column(db.String(32), db.ForeignKey('chunked_upload.id'), primary_key=True)
+    index = db.Column(db.Integer, primary_key=True)
+
 class Note(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -115,8 +202,25 @@ class Note(db.Model):
     college_id = db.Column(db.Integer, db.ForeignKey('college.id'), nullable=False)
     upload_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     is_verified = db.Column(db.Boolean, default=False, nullable=False)
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), nullable=True) # Local file content, shared by identical uploads
+    blob = db.relationship('Blob', lazy=True)
     verification_status = db.relationship('VerificationStatus', uselist=False, backref='note', lazy=True)
 
+    # Denormalized syllabus path of topic_id so listing filters never join the hierarchy.
+    # Kept in step by app.syllabus when notes are created or syllabus items re-parented.
+    course_id = db.Column(db.Integer, nullable=True)
+    semester_id = db.Column(db.Integer, nullable=True)
+    semester_number = db.Column(db.Integer, nullable=True)
+    subject_id = db.Column(db.Integer, nullable=True)
+    unit_id = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_note_listing', 'college_id', 'is_verified', 'upload_date'),
+        db.Index('ix_note_course', 'college_id', 'is_verified', 'course_id', 'upload_date'),
+        db.Index('ix_note_semester', 'college_id', 'is_verified', 'semester_number', 'upload_date'),
+        db.Index('ix_note_subject', 'college_id', 'is_verified', 'subject_id', 'upload_date'),
+    )
+
 class VerificationStatus(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     note_id = db.Column(db.Integer, db.ForeignKey('note.id'), unique=True, nullable=False)
@@ -131,8 +235,41 @@ class ActivityLog(db.Model):
     action = db.Column(db.String(100), nullable=False) # e.g., 'Logged In', 'Uploaded Note'
     details = db.Column(db.Text, nullable=True) # Extra info like filename or IP (optional)
     timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # The actor's role and college when the event was written. No foreign keys, so the
+    # history survives role changes and college deletion; the log views filter on these alone.
+    role_id = db.Column(db.Integer, nullable=True)
+    college_id = db.Column(db.Integer, nullable=True)
     
     user = db.relationship('User', backref=db.backref('activity_logs', lazy=True))
 
+    __table_args__ = (
+        db.Index('ix_activity_log_scope', 'college_id', 'role_id', timestamp.desc(), id.desc()),
+        db.Index('ix_activity_log_role', 'role_id', timestamp.desc(), id.desc()),
+        db.Index('ix_activity_log_user', 'user_id', timestamp.desc(), id.desc()),
+    )
+
     def __repr__(self):
         return f"ActivityLog('{self.user.username}', '{self.action}', '{self.timestamp}')"
+
+class ExportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False) # Who asked; only they may download
+    export = db.Column(db.String(50), nullable=False) # Key into app.exports.EXPORTS
+    params = db.Column(db.Text, nullable=False, default='{}') # JSON keyword arguments for the export
+    format = db.Column(db.String(10), nullable=False, default='csv') # csv, csv.gz or xlsx
+    filename = db.Column(db.String(200), nullable=False) # Download name without extension
+    status = db.Column(db.String(20), nullable=False, default='queued') # queued, running, done, failed, expired
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    rows_total = db.Column(db.Integer, nullable=True)
+    artifact = db.Column(db.String(300), nullable=True) # File name inside EXPORT_FOLDER once done
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow) # Heartbeat while running
+    expires_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_export_job_queue', 'status', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"ExportJob({self.id}, '{self.export}', '{self.status}')"
@@ -0,0 +1,93 @@
+"""Write-behind buffer for User.last_active.
+
+Requests record presence in a per-process dict instead of committing. A daemon
+thread writes the buffered timestamps back in one batched UPDATE every
+PRESENCE_FLUSH_INTERVAL seconds, and a user is only buffered again once their
+timestamp is PRESENCE_THROTTLE seconds old. Both are far below the five minute
+window used by User.is_online, so its answers do not change.
+"""
+import atexit
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, update
+from app import db
+from app.models import User
+
+
+class PresenceBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}  # user_id -> last_active waiting to be written
+        self._recorded = {}  # user_id -> last_active this process has seen or queued
+        self._app = None
+        self._thread = None
+
+    def init_app(self, app):
+        if self._app is None:
+            atexit.register(self.flush)
+        self._app = app
+
+    def record(self, user_id, stored_last_active=None, now=None):
+        """Queues a presence update unless the user was marked active within the throttle window."""
+        now = now or datetime.utcnow()
+        throttle = timedelta(seconds=self._app.config.get('PRESENCE_THROTTLE', 60))
+        with self._lock:
+            latest = max(filter(None, [stored_last_active, self._recorded.get(user_id)]), default=None)
+            if latest and now - latest < throttle:
+                return False
+            self._pending[user_id] = now
+            self._recorded[user_id] = now
+
+        if self._app.config.get('PRESENCE_FLUSH_INTERVAL', 15) <= 0:
+            self.flush()
+        else:
+            self._ensure_thread()
+        return True
+
+    def flush(self):
+        """Writes every buffered timestamp in one batched UPDATE. Returns the number of users."""
+        if self._app is None:
+            return 0
+        throttle = timedelta(seconds=self._app.config.get('PRESENCE_THROTTLE', 60))
+        cutoff = datetime.utcnow() - throttle
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            # Entries past the throttle window no longer suppress anything
+            self._recorded = {uid: ts for uid, ts in self._recorded.items() if ts > cutoff}
+        if not pending:
+            return 0
+
+        user = User.__table__
+        stmt = update(user).where(user.c.id == bindparam('user_id')).values(last_active=bindparam('ts'))
+        rows = [{'user_id': user_id, 'ts': ts} for user_id, ts in pending.items()]
+        try:
+            with self._app.app_context():
+                with db.engine.begin() as conn:
+                    conn.execute(stmt, rows)
+        except Exception as e:
+            # Keep the newer of the failed and any freshly queued timestamps for the next round
+            with self._lock:
+                for user_id, ts in pending.items():
+                    self._pending[user_id] = max(ts, self._pending.get(user_id, ts))
+            print(f"Presence flush failed: {e}")
+            return 0
+        return len(rows)
+
+    def _ensure_thread(self):
+        # Started lazily so each forked worker gets its own flusher
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='presence-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self._app.config.get('PRESENCE_FLUSH_INTERVAL', 15))
+            self.flush()
+
+
+buffer = PresenceBuffer()
@@ -0,0 +1,115 @@
+"""Thumbnails and page previews for uploaded PDFs.
+
+upload_note only marks a new PDF blob as queued; nothing is rendered on the request
+path. bin/worker.py claims queued blobs a batch at a time and renders them in a
+process pool with PyMuPDF: a small first-page thumbnail for the listing and the
+first PREVIEW_PAGES pages as compressed JPEGs, written next to the blob file.
+Previews belong to the content hash, so identical uploads are rendered once.
+"""
+import os
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from app import blobs
+from app.models import Blob, Note
+from app.utils import process_pool, reset_process_pool
+
+THUMB_NAME = 'thumb.jpg'
+
+
+def page_name(number):
+    return f'page-{number}.jpg'
+
+
+def enqueue(blob, material_type):
+    """Queues a PDF blob that has never been rendered. The caller commits."""
+    if material_type == 'pdf' and blob.preview_status is None:
+        blob.preview_status = 'queued'
+        blob.preview_at = datetime.utcnow()
+
+
+def render(path, out_dir, pages, thumb_width, page_width, quality):
+    """Renders one PDF's images. Runs in a pool process, so it must not touch the app or database."""
+    import pymupdf
+
+    os.makedirs(out_dir, exist_ok=True)
+    with pymupdf.open(path) as doc:
+        count = min(pages, doc.page_count)
+        for index in range(count):
+            page = doc[index]
+            if index == 0:
+                scale = thumb_width / page.rect.width
+                page.get_pixmap(matrix=pymupdf.Matrix(scale, scale)).save(
+                    os.path.join(out_dir, THUMB_NAME), jpg_quality=quality)
+            scale = page_width / page.rect.width
+            page.get_pixmap(matrix=pymupdf.Matrix(scale, scale)).save(
+                os.path.join(out_dir, page_name(index + 1)), jpg_quality=quality)
+    return count
+
+
+def claim_batch():
+    """Marks up to one batch (two per pool process) of queued blobs as running and returns their ids."""
+    size = 2 * current_app.config.get('WORKER_PROCESSES', 2)
+    candidates = [blob_id for (blob_id,) in db.session.query(Blob.id).filter(
+        Blob.preview_status == 'queued').order_by(Blob.preview_at, Blob.id).limit(size)]
+    claimed = []
+    for blob_id in candidates:
+        if db.session.execute(
+            update(Blob).where(Blob.id == blob_id, Blob.preview_status == 'queued')
+            .values(preview_status='running', preview_at=datetime.utcnow())
+        ).rowcount:
+            claimed.append(blob_id)
+    db.session.commit()
+    return claimed
+
+
+def run_batch(blob_ids):
+    """Renders the claimed blobs in parallel. Returns how many succeeded."""
+    config = current_app.config
+    options = dict(pages=config.get('PREVIEW_PAGES', 3), thumb_width=config.get('PREVIEW_THUMB_WIDTH', 320),
+                   page_width=config.get('PREVIEW_PAGE_WIDTH', 900), quality=config.get('PREVIEW_JPEG_QUALITY', 70))
+    futures = {}
+    for blob in Blob.query.filter(Blob.id.in_(blob_ids)):
+        future = process_pool().submit(render, blobs.blob_path(blob.sha256), blobs.preview_dir(blob.sha256), **options)
+        futures[future] = blob
+
+    done = 0
+    for future in as_completed(futures):
+        blob = futures[future]
+        try:
+            blob.preview_pages = future.result()
+            blob.preview_status = 'done'
+            done += 1
+        except BrokenProcessPool:
+            # A crashed renderer takes the pool with it; the blob is retried with a fresh pool
+            reset_process_pool()
+            blob.preview_status = 'queued'
+        except Exception as e:
+            current_app.logger.warning(f"Preview of blob {blob.id} failed: {e}")
+            blob.preview_status = 'failed'
+        blob.preview_at = datetime.utcnow()
+    db.session.commit()
+    return done
+
+
+def requeue_stale():
+    """Queues renders whose worker stopped. Returns the count."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_STALE_AFTER', 600))
+    count = db.session.execute(
+        update(Blob).where(Blob.preview_status == 'running', Blob.preview_at < cutoff)
+        .values(preview_status='queued')
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def queue_missing():
+    """Queues every PDF blob that has no preview yet, for uploads made before previews existed."""
+    pdf_blobs = db.session.query(Note.blob_id).filter(Note.material_type == 'pdf', Note.blob_id.isnot(None))
+    return db.session.execute(
+        update(Blob).where(Blob.id.in_(pdf_blobs), Blob.preview_status.is_(None))
+        .values(preview_status='queued', preview_at=datetime.utcnow())
+    ).rowcount
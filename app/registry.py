@@ -0,0 +1,339 @@
+"""Bulk import of the student registry from uploaded CSV/XLSX files.
+
+Uploads are saved to disk and read in chunks of REGISTRY_CHUNK_SIZE rows
+(pd.read_csv(chunksize=...) for CSV, openpyxl read-only iteration for XLSX), so
+memory stays bounded whatever the file size. Each chunk is normalized with
+vectorized pandas operations, deduplicated, checked against the college's
+registry with chunked IN queries and bulk inserted, then committed together
+with the progress counters on its RegistryImport row. A failed import resumes
+from the last committed chunk.
+
+Small files are imported inside the upload request; larger ones are queued for
+bin/worker.py.
+
+Sync mode treats the upload as the college's full list instead: diff() merges it
+against the current registry in one outer join and sorts each register number into
+an insert, an email update or a removal; apply_sync() writes the whole diff in a
+handful of bulk statements.
+"""
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta
+import pandas as pd
+from flask import current_app, url_for
+from sqlalchemy import delete, update
+from app import db
+from app.models import RegistryImport, StudentRegistry
+
+REQUIRED_COLUMNS = ('Register Number', 'Email')
+EMAIL_PATTERN = r'^[^@\s]+@[^@\s]+\.[^@\s]+$'
+LOOKUP_CHUNK = 500  # Register numbers per IN list when looking up existing rows
+
+ImportResult = namedtuple('ImportResult', 'inserted duplicates invalid')
+SyncDiff = namedtuple('SyncDiff', 'inserts updates removals invalid duplicates')
+
+
+class RegistryFileError(ValueError):
+    """The upload cannot be imported at all (unreadable, or a required column is missing)."""
+
+
+def _check_columns(columns):
+    columns = [str(c).strip() for c in columns]
+    if any(c not in columns for c in REQUIRED_COLUMNS):
+        raise RegistryFileError('File must contain "Register Number" and "Email" columns.')
+    return columns
+
+
+def _is_csv(path):
+    return path.lower().endswith('.csv')
+
+
+def iter_chunks(path, chunk_size, skip=0):
+    """Yields the file as DataFrames of at most `chunk_size` text rows, after skipping `skip` data rows."""
+    if _is_csv(path):
+        # Skipped by parsed record, like rows_done counts them: blank lines and quoted
+        # newlines make physical lines (skiprows) drift from records
+        reader = pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_size)
+        for chunk in reader:
+            chunk.columns = _check_columns(chunk.columns)
+            if skip >= len(chunk):
+                skip -= len(chunk)
+                continue
+            if skip:
+                chunk = chunk.iloc[skip:]
+                skip = 0
+            yield chunk
+        return
+
+    from openpyxl import load_workbook
+
+    # Read-only mode parses rows lazily instead of loading the whole sheet
+    workbook = load_workbook(path, read_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = _check_columns(['' if c is None else c for c in next(rows, ())])
+        batch = []
+        for index, row in enumerate(rows):
+            if index < skip:
+                continue
+            batch.append(['' if value is None else str(value) for value in row[:len(header)]])
+            if len(batch) == chunk_size:
+                yield pd.DataFrame(batch, columns=header)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header)
+    finally:
+        workbook.close()
+
+
+def estimate_rows(path):
+    """Data rows in the file, for progress reporting. Quoted line breaks make CSV counts approximate."""
+    if _is_csv(path):
+        lines = 0
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                lines += block.count(b'\n')
+        return max(lines - 1, 0)
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        max_row = workbook.active.max_row
+    finally:
+        workbook.close()
+    return max(max_row - 1, 0) if max_row else None
+
+
+def normalize(df):
+    """Returns (frame of register_number/email, number of invalid rows dropped)."""
+    frame = pd.DataFrame({
+        'register_number': df['Register Number'].fillna('').astype(str).str.strip(),
+        'email': df['Email'].fillna('').astype(str).str.strip(),
+    })
+    valid = (frame['register_number'] != '') & frame['email'].str.match(EMAIL_PATTERN)
+    return frame[valid], int((~valid).sum())
+
+
+def dedupe(frame):
+    """Keeps the first row of each register number. Returns (frame, number of rows dropped)."""
+    unique = frame.drop_duplicates(subset='register_number', keep='first')
+    return unique, len(frame) - len(unique)
+
+
+def existing_register_numbers(college_id, register_numbers):
+    """The subset of `register_numbers` already in the college's registry."""
+    register_numbers = list(register_numbers)
+    found = set()
+    for start in range(0, len(register_numbers), LOOKUP_CHUNK):
+        chunk = register_numbers[start:start + LOOKUP_CHUNK]
+        found.update(r for (r,) in db.session.query(StudentRegistry.register_number).filter(
+            StudentRegistry.college_id == college_id,
+            StudentRegistry.register_number.in_(chunk)
+        ))
+    return found
+
+
+def import_frame(df, college_id):
+    """Inserts the new rows of one chunk. Rows already committed by earlier chunks count as
+    duplicates, so duplicates spanning chunks are caught too. The caller commits."""
+    frame, invalid = normalize(df)
+    frame, duplicates = dedupe(frame)
+    existing = existing_register_numbers(college_id, frame['register_number'])
+    new = frame[~frame['register_number'].isin(existing)]
+    if len(new):
+        records = new.assign(college_id=college_id, is_registered=False).to_dict('records')
+        db.session.execute(StudentRegistry.__table__.insert(), records)
+    return ImportResult(inserted=len(new), duplicates=duplicates + len(existing), invalid=invalid)
+
+
+def upload_folder():
+    folder = current_app.config.get('REGISTRY_UPLOAD_FOLDER') or os.path.join(current_app.instance_path, 'registry_imports')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def save_upload(file, filename):
+    """Saves an uploaded file under a random name and returns its path. Raises
+    RegistryFileError (and removes the file) if the header is missing a required column."""
+    extension = '.csv' if _is_csv(filename) else '.xlsx'
+    path = os.path.join(upload_folder(), f"{uuid.uuid4().hex}{extension}")
+    file.save(path)
+    try:
+        next(iter_chunks(path, 1), None)
+    except RegistryFileError:
+        os.remove(path)
+        raise
+    return path
+
+
+def create_import(file, filename, college_id, user_id):
+    """Saves an uploaded file and records an import for it. Raises RegistryFileError if the
+    header is missing a required column.
+
+    Files up to REGISTRY_INLINE_MAX_BYTES come back marked running, for the caller to run()
+    straight away; larger ones are queued for bin/worker.py.
+    """
+    path = save_upload(file, filename)
+    inline = os.path.getsize(path) <= current_app.config.get('REGISTRY_INLINE_MAX_BYTES', 5 * 1024 * 1024)
+    job = RegistryImport(college_id=college_id, user_id=user_id, filename=filename, path=path,
+                         rows_total=estimate_rows(path), status='running' if inline else 'queued')
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def run(job):
+    """Imports the file chunk by chunk from job.rows_done. Returns True once the whole file is in."""
+    chunk_size = current_app.config.get('REGISTRY_CHUNK_SIZE', 5000)
+    job.status = 'running'
+    job.error = None
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    try:
+        for chunk in iter_chunks(job.path, chunk_size, skip=job.rows_done):
+            result = import_frame(chunk, job.college_id)
+            # The counters move in the same transaction as the rows, so a resume never double counts
+            job.rows_done += len(chunk)
+            job.inserted += result.inserted
+            job.duplicates += result.duplicates
+            job.invalid += result.invalid
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        job.status = 'failed'
+        job.error = str(e)
+        job.updated_at = datetime.utcnow()
+        db.session.commit()
+        return False
+
+    job.status = 'done'
+    job.rows_total = job.rows_done
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    if os.path.exists(job.path):
+        os.remove(job.path)
+    return True
+
+
+def resume(job):
+    """Queues a failed import again; it continues after the last committed chunk."""
+    if job.status == 'failed':
+        job.status = 'queued'
+        db.session.commit()
+
+
+def status(job):
+    """What the progress endpoint reports for an import."""
+    return {
+        'id': job.id,
+        'filename': job.filename,
+        'status': job.status,
+        'rows_done': job.rows_done,
+        'rows_total': job.rows_total,
+        'progress': min(1.0, round(job.rows_done / job.rows_total, 3)) if job.rows_total else None,
+        'inserted': job.inserted,
+        'duplicates': job.duplicates,
+        'invalid': job.invalid,
+        'error': job.error,
+        'status_url': url_for('api.registry_import_status', import_id=job.id),
+    }
+
+
+def claim_next():
+    """Marks the oldest queued import as running and returns it, or None if there is none."""
+    while True:
+        job_id = db.session.query(RegistryImport.id).filter_by(status='queued').order_by(
+            RegistryImport.created_at, RegistryImport.id).limit(1).scalar()
+        if job_id is None:
+            return None
+        claimed = db.session.execute(
+            update(RegistryImport).where(RegistryImport.id == job_id, RegistryImport.status == 'queued')
+            .values(status='running', updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(RegistryImport, job_id)
+
+
+def requeue_stale():
+    """Queues running imports whose worker stopped reporting; they resume where they stopped."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_STALE_AFTER', 600))
+    count = db.session.execute(
+        update(RegistryImport).where(RegistryImport.status == 'running', RegistryImport.updated_at < cutoff)
+        .values(status='queued')
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def read_upload(path):
+    """The whole file normalized and deduplicated. Returns (frame, invalid rows, duplicate rows)."""
+    chunk_size = current_app.config.get('REGISTRY_CHUNK_SIZE', 5000)
+    frames, invalid = [], 0
+    for chunk in iter_chunks(path, chunk_size):
+        frame, dropped = normalize(chunk)
+        frames.append(frame)
+        invalid += dropped
+    if not frames:
+        return pd.DataFrame(columns=['register_number', 'email']), invalid, 0
+    frame, duplicates = dedupe(pd.concat(frames, ignore_index=True))
+    return frame, invalid, duplicates
+
+
+def current_registry(college_id):
+    """The college's registry as a frame of id/register_number/email/is_registered."""
+    rows = db.session.query(
+        StudentRegistry.id, StudentRegistry.register_number, StudentRegistry.email, StudentRegistry.is_registered
+    ).filter(StudentRegistry.college_id == college_id).all()
+    return pd.DataFrame(rows, columns=['id', 'register_number', 'email', 'is_registered'])
+
+
+def diff(path, college_id):
+    """Compares an uploaded full list with the college's registry. Nothing is written."""
+    uploaded, invalid, duplicates = read_upload(path)
+    current = current_registry(college_id)
+    merged = uploaded.merge(current, on='register_number', how='outer',
+                            suffixes=('', '_current'), indicator=True)
+
+    inserts = merged.loc[merged['_merge'] == 'left_only', ['register_number', 'email']]
+    both = merged[merged['_merge'] == 'both']
+    updates = both.loc[both['email'] != both['email_current'], ['id', 'register_number', 'email_current', 'email']]
+    removals = merged.loc[merged['_merge'] == 'right_only', ['id', 'register_number', 'email_current', 'is_registered']]
+    # The outer join leaves NaN in the unmatched rows, which turns ids into floats
+    updates = updates.astype({'id': 'int64'})
+    removals = removals.astype({'id': 'int64', 'is_registered': bool})
+    return SyncDiff(inserts=inserts, updates=updates, removals=removals, invalid=invalid, duplicates=duplicates)
+
+
+def preview(sync, limit=20):
+    """Counts and the first `limit` rows of each change, for the dry-run page."""
+    return {
+        'inserts': len(sync.inserts),
+        'updates': len(sync.updates),
+        'removals': len(sync.removals),
+        'registered_removals': int(sync.removals['is_registered'].sum()),
+        'invalid': sync.invalid,
+        'duplicates': sync.duplicates,
+        'insert_rows': sync.inserts.head(limit).to_dict('records'),
+        'update_rows': sync.updates.head(limit).to_dict('records'),
+        'removal_rows': sync.removals.head(limit).to_dict('records'),
+    }
+
+
+def apply_sync(sync, college_id):
+    """Writes a diff with one executemany per kind of change. The caller commits."""
+    if len(sync.inserts):
+        records = sync.inserts.assign(college_id=college_id, is_registered=False).to_dict('records')
+        db.session.execute(StudentRegistry.__table__.insert(), records)
+    if len(sync.updates):
+        # A list of parameter sets makes this an ORM bulk UPDATE by primary key
+        db.session.execute(update(StudentRegistry), sync.updates[['id', 'email']].to_dict('records'))
+    ids = sync.removals['id'].tolist()
+    for start in range(0, len(ids), LOOKUP_CHUNK):
+        db.session.execute(delete(StudentRegistry).where(
+            StudentRegistry.college_id == college_id,
+            StudentRegistry.id.in_(ids[start:start + LOOKUP_CHUNK])
+        ))
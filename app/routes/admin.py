@@ -1,11 +1,15 @@
-from flask import render_template, url_for, flash, redirect, request, Blueprint, make_response
+from flask import render_template, url_for, flash, redirect, request, Blueprint, make_response, session
 from flask_login import login_required, current_user
 from app import db
-from app.models import Course, Semester, Subject, Unit, Topic, Role, StudentRegistry, User
+from app.models import Course, Semester, Subject, Unit, Topic, Role, StudentRegistry, User, RegistryImport
 from app.forms import CourseForm, SemesterForm, SubjectForm, UnitForm, TopicForm, CSVUploadForm
 from app.decorators import admin_required, role_required
-from app.utils import log_activity
-import pandas as pd
+from app.utils import log_activity, csv_response
+from app import syllabus
+from app import identity
+from app import activity
+from app import exports
+from app import registry
 from werkzeug.utils import secure_filename
 import os
 
@@ -89,6 +93,7 @@ def verify_teacher(user_id, action):
         flash(f'Teacher {username} rejected.', 'danger')
     
     db.session.commit()
+    identity.invalidate(user_id)
     return redirect(url_for('admin.dashboard'))
 
 @admin.route('/admin/delete_teacher/<int:user_id>', methods=['POST'])
@@ -105,6 +110,7 @@ def delete_teacher(user_id):
     log_activity('Delete Teacher', f'Deleted teacher {username}')
     db.session.delete(user)
     db.session.commit()
+    identity.invalidate(user_id)
     flash(f'Teacher {username} deleted.', 'success')
     return redirect(url_for('admin.dashboard'))
 
@@ -112,13 +118,9 @@ def delete_teacher(user_id):
 @login_required
 @role_required('Admin')
 def view_logs():
-    # Filter logs for 'Teacher' role users in THIS college
-    from app.models import ActivityLog
-    logs = ActivityLog.query.join(User).join(Role).filter(
-        Role.name == 'Teacher',
-        User.college_id == current_user.college_id
-    ).order_by(ActivityLog.timestamp.desc()).all()
-    return render_template('admin/logs.html', logs=logs, title='Teacher Activity Logs')
+    # Logs of 'Teacher' role users in THIS college, one page at a time
+    context = activity.log_view('Teacher', current_user.college_id, 'admin.view_logs')
+    return render_template('admin/logs.html', title='Teacher Activity Logs', **context)
 
 @admin.route('/admin/manage/course', methods=['GET', 'POST'])
 @login_required
@@ -128,6 +130,7 @@ def manage_course():
     if form.validate_on_submit():
         course = Course(name=form.name.data, college_id=current_user.college_id)
         db.session.add(course)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Add Course', f'Added course {course.name}')
         flash('Course Added!', 'success')
@@ -143,8 +146,9 @@ def manage_semester():
     form = SemesterForm()
     form.course.choices = [(c.id, c.name) for c in Course.query.filter_by(college_id=current_user.college_id).all()]
     if form.validate_on_submit():
-        semester = Semester(number=form.number.data, course_id=form.course.data)
+        semester = Semester(number=form.number.data, course_id=form.course.data, college_id=current_user.college_id)
         db.session.add(semester)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Add Semester', f'Added Semester {semester.number} for course {semester.course.name}')
         flash('Semester Added!', 'success')
@@ -161,8 +165,9 @@ def manage_subject():
     # Chain selection: only semesters belonging to courses in this college
     form.semester.choices = [(s.id, f"{s.course.name} - Semester {s.number}") for s in Semester.query.join(Course).filter(Course.college_id == current_user.college_id).all()]
     if form.validate_on_submit():
-        subject = Subject(name=form.name.data, semester_id=form.semester.data)
+        subject = Subject(name=form.name.data, semester_id=form.semester.data, college_id=current_user.college_id)
         db.session.add(subject)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Add Subject', f'Added Subject {subject.name} to Semester {subject.semester.number}')
         flash('Subject Added!', 'success')
@@ -178,9 +183,13 @@ def manage_subject():
 @role_required('Admin', 'Teacher')
 def edit_course(course_id):
     course = Course.query.get_or_404(course_id)
+    if not syllabus.is_owned(course):
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
     form = CourseForm(obj=course)
     if form.validate_on_submit():
         course.name = form.name.data
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Edit Course', f'Updated course name to {course.name}')
         flash('Course Updated!', 'success')
@@ -192,8 +201,12 @@ def edit_course(course_id):
 @role_required('Admin', 'Teacher')
 def delete_course(course_id):
     course = Course.query.get_or_404(course_id)
+    if not syllabus.is_owned(course):
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
     course_name = course.name
     db.session.delete(course)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     log_activity('Delete Course', f'Deleted course {course_name}')
     flash(f'Course "{course_name}" Deleted!', 'success')
@@ -204,7 +217,7 @@ def delete_course(course_id):
 @role_required('Admin', 'Teacher')
 def edit_semester(sem_id):
     sem = Semester.query.get_or_404(sem_id)
-    if sem.course.college_id != current_user.college_id:
+    if not syllabus.is_owned(sem):
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('admin.dashboard'))
     form = SemesterForm(obj=sem)
@@ -212,6 +225,8 @@ def edit_semester(sem_id):
     if form.validate_on_submit():
         sem.number = form.number.data
         sem.course_id = form.course.data
+        syllabus.refresh_note_paths(Semester, sem.id)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Edit Semester', f'Updated Semester {sem.number} for course {sem.course.name}')
         flash('Semester Updated!', 'success')
@@ -224,9 +239,13 @@ def edit_semester(sem_id):
 @role_required('Admin', 'Teacher')
 def delete_semester(sem_id):
     sem = Semester.query.get_or_404(sem_id)
+    if not syllabus.is_owned(sem):
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
     sem_num = sem.number
     course_name = sem.course.name
     db.session.delete(sem)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     log_activity('Delete Semester', f'Deleted Semester {sem_num} for course {course_name}')
     flash(f'Semester {sem_num} Deleted!', 'success')
@@ -237,7 +256,7 @@ def delete_semester(sem_id):
 @role_required('Admin', 'Teacher')
 def edit_subject(sub_id):
     sub = Subject.query.get_or_404(sub_id)
-    if sub.semester.course.college_id != current_user.college_id:
+    if not syllabus.is_owned(sub):
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('admin.dashboard'))
     form = SubjectForm(obj=sub)
@@ -245,6 +264,8 @@ def edit_subject(sub_id):
     if form.validate_on_submit():
         sub.name = form.name.data
         sub.semester_id = form.semester.data
+        syllabus.refresh_note_paths(Subject, sub.id)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Edit Subject', f'Updated Subject {sub.name}')
         flash('Subject Updated!', 'success')
@@ -257,8 +278,12 @@ def edit_subject(sub_id):
 @role_required('Admin', 'Teacher')
 def delete_subject(sub_id):
     sub = Subject.query.get_or_404(sub_id)
+    if not syllabus.is_owned(sub):
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
     sub_name = sub.name
     db.session.delete(sub)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     log_activity('Delete Subject', f'Deleted Subject {sub_name}')
     flash(f'Subject "{sub_name}" Deleted!', 'success')
@@ -271,8 +296,9 @@ def manage_unit():
     form = UnitForm()
     form.subject.choices = [(s.id, s.name) for s in Subject.query.join(Semester).join(Course).filter(Course.college_id == current_user.college_id).all()]
     if form.validate_on_submit():
-        unit = Unit(number=form.number.data, subject_id=form.subject.data)
+        unit = Unit(number=form.number.data, subject_id=form.subject.data, college_id=current_user.college_id)
         db.session.add(unit)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Add Unit', f'Added Unit {unit.number} to {unit.subject.name}')
         flash('Unit Added!', 'success')
@@ -292,8 +318,9 @@ def manage_topic():
     form = TopicForm()
     form.unit.choices = [(u.id, f"{u.subject.name} - Unit {u.number}") for u in Unit.query.join(Subject).join(Semester).join(Course).filter(Course.college_id == current_user.college_id).all()]
     if form.validate_on_submit():
-        topic = Topic(name=form.name.data, unit_id=form.unit.data)
+        topic = Topic(name=form.name.data, unit_id=form.unit.data, college_id=current_user.college_id)
         db.session.add(topic)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Add Topic', f'Added Topic {topic.name} to Unit {topic.unit.number}')
         flash('Topic Added!', 'success')
@@ -310,7 +337,7 @@ def manage_topic():
 @role_required('Admin', 'Teacher')
 def edit_unit(unit_id):
     unit = Unit.query.get_or_404(unit_id)
-    if unit.subject.semester.course.college_id != current_user.college_id:
+    if not syllabus.is_owned(unit):
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('admin.dashboard'))
     form = UnitForm(obj=unit)
@@ -318,6 +345,8 @@ def edit_unit(unit_id):
     if form.validate_on_submit():
         unit.number = form.number.data
         unit.subject_id = form.subject.data
+        syllabus.refresh_note_paths(Unit, unit.id)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Edit Unit', f'Updated Unit {unit.number} in {unit.subject.name}')
         flash('Unit Updated!', 'success')
@@ -330,9 +359,13 @@ def edit_unit(unit_id):
 @role_required('Admin', 'Teacher')
 def delete_unit(unit_id):
     unit = Unit.query.get_or_404(unit_id)
+    if not syllabus.is_owned(unit):
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
     unit_num = unit.number
     sub_name = unit.subject.name
     db.session.delete(unit)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     log_activity('Delete Unit', f'Deleted Unit {unit_num} from {sub_name}')
     flash(f'Unit {unit_num} Deleted!', 'success')
@@ -343,7 +376,7 @@ def delete_unit(unit_id):
 @role_required('Admin', 'Teacher')
 def edit_topic(topic_id):
     topic = Topic.query.get_or_404(topic_id)
-    if topic.unit.subject.semester.course.college_id != current_user.college_id:
+    if not syllabus.is_owned(topic):
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('admin.dashboard'))
     form = TopicForm(obj=topic)
@@ -351,6 +384,8 @@ def edit_topic(topic_id):
     if form.validate_on_submit():
         topic.name = form.name.data
         topic.unit_id = form.unit.data
+        syllabus.refresh_note_paths(Topic, topic.id)
+        syllabus.touch(current_user.college_id)
         db.session.commit()
         log_activity('Edit Topic', f'Updated Topic {topic.name} in Unit {topic.unit.number}')
         flash('Topic Updated!', 'success')
@@ -363,9 +398,13 @@ def edit_topic(topic_id):
 @role_required('Admin', 'Teacher')
 def delete_topic(topic_id):
     topic = Topic.query.get_or_404(topic_id)
+    if not syllabus.is_owned(topic):
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
     topic_name = topic.name
     unit_num = topic.unit.number
     db.session.delete(topic)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     log_activity('Delete Topic', f'Deleted Topic {topic_name} from Unit {unit_num}')
     flash(f'Topic "{topic_name}" Deleted!', 'success')
@@ -379,115 +418,147 @@ def upload_student_data():
     if form.validate_on_submit():
         file = form.file.data
         filename = secure_filename(file.filename)
-        # Determine strict parsing based on extension
+        if form.mode.data == 'sync':
+            return _start_registry_sync(file, filename)
         try:
-            if filename.endswith('.csv'):
-                df = pd.read_csv(file)
-            else:
-                df = pd.read_excel(file)
-            
             # Expected columns: Register Number, Email
-            # Normalize Headers
-            df.columns = [c.strip() for c in df.columns]
-            
-            if 'Register Number' not in df.columns or 'Email' not in df.columns:
-                flash('File must contain "Register Number" and "Email" columns.', 'danger')
-                return redirect(url_for('admin.upload_student_data'))
-            
-            count = 0
-            for index, row in df.iterrows():
-                reg_num = str(row['Register Number']).strip()
-                email = str(row['Email']).strip()
-                
-                # Check for duplications in this college
-                exists = StudentRegistry.query.filter_by(register_number=reg_num, college_id=current_user.college_id).first()
-                if not exists:
-                    registry = StudentRegistry(register_number=reg_num, email=email, college_id=current_user.college_id)
-                    db.session.add(registry)
-                    count += 1
-            
-            db.session.commit()
-            log_activity('Upload Registry', f'Uploaded {count} student records via {filename}')
-            flash(f'Successfully uploaded {count} student records.', 'success')
-            return redirect(url_for('admin.dashboard'))
-            
+            job = registry.create_import(file, filename, current_user.college_id, current_user.id)
+        except registry.RegistryFileError as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('admin.upload_student_data'))
         except Exception as e:
+            db.session.rollback()
             flash(f'Error processing file: {str(e)}', 'danger')
             return redirect(url_for('admin.upload_student_data'))
+        
+        if job.status == 'queued':
+            log_activity('Upload Registry', f'Queued registry import of {filename}')
+            flash('Large file queued for import.', 'info')
+            return redirect(url_for('admin.registry_import', import_id=job.id))
+        
+        if not registry.run(job):
+            flash(f'Error processing file: {job.error}', 'danger')
+            return redirect(url_for('admin.registry_import', import_id=job.id))
+        log_activity('Upload Registry', f'Uploaded {job.inserted} student records via {filename}')
+        flash(f'Successfully uploaded {job.inserted} student records '
+              f'({job.duplicates} duplicates skipped, {job.invalid} invalid rows).', 'success')
+        return redirect(url_for('admin.dashboard'))
 
     return render_template('admin/upload_registry.html', form=form)
 
+def _pending_sync_path():
+    pending = session.get('registry_sync')
+    if not pending:
+        return None, None
+    path = os.path.join(registry.upload_folder(), os.path.basename(pending['file']))
+    return (path, pending['filename']) if os.path.exists(path) else (None, None)
+
+def _start_registry_sync(file, filename):
+    # Only one pending sync per session; a new upload replaces the last preview
+    previous, _ = _pending_sync_path()
+    if previous:
+        os.remove(previous)
+    try:
+        path = registry.save_upload(file, filename)
+    except registry.RegistryFileError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('admin.upload_student_data'))
+    session['registry_sync'] = {'file': os.path.basename(path), 'filename': filename}
+    return redirect(url_for('admin.sync_registry'))
+
+@admin.route('/admin/upload_registry/sync', methods=['GET', 'POST'])
+@login_required
+@role_required('Admin')
+def sync_registry():
+    path, filename = _pending_sync_path()
+    if path is None:
+        flash('No registry sync pending. Upload the full student list first.', 'info')
+        return redirect(url_for('admin.upload_student_data'))
+
+    # The diff is recomputed on apply, so changes made since the preview are not clobbered
+    try:
+        sync = registry.diff(path, current_user.college_id)
+    except Exception as e:
+        flash(f'Error processing file: {str(e)}', 'danger')
+        return redirect(url_for('admin.upload_student_data'))
+
+    if request.method == 'GET':
+        return render_template('admin/registry_sync.html', filename=filename, preview=registry.preview(sync))
+
+    if request.form.get('action') == 'cancel':
+        flash('Registry sync cancelled.', 'info')
+    else:
+        try:
+            registry.apply_sync(sync, current_user.college_id)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error applying sync: {str(e)}', 'danger')
+            return redirect(url_for('admin.sync_registry'))
+        summary = f'{len(sync.inserts)} added, {len(sync.updates)} emails updated, {len(sync.removals)} removed'
+        log_activity('Sync Registry', f'Synced registry from {filename}: {summary}')
+        flash(f'Registry synced: {summary}.', 'success')
+    session.pop('registry_sync', None)
+    os.remove(path)
+    return redirect(url_for('admin.dashboard'))
+
+@admin.route('/admin/upload_registry/<int:import_id>')
+@login_required
+@role_required('Admin')
+def registry_import(import_id):
+    job = RegistryImport.query.get_or_404(import_id)
+    if job.college_id != current_user.college_id:
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
+    return render_template('admin/registry_import.html', job=registry.status(job))
+
+@admin.route('/admin/upload_registry/<int:import_id>/resume', methods=['POST'])
+@login_required
+@role_required('Admin')
+def resume_registry_import(import_id):
+    job = RegistryImport.query.get_or_404(import_id)
+    if job.college_id != current_user.college_id:
+        flash('Unauthorized access.', 'danger')
+        return redirect(url_for('admin.dashboard'))
+    registry.resume(job)
+    flash(f'Import resumed from row {job.rows_done + 1}.', 'info')
+    return redirect(url_for('admin.registry_import', import_id=job.id))
+
 @admin.route('/admin/report/<int:user_id>')
 @login_required
 @role_required('Admin')
 def user_report(user_id):
-    import io
-    import csv
-    from app.models import ActivityLog
-    
     user = User.query.get_or_404(user_id)
     # Security: Admin can only see reports of teachers in their college
     if user.college_id != current_user.college_id or user.role.name != 'Teacher':
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('admin.dashboard'))
     
-    logs = ActivityLog.query.filter_by(user_id=user.id).order_by(ActivityLog.timestamp.desc()).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Activity Report'])
-    writer.writerow(['Username', user.username])
-    writer.writerow(['Email', user.email])
-    writer.writerow(['Role', user.role.name])
-    writer.writerow([])
-    writer.writerow(['Timestamp', 'Action', 'Details'])
-    
-    for log in logs:
-        writer.writerow([log.timestamp.strftime('%Y-%m-%d %H:%M:%S'), log.action, log.details or ''])
+    header = [['Activity Report'], ['Username', user.username], ['Email', user.email], ['Role', user.role.name], []]
     
-    output.seek(0)
-    
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename=activity_report_{user.username}.csv'
-    response.headers['Content-Type'] = 'text/csv'
+    def rows():
+        yield from header
+        yield ['Timestamp', 'Action', 'Details']
+        for timestamp, action, details in activity.user_export_rows(user.id):
+            yield [timestamp.strftime('%Y-%m-%d %H:%M:%S'), action, details or '']
     
     log_activity('Generate Report', f'Generated activity report for teacher {user.username}')
-    return response
+    return csv_response(rows(), f'activity_report_{user.username}.csv')
 
-@admin.route('/admin/download_logs/<role_name>')
+@admin.route('/admin/download_logs/<role_name>', methods=['GET', 'POST'])
 @login_required
 @role_required('Admin')
 def download_logs(role_name):
-    import io
-    import csv
-    from app.models import ActivityLog
-    
     if role_name not in ['Teacher', 'Student']:
         flash('Invalid role specified.', 'danger')
         return redirect(url_for('admin.dashboard'))
-        
-    logs = ActivityLog.query.join(User).join(Role).filter(
-        Role.name == role_name,
-        User.college_id == current_user.college_id
-    ).order_by(ActivityLog.timestamp.desc()).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Timestamp', 'User', 'Email', 'Action', 'Details'])
-    
-    for log in logs:
-        writer.writerow([
-            log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            log.user.username,
-            log.user.email,
-            log.action,
-            log.details or ''
-        ])
     
-    output.seek(0)
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename={role_name.lower()}_activity_logs.csv'
-    response.headers['Content-Type'] = 'text/csv'
+    if request.method == 'POST':
+        # Queued for bin/worker.py instead of holding this worker for the whole export
+        log_activity('Download Bulk Logs', f'Queued bulk activity log export for {role_name}s')
+        return exports.enqueue_request('activity_logs', f'{role_name.lower()}_activity_logs',
+                                       role_name=role_name, college_id=current_user.college_id)
     
+    rows = activity.log_export_lines(role_name, current_user.college_id)
     log_activity('Download Bulk Logs', f'Downloaded bulk activity logs for {role_name}s')
-    return response
+    return csv_response(rows, f'{role_name.lower()}_activity_logs.csv')
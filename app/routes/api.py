@@ -1,12 +1,125 @@
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, make_response, send_file
 from flask_login import login_required, current_user
 from app import db
-from app.models import Course, Semester, Subject, Unit, Topic
+from app.models import Course, Semester, Subject, Unit, Topic, ExportJob, RegistryImport, ChunkedUpload
 from app.decorators import role_required
+from app import syllabus
+from app import activity
+from app import exports
+from app import registry
+from app import uploads
 
 api = Blueprint('api', __name__)
 
 # Fetch Operations
+@api.route('/api/logs')
+@login_required
+@role_required('Admin', 'Teacher', 'Super Admin')
+def get_logs():
+    # Infinite scroll feed behind the log pages; same filters and cursor as the HTML views
+    role_name, own_college = activity.LOG_AUDIENCES[current_user.role.name]
+    college_id = current_user.college_id if own_college else None
+    logs, next_cursor = activity.log_page(
+        role_name, college_id, activity.parse_log_filters(request.args),
+        cursor=request.args.get('cursor'),
+        per_page=request.args.get('per_page', activity.LOG_PAGE_SIZE, type=int)
+    )
+    for log in logs:
+        log['timestamp'] = log['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
+    return jsonify({'logs': logs, 'next_cursor': next_cursor})
+
+@api.route('/api/exports/<int:job_id>')
+@login_required
+def export_status(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(exports.status(job))
+
+@api.route('/api/registry_imports/<int:import_id>')
+@login_required
+@role_required('Admin')
+def registry_import_status(import_id):
+    job = db.session.get(RegistryImport, import_id)
+    if job is None or job.college_id != current_user.college_id:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(registry.status(job))
+
+@api.route('/api/exports/<int:job_id>/download')
+@login_required
+def download_export(job_id):
+    job = db.session.get(ExportJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        return jsonify({'error': 'Not found'}), 404
+    if job.status != 'done':
+        return jsonify(exports.status(job)), 409
+    return send_file(exports.artifact_path(job), mimetype=exports.FORMATS[job.format],
+                     as_attachment=True, download_name=f'{job.filename}.{job.format}')
+
+# Resumable uploads: open, PUT chunks, finalize; the note form then submits the upload id
+def _own_upload(upload_id):
+    upload = db.session.get(ChunkedUpload, upload_id)
+    if upload is None or upload.user_id != current_user.id:
+        return None
+    return upload
+
+@api.route('/api/uploads', methods=['POST'])
+@login_required
+@role_required('Teacher', 'Senior Student', 'Admin')
+def create_upload():
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = uploads.create(current_user.id, data.get('filename'), data.get('size'))
+    except uploads.UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(uploads.status(upload)), 201
+
+@api.route('/api/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    upload = _own_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Not found'}), 404
+    return jsonify(uploads.status(upload))
+
+@api.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def put_upload_chunk(upload_id):
+    upload = _own_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        index = uploads.write_chunk(upload, request.headers.get('Content-Range'), request.stream)
+    except uploads.UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'index': index}), 200
+
+@api.route('/api/uploads/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    upload = _own_upload(upload_id)
+    if upload is None:
+        return jsonify({'error': 'Not found'}), 404
+    try:
+        uploads.finalize(upload)
+    except uploads.UploadError as e:
+        return jsonify({'error': str(e), **uploads.status(upload)}), 409
+    return jsonify(uploads.status(upload))
+
+@api.route('/api/syllabus')
+@login_required
+def get_syllabus():
+    # The version only moves when the college's syllabus changes, so browsers can
+    # revalidate with If-None-Match and skip the tree query entirely
+    etag = f"syllabus-{current_user.college_id}-{syllabus.version(current_user.college_id)}"
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = jsonify(syllabus.tree(current_user.college_id))
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
 @api.route('/api/courses')
 @login_required
 def get_courses():
@@ -17,7 +130,7 @@ def get_courses():
 @login_required
 def get_semesters(course_id):
     course = Course.query.get_or_404(course_id)
-    if course.college_id != current_user.college_id:
+    if not syllabus.is_owned(course):
         return jsonify({'error': 'Unauthorized'}), 403
     semesters = Semester.query.filter_by(course_id=course_id).all()
     return jsonify([{'id': s.id, 'name': f"Semester {s.number}"} for s in semesters])
@@ -26,7 +139,7 @@ def get_semesters(course_id):
 @login_required
 def get_subjects(semester_id):
     sem = Semester.query.get_or_404(semester_id)
-    if sem.course.college_id != current_user.college_id:
+    if not syllabus.is_owned(sem):
         return jsonify({'error': 'Unauthorized'}), 403
     subjects = Subject.query.filter_by(semester_id=semester_id).all()
     return jsonify([{'id': s.id, 'name': s.name} for s in subjects])
@@ -35,7 +148,7 @@ def get_subjects(semester_id):
 @login_required
 def get_units(subject_id):
     sub = Subject.query.get_or_404(subject_id)
-    if sub.semester.course.college_id != current_user.college_id:
+    if not syllabus.is_owned(sub):
         return jsonify({'error': 'Unauthorized'}), 403
     units = Unit.query.filter_by(subject_id=subject_id).all()
     return jsonify([{'id': u.id, 'name': f"Unit {u.number}"} for u in units])
@@ -44,7 +157,7 @@ def get_units(subject_id):
 @login_required
 def get_topics(unit_id):
     unit = Unit.query.get_or_404(unit_id)
-    if unit.subject.semester.course.college_id != current_user.college_id:
+    if not syllabus.is_owned(unit):
         return jsonify({'error': 'Unauthorized'}), 403
     topics = Topic.query.filter_by(unit_id=unit_id).all()
     return jsonify([{'id': t.id, 'name': t.name} for t in topics])
@@ -59,6 +172,7 @@ def create_course():
         return jsonify({'error': 'Name is required'}), 400
     course = Course(name=data['name'], college_id=current_user.college_id)
     db.session.add(course)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     return jsonify({'id': course.id, 'name': course.name, 'message': 'Course created!'})
 
@@ -69,8 +183,11 @@ def create_semester():
     data = request.get_json()
     if not data or 'number' not in data or 'course_id' not in data:
         return jsonify({'error': 'Missing required fields'}), 400
-    semester = Semester(number=data['number'], course_id=data['course_id'])
+    if syllabus.college_of(Course, data['course_id']) != current_user.college_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    semester = Semester(number=data['number'], course_id=data['course_id'], college_id=current_user.college_id)
     db.session.add(semester)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     return jsonify({'id': semester.id, 'name': f"Semester {semester.number}", 'message': 'Semester created!'})
 
@@ -81,8 +198,11 @@ def create_subject():
     data = request.get_json()
     if not data or 'name' not in data or 'semester_id' not in data:
         return jsonify({'error': 'Missing required fields'}), 400
-    subject = Subject(name=data['name'], semester_id=data['semester_id'])
+    if syllabus.college_of(Semester, data['semester_id']) != current_user.college_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    subject = Subject(name=data['name'], semester_id=data['semester_id'], college_id=current_user.college_id)
     db.session.add(subject)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     return jsonify({'id': subject.id, 'name': subject.name, 'message': 'Subject created!'})
 
@@ -93,8 +213,11 @@ def create_unit():
     data = request.get_json()
     if not data or 'number' not in data or 'subject_id' not in data:
         return jsonify({'error': 'Missing required fields'}), 400
-    unit = Unit(number=data['number'], subject_id=data['subject_id'])
+    if syllabus.college_of(Subject, data['subject_id']) != current_user.college_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    unit = Unit(number=data['number'], subject_id=data['subject_id'], college_id=current_user.college_id)
     db.session.add(unit)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     return jsonify({'id': unit.id, 'name': f"Unit {unit.number}", 'message': 'Unit created!'})
 
@@ -105,7 +228,10 @@ def create_topic():
     data = request.get_json()
     if not data or 'name' not in data or 'unit_id' not in data:
         return jsonify({'error': 'Missing required fields'}), 400
-    topic = Topic(name=data['name'], unit_id=data['unit_id'])
+    if syllabus.college_of(Unit, data['unit_id']) != current_user.college_id:
+        return jsonify({'error': 'Unauthorized'}), 403
+    topic = Topic(name=data['name'], unit_id=data['unit_id'], college_id=current_user.college_id)
     db.session.add(topic)
+    syllabus.touch(current_user.college_id)
     db.session.commit()
     return jsonify({'id': topic.id, 'name': topic.name, 'message': 'Topic created!'})
@@ -8,13 +8,10 @@ main = Blueprint('main', __name__)
 @login_required
 @role_required('Teacher')
 def view_student_logs():
-    # Filter logs for 'Student' role users in THIS college
-    from app.models import ActivityLog, User, Role
-    logs = ActivityLog.query.join(User).join(Role).filter(
-        Role.name == 'Student',
-        User.college_id == current_user.college_id
-    ).order_by(ActivityLog.timestamp.desc()).all()
-    return render_template('teacher/logs.html', logs=logs, title='Student Activity Logs')
+    # Logs of 'Student' role users in THIS college, one page at a time
+    from app import activity
+    context = activity.log_view('Student', current_user.college_id, 'main.view_student_logs')
+    return render_template('teacher/logs.html', title='Student Activity Logs', **context)
 
 @main.route('/')
 def index():
@@ -63,10 +60,9 @@ def teacher_dashboard():
 @login_required
 @role_required('Teacher', 'Admin')
 def student_report(user_id):
-    import io
-    import csv
-    from flask import make_response
-    from app.models import ActivityLog, User
+    from app import activity
+    from app.models import User
+    from app.utils import csv_response, log_activity
     
     user = User.query.get_or_404(user_id)
     # Security: Teacher can only see reports of students in their college
@@ -75,62 +71,32 @@ def student_report(user_id):
         flash('Unauthorized access.', 'danger')
         return redirect(url_for('main.teacher_dashboard'))
     
-    logs = ActivityLog.query.filter_by(user_id=user.id).order_by(ActivityLog.timestamp.desc()).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Student Activity Report'])
-    writer.writerow(['Username', user.username])
-    writer.writerow(['Register Number', user.register_number or 'N/A'])
-    writer.writerow([])
-    writer.writerow(['Timestamp', 'Action', 'Details'])
+    header = [['Student Activity Report'], ['Username', user.username], ['Register Number', user.register_number or 'N/A'], []]
     
-    for log in logs:
-        writer.writerow([log.timestamp.strftime('%Y-%m-%d %H:%M:%S'), log.action, log.details or ''])
+    def rows():
+        yield from header
+        yield ['Timestamp', 'Action', 'Details']
+        for timestamp, action, details in activity.user_export_rows(user.id):
+            yield [timestamp.strftime('%Y-%m-%d %H:%M:%S'), action, details or '']
     
-    output.seek(0)
-    from flask import make_response
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename=student_report_{user.username}.csv'
-    response.headers['Content-Type'] = 'text/csv'
-    
-    from app.utils import log_activity
     log_activity('Generate Report', f'Generated activity report for student {user.username}')
-    return response
+    return csv_response(rows(), f'student_report_{user.username}.csv')
 
-@main.route('/teacher/download_student_logs')
+@main.route('/teacher/download_student_logs', methods=['GET', 'POST'])
 @login_required
 @role_required('Teacher')
 def download_student_logs():
-    import io
-    import csv
-    from app.models import ActivityLog, User, Role
-    from flask import make_response
-    
-    logs = ActivityLog.query.join(User).join(Role).filter(
-        Role.name == 'Student',
-        User.college_id == current_user.college_id
-    ).order_by(ActivityLog.timestamp.desc()).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Timestamp', 'Student', 'Email', 'Action', 'Details'])
-    
-    for log in logs:
-        writer.writerow([
-            log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            log.user.username,
-            log.user.email,
-            log.action,
-            log.details or ''
-        ])
+    from flask import request
+    from app import activity, exports
+    from app.utils import csv_response, log_activity
     
-    output.seek(0)
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = 'attachment; filename=student_activity_logs.csv'
-    response.headers['Content-Type'] = 'text/csv'
+    if request.method == 'POST':
+        # Queued for bin/worker.py instead of holding this worker for the whole export
+        log_activity('Download Bulk Logs', 'Teacher queued bulk activity log export for students')
+        return exports.enqueue_request('activity_logs', 'student_activity_logs', role_name='Student',
+                                       college_id=current_user.college_id, user_label='Student')
     
-    from app.utils import log_activity
+    rows = activity.log_export_lines('Student', current_user.college_id, user_label='Student')
     log_activity('Download Bulk Logs', 'Teacher downloaded bulk activity logs for students')
-    return response
+    return csv_response(rows, 'student_activity_logs.csv')
 
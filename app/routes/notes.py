@@ -1,67 +1,89 @@
+import mimetypes
 import os
-from flask import render_template, url_for, flash, redirect, request, Blueprint, send_from_directory, current_app
+import re
+from flask import render_template, url_for, flash, redirect, request, session, Blueprint, send_file, send_from_directory, current_app, abort
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
 from app import db
-from app.models import Note, Topic, Course, Semester, Subject, Unit, VerificationStatus, Role
+from app.models import Blob, Note, Topic, Course, Semester, Subject, Unit, VerificationStatus, Role
 from app.forms import NoteUploadForm, NoteSelectionForm, NoteEditForm
 from app.decorators import role_required
-from app.utils import log_activity
+from app.utils import log_activity, keyset_paginate
+from app import blobs, extraction, links, previews, search, similarity, storage, syllabus, uploads
 
 notes = Blueprint('notes', __name__)
 
-def save_file(form_file):
-    filename = secure_filename(form_file.filename)
-    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-    form_file.save(file_path)
-    return filename
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+PREVIEW_MAX_AGE = 365 * 24 * 3600
 
-def save_file_to_cdn(form_file, material_type):
-    import cloudinary.uploader
-    import cloudinary
-    
-    # Check if keys are configured
-    if not current_app.config.get('CLOUDINARY_CLOUD_NAME'):
-        return None
+def send_note_file(note, as_attachment):
+    path = blobs.note_path(note)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return send_stored_file(path, note.filename, note.blob.sha256 if note.blob_id else None, as_attachment)
 
-    cloudinary.config( 
-        cloud_name = current_app.config['CLOUDINARY_CLOUD_NAME'], 
-        api_key = current_app.config['CLOUDINARY_API_KEY'], 
-        api_secret = current_app.config['CLOUDINARY_API_SECRET'] 
-    )
-    
-    resource_type = 'auto'
-    if material_type == 'video':
-        resource_type = 'video'
-    elif material_type in ['pdf', 'docx', 'ppt']:
-        resource_type = 'raw'
-        
-    try:
-        upload_result = cloudinary.uploader.upload(
-            form_file,
-            resource_type=resource_type,
-            folder="edustack_materials",
-            use_filename=True,
-            unique_filename=True
-        )
-        return upload_result['secure_url']
-    except Exception as e:
-        print(f"CDN Upload Error: {e}")
-        return None
+def send_stored_file(path, filename, sha256, as_attachment):
+    """Serves a local note file with Range (206), ETag and Last-Modified support.
+
+    Blob files get their SHA-256 as a strong ETag. With SENDFILE_HEADER set, the response
+    only carries headers and the web server streams the file (and answers Range requests)
+    once this worker has authorized it.
+    """
+    header = current_app.config.get('SENDFILE_HEADER')
+    if not header:
+        return send_file(path, as_attachment=as_attachment, download_name=filename,
+                         etag=sha256 or True, conditional=True)
+
+    response = current_app.response_class(
+        mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', filename=filename)
+    stat = os.stat(path)
+    response.last_modified = stat.st_mtime
+    response.set_etag(sha256 or f'{stat.st_mtime}-{stat.st_size}')
+    if header == 'X-Accel-Redirect':
+        # nginx maps these internal locations onto BLOB_STORE and, for legacy files, UPLOAD_FOLDER
+        if sha256:
+            root, prefix = blobs.store_root(), current_app.config.get('SENDFILE_BLOB_PREFIX', '/protected-blobs/')
+        else:
+            root, prefix = current_app.config['UPLOAD_FOLDER'], current_app.config.get('SENDFILE_ACCEL_PREFIX', '/protected-uploads/')
+        response.headers[header] = prefix + os.path.relpath(path, root).replace(os.sep, '/')
+    else:
+        response.headers[header] = path
+    # Answers If-None-Match / If-Modified-Since with a 304 here; ranges are left to the web server
+    return response.make_conditional(request)
+
+@notes.app_template_global()
+def note_file_url(note, permission):
+    """Signed link to view or download a note file, see app/links.py."""
+    return links.file_url(note, current_user, permission)
 
 @notes.route('/notes/upload', methods=['GET', 'POST'])
 @login_required
 @role_required('Teacher', 'Senior Student', 'Admin')
 def upload_note():
     form = NoteUploadForm()
-    # Populate topics with full context, filtered by college
-    topics = Topic.query.join(Unit).join(Subject).join(Semester).join(Course).filter(Course.college_id == current_user.college_id).all()
-    form.topic.choices = [(t.id, f"{t.unit.subject.semester.course.name} - Sem {t.unit.subject.semester.number} - {t.unit.subject.name} - Unit {t.unit.number} - {t.name}") for t in topics]
+    # Populate topics with full context, filtered by college (cached per college)
+    form.topic.choices = syllabus.topic_choices(current_user.college_id)
 
     if form.validate_on_submit():
+        # Topic choices are filled over AJAX, so the posted id has to be checked here
+        if syllabus.college_of(Topic, form.topic.data) != current_user.college_id:
+            flash('Please select a topic from your college syllabus.', 'danger')
+            return render_template('notes/upload_note.html', form=form)
+
+        # Duplicate Detection (before the upload is stored, so a rejected upload leaves nothing behind)
+        existing_note = Note.query.filter_by(title=form.title.data, topic_id=form.topic.data).first()
+        if existing_note:
+            flash(f'A study material with title "{form.title.data}" already exists for this topic.', 'warning')
+            return redirect(url_for('notes.upload_note'))
+
         material_type = form.material_type.data
         filename = None
         file_url = None
+        blob = None
         
         if material_type == 'url':
             if not form.file_url.data:
@@ -69,34 +91,38 @@ def upload_note():
                 return render_template('notes/upload_note.html', form=form)
             file_url = form.file_url.data
         else:
-            if not form.file.data:
+            # Stored once per content; identical files share the blob and its CDN copy
+            if form.upload_id.data:
+                # Sent ahead in chunks by upload.js
+                try:
+                    blob, filename = uploads.claim(form.upload_id.data, current_user.id)
+                except uploads.UploadError as e:
+                    flash(str(e), 'danger')
+                    # Otherwise hidden_tag() writes the dead id back and every resubmit fails the same way
+                    form.upload_id.data = ''
+                    return render_template('notes/upload_note.html', form=form)
+            elif form.file.data:
+                blob = blobs.save(form.file.data)
+                filename = secure_filename(form.file.data.filename)
+            else:
                 flash('Please upload a file for this material type.', 'danger')
                 return render_template('notes/upload_note.html', form=form)
-            
-            # Try CDN Upload
-            cdn_url = save_file_to_cdn(form.file.data, material_type)
-            if cdn_url:
-                file_url = cdn_url
-                filename = form.file.data.filename # Keep original name for record
-            else:
-                # Fallback to local storage
-                filename = save_file(form.file.data)
-                flash('CDN upload unavailable. Saved locally.', 'warning')
-
-        # Duplicate Detection
-        existing_note = Note.query.filter_by(title=form.title.data, topic_id=form.topic.data).first()
-        if existing_note:
-            flash(f'A study material with title "{form.title.data}" already exists for this topic.', 'warning')
-            return redirect(url_for('notes.upload_note'))
+            # Served locally until bin/worker.py has pushed it to the CDN
+            file_url = storage.enqueue(blob, material_type, filename)
+            previews.enqueue(blob, material_type)
+            extraction.enqueue(blob, material_type)
+            similarity.enqueue(blob, material_type)
         
         note = Note(
             title=form.title.data, 
             filename=filename, 
             file_url=file_url,
             material_type=material_type,
+            blob_id=blob.id if blob else None,
             user_id=current_user.id, 
             topic_id=form.topic.data, 
-            college_id=current_user.college_id
+            college_id=current_user.college_id,
+            **syllabus.syllabus_path(Topic, form.topic.data)
         )
         db.session.add(note)
         db.session.commit()
@@ -104,6 +130,7 @@ def upload_note():
         # Create Verification Status
         verification = VerificationStatus(note_id=note.id, status='Pending')
         db.session.add(verification)
+        search.index_note(note)
         db.session.commit()
         
         log_activity('Upload Material', f'Uploaded {material_type} material "{note.title}" for topic {note.topic.name}')
@@ -119,34 +146,52 @@ def list_notes():
     semester_num = request.args.get('semester_num', type=int)
     subject_id = request.args.get('subject_id', type=int)
     search_query = request.args.get('q', '')
+    # 'content' searches the text inside uploaded documents instead of titles and syllabus names
+    scope = request.args.get('scope', 'catalog')
+    cursor = request.args.get('cursor')
+    per_page = request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
     
     # Base query for verified notes
-    # We join everything to support filtering by any combination
-    notes_query = Note.query.filter_by(is_verified=True).join(Topic).join(Unit).join(Subject).join(Semester)
+    # Filters read the denormalized syllabus path on Note, so the listing is one indexed
+    # scan of `note`; the chain and uploader the cards render are joined in for the page only
+    notes_query = Note.query.filter_by(is_verified=True).options(
+        joinedload(Note.topic).joinedload(Topic.unit).joinedload(Unit.subject)
+            .joinedload(Subject.semester).joinedload(Semester.course),
+        joinedload(Note.uploader),
+        joinedload(Note.blob)
+    )
+    # Keyset order: newest first, ties broken by id so the cursor is stable
+    page_keys = [Note.upload_date, Note.id]
     
     # Apply independent filters
     if course_id:
-        notes_query = notes_query.filter(Semester.course_id == course_id)
+        notes_query = notes_query.filter(Note.course_id == course_id)
     if semester_num:
-        notes_query = notes_query.filter(Semester.number == semester_num)
+        notes_query = notes_query.filter(Note.semester_number == semester_num)
     if subject_id:
-        notes_query = notes_query.filter(Subject.id == subject_id)
-    if search_query:
-        search_filter = f"%{search_query}%"
-        from sqlalchemy import or_
-        from app.models import User
-        notes_query = notes_query.join(User, Note.user_id == User.id).filter(or_(
-            Note.title.ilike(search_filter),
-            Topic.name.ilike(search_filter),
-            Subject.name.ilike(search_filter),
-            User.username.ilike(search_filter)
-        ))
+        notes_query = notes_query.filter(Note.subject_id == subject_id)
+    if search_query and scope == 'content':
+        # Extracted document text, indexed once per file and shared by notes with the same file
+        hits = search.content_hits(search_query)
+        if hits is not None:
+            notes_query = notes_query.join(hits, hits.c.blob_id == Note.blob_id)
+            page_keys.insert(0, hits.c.score)
+    elif search_query:
+        # Full-text index over title, topic, subject and uploader, best matches first
+        hits = search.search_hits(search_query)
+        if hits is not None:
+            notes_query = notes_query.join(hits, hits.c.note_id == Note.id)
+            page_keys.insert(0, hits.c.score)
     
     # Strict college isolation for authenticated users
     if current_user.is_authenticated and current_user.college_id:
         notes_query = notes_query.filter(Note.college_id == current_user.college_id)
     
-    notes = notes_query.order_by(Note.upload_date.desc()).all()
+    notes, next_cursor = keyset_paginate(notes_query, page_keys, cursor=cursor, per_page=per_page)
+    next_url = None
+    if next_cursor:
+        next_url = url_for('notes.list_notes', **{**request.args.to_dict(), 'cursor': next_cursor})
     
     # Fetch data for filter dropdowns (restricted by college)
     course_query = Course.query
@@ -170,14 +215,18 @@ def list_notes():
                            selected_course=course_id,
                            selected_semester_num=semester_num,
                            selected_subject=subject_id,
-                           search_query=search_query)
+                           search_query=search_query,
+                           search_scope=scope,
+                           is_first_page=not cursor,
+                           next_url=next_url)
 
 @notes.route('/notes/verify')
 @login_required
 @role_required('Teacher', 'Admin')
 def verification_queue():
     pending_notes = Note.query.filter_by(is_verified=False).all()
-    return render_template('notes/verification_queue.html', notes=pending_notes)
+    duplicates = similarity.duplicates_for_notes(pending_notes)
+    return render_template('notes/verification_queue.html', notes=pending_notes, duplicates=duplicates)
 
 @notes.route('/notes/approve/<int:note_id>')
 @login_required
@@ -193,6 +242,7 @@ def approve_note(note_id):
         from datetime import datetime
         status.verified_at = datetime.utcnow()
     
+    search.index_note(note)
     db.session.commit()
     log_activity('Verify Note', f'Approved note "{note.title}"')
     flash('Note approved.', 'success')
@@ -211,21 +261,26 @@ def delete_note(note_id):
     
     title = note.title
     filename = note.filename
-    
-    # File cleanup
-    if filename and not note.file_url:
-        file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                print(f"Error deleting file: {e}")
-                flash('Note record deleted, but there was an issue removing the physical file.', 'warning')
+    blob_id = note.blob_id
+    legacy_file = bool(filename and not note.file_url and not blob_id)
 
     # Remove verification status first due to FK
+    search.remove_note(note.id)
     VerificationStatus.query.filter_by(note_id=note.id).delete()
     db.session.delete(note)
+    db.session.flush()
+    # Shared content is only deleted with its last note
+    orphan = blobs.release(blob_id)
     db.session.commit()
+
+    # File cleanup
+    if legacy_file:
+        orphan = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+    try:
+        blobs.remove_file(orphan)
+    except Exception as e:
+        print(f"Error deleting file: {e}")
+        flash('Note record deleted, but there was an issue removing the physical file.', 'warning')
     
     log_activity('Delete Note', f'Deleted note "{title}"')
     flash(f'Note "{title}" has been deleted.', 'success')
@@ -246,6 +301,7 @@ def edit_note(note_id):
     if form.validate_on_submit():
         old_title = note.title
         note.title = form.title.data
+        search.index_note(note)
         db.session.commit()
         log_activity('Edit Note', f'Changed note title from "{old_title}" to "{note.title}"')
         flash('Note title updated.', 'success')
@@ -274,11 +330,14 @@ def reject_note(note_id):
     flash('Note rejected.', 'danger')
     return redirect(url_for('notes.verification_queue'))
 
-@notes.route('/notes/download/<filename>')
+@notes.route('/notes/download/<int:note_id>/<filename>')
 @login_required
-def download_file(filename):
+def download_file(note_id, filename):
     # Only allow if verified or if user is uploader/teacher/admin
-    note = Note.query.filter_by(filename=filename).first_or_404()
+    # Resolved by id: uploads with the same name are separate notes with the same filename
+    note = Note.query.get_or_404(note_id)
+    if note.filename != filename:
+        abort(404)
     if not note.is_verified:
         if current_user.role.name == 'Student' and current_user.id != note.user_id:
             flash('This note is not yet verified.', 'warning')
@@ -293,13 +352,16 @@ def download_file(filename):
                 return redirect(download_url)
         return redirect(note.file_url)
 
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    return send_note_file(note, as_attachment=True)
 
-@notes.route('/notes/view/<filename>')
+@notes.route('/notes/view/<int:note_id>/<filename>')
 @login_required
-def view_file(filename):
+def view_file(note_id, filename):
     # Only allow if verified or if user is uploader/teacher/admin
-    note = Note.query.filter_by(filename=filename).first_or_404()
+    # Resolved by id: uploads with the same name are separate notes with the same filename
+    note = Note.query.get_or_404(note_id)
+    if note.filename != filename:
+        abort(404)
     if not note.is_verified:
         if current_user.role.name == 'Student' and current_user.id != note.user_id:
             flash('This note is not yet verified.', 'warning')
@@ -308,5 +370,51 @@ def view_file(filename):
     if note.file_url:
         return redirect(note.file_url)
 
-    # Send file with inline disposition to view in browser
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename, as_attachment=False)
+    # Send file with inline disposition to view in browser (seekable for videos)
+    return send_note_file(note, as_attachment=False)
+
+@notes.route('/notes/files/<token>/<filename>')
+def signed_file(token, filename):
+    # Access was checked when the link was signed: no note, user or file lookup here
+    claims = links.verify(token, filename)
+    if claims is None:
+        abort(404)
+    note_id, user_id, permission, sha256, expired = claims
+    if expired or session.get('_user_id') != str(user_id):
+        # Stale or someone else's link: the note routes log in and check access again
+        endpoint = 'notes.download_file' if permission == 'download' else 'notes.view_file'
+        return redirect(url_for(endpoint, note_id=note_id, filename=filename))
+    path = blobs.blob_path(sha256)
+    if not os.path.isfile(path):
+        abort(404)
+    return send_stored_file(path, filename, sha256, as_attachment=permission == 'download')
+
+@notes.route('/notes/preview/<int:note_id>')
+@login_required
+def preview_note(note_id):
+    note = Note.query.get_or_404(note_id)
+    if not note.is_verified:
+        if current_user.role.name == 'Student' and current_user.id != note.user_id:
+            flash('This note is not yet verified.', 'warning')
+            return redirect(url_for('notes.list_notes'))
+    if not note.blob or note.blob.preview_status != 'done':
+        return redirect(links.file_url(note, current_user, 'view'))
+    return render_template('notes/preview.html', note=note)
+
+@notes.route('/notes/previews/<sha256>/<name>')
+@login_required
+def preview_image(sha256, name):
+    # Images are addressed by content hash, so they never change and can be cached for good
+    if not re.fullmatch(r'[0-9a-f]{64}', sha256) or not re.fullmatch(r'thumb\.jpg|page-\d+\.jpg', name):
+        abort(404)
+    # Same gate as preview_note, through any note on this file: unverified ones are for staff and their uploader
+    accessible = db.session.query(Note.id).join(Note.blob).filter(Blob.sha256 == sha256)
+    if current_user.role.name == 'Student':
+        accessible = accessible.filter(or_(Note.is_verified.is_(True), Note.user_id == current_user.id))
+    if accessible.first() is None:
+        abort(404)
+    response = send_from_directory(blobs.preview_dir(sha256), name, max_age=PREVIEW_MAX_AGE)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
@@ -4,7 +4,11 @@ from app import db
 from app.models import User, Role, College
 from app.forms import CollegeForm
 from app.decorators import role_required
-from app.utils import log_activity
+from app.utils import log_activity, csv_response
+from app import identity
+from app import activity
+from app import exports
+from datetime import datetime
 
 super_admin = Blueprint('super_admin', __name__)
 
@@ -85,6 +89,7 @@ def verify_user(user_id, action):
         flash(f'User {username} rejected/deleted.', 'danger')
     
     db.session.commit()
+    identity.invalidate(user_id)
     return redirect(url_for('super_admin.approve_admins'))
 
 @super_admin.route('/super_admin/college/edit/<int:college_id>', methods=['GET', 'POST'])
@@ -107,18 +112,21 @@ def edit_college(college_id):
 @login_required
 @role_required('Super Admin')
 def view_logs():
-    # Filter logs for 'Admin' role users
-    from app.models import ActivityLog
-    logs = ActivityLog.query.join(User).join(Role).filter(Role.name == 'Admin').order_by(ActivityLog.timestamp.desc()).all()
-    return render_template('super_admin/logs.html', logs=logs, title='Admin Activity Logs')
+    # Logs of 'Admin' role users across all colleges, one page at a time
+    context = activity.log_view('Admin', None, 'super_admin.view_logs')
+    return render_template('super_admin/logs.html', title='Admin Activity Logs', **context)
 
 @super_admin.route('/super_admin/college/delete/<int:college_id>', methods=['POST'])
 @login_required
 @role_required('Super Admin')
 def delete_college(college_id):
     college = College.query.get_or_404(college_id)
+    # Members are detached from the college, so their cached identities are stale
+    member_ids = [u.id for u in college.users]
     db.session.delete(college)
     db.session.commit()
+    for user_id in member_ids:
+        identity.invalidate(user_id)
     log_activity('Delete College', f'Deleted college {college.name}')
     flash(f'College "{college.name}" deleted successfully.', 'success')
     return redirect(url_for('super_admin.dashboard'))
@@ -134,6 +142,7 @@ def delete_admin(user_id):
     username = user.username
     db.session.delete(user)
     db.session.commit()
+    identity.invalidate(user_id)
     log_activity('Delete Admin', f'Deleted admin {username}')
     flash(f'Admin {username} deleted.', 'success')
     return redirect(url_for('super_admin.dashboard'))
@@ -142,70 +151,40 @@ def delete_admin(user_id):
 @login_required
 @role_required('Super Admin')
 def user_report(user_id):
-    import io
-    import csv
-    from app.models import ActivityLog
-    
     user = User.query.get_or_404(user_id)
     # Super Admin can see reports of any Admin
     if user.role.name != 'Admin':
         flash('Unauthorized transition.', 'danger')
         return redirect(url_for('super_admin.dashboard'))
     
-    logs = ActivityLog.query.filter_by(user_id=user.id).order_by(ActivityLog.timestamp.desc()).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Admin Activity Report'])
-    writer.writerow(['Username', user.username])
-    writer.writerow(['Email', user.email])
-    writer.writerow(['College', user.college.name if user.college else 'N/A'])
-    writer.writerow([])
-    writer.writerow(['Timestamp', 'Action', 'Details'])
-    
-    for log in logs:
-        writer.writerow([log.timestamp.strftime('%Y-%m-%d %H:%M:%S'), log.action, log.details or ''])
-    
-    output.seek(0)
+    header = [
+        ['Admin Activity Report'],
+        ['Username', user.username],
+        ['Email', user.email],
+        ['College', user.college.name if user.college else 'N/A'],
+        [],
+    ]
     
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = f'attachment; filename=activity_report_{user.username}.csv'
-    response.headers['Content-Type'] = 'text/csv'
+    def rows():
+        yield from header
+        yield ['Timestamp', 'Action', 'Details']
+        for timestamp, action, details in activity.user_export_rows(user.id):
+            yield [timestamp.strftime('%Y-%m-%d %H:%M:%S'), action, details or '']
     
     log_activity('Generate Report', f'Generated activity report for admin {user.username}')
-    return response
+    return csv_response(rows(), f'activity_report_{user.username}.csv')
 
-@super_admin.route('/super_admin/download_all_logs')
+@super_admin.route('/super_admin/download_all_logs', methods=['GET', 'POST'])
 @login_required
 @role_required('Super Admin')
 def download_all_logs():
-    import io
-    import csv
-    from app.models import ActivityLog
-    
-    logs = ActivityLog.query.join(User).join(Role).filter(Role.name == 'Admin').order_by(ActivityLog.timestamp.desc()).all()
-    
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['Global Admin Activity Logs'])
-    writer.writerow(['Generated At', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')])
-    writer.writerow([])
-    writer.writerow(['Timestamp', 'User', 'Email', 'College', 'Action', 'Details'])
-    
-    for log in logs:
-        writer.writerow([
-            log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-            log.user.username,
-            log.user.email,
-            log.user.college.name if log.user.college else 'N/A',
-            log.action,
-            log.details or ''
-        ])
-    
-    output.seek(0)
-    response = make_response(output.getvalue())
-    response.headers['Content-Disposition'] = 'attachment; filename=admin_activity_logs.csv'
-    response.headers['Content-Type'] = 'text/csv'
+    title = [['Global Admin Activity Logs'], ['Generated At', datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')], []]
+    if request.method == 'POST':
+        # Queued for bin/worker.py instead of holding this worker for the whole export
+        log_activity('Download Bulk Logs', 'Super Admin queued an export of all admin activity logs')
+        return exports.enqueue_request('activity_logs', 'admin_activity_logs', role_name='Admin',
+                                       with_college=True, title=title)
     
+    rows = activity.log_export_lines('Admin', with_college=True, title=title)
     log_activity('Download Bulk Logs', 'Super Admin downloaded all admin activity logs')
-    return response
+    return csv_response(rows, 'admin_activity_logs.csv')
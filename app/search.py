@@ -0,0 +1,237 @@
+"""Full-text search index for the notes catalog.
+
+SQLite databases use an FTS5 virtual table, Postgres uses a tsvector column
+with a GIN index. The backend is picked from the dialect of the configured
+DATABASE_URL, so routes only ever talk to the module level helpers below.
+
+A second index holds the body text extracted from uploaded documents (see
+app/extraction.py). It is keyed by blob rather than note, so identical files
+shared by several notes are indexed once.
+"""
+import re
+from sqlalchemy import text, Integer, Float
+from app import db
+from app.models import Note, Topic, Unit, Subject, User
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    return TOKEN_RE.findall(query or '')[:16]
+
+
+def document_query():
+    """Column-only rows (id, title, topic, subject, uploader) for indexing."""
+    return db.session.query(
+        Note.id, Note.title, Topic.name, Subject.name, User.username, User.name
+    ).join(Topic, Note.topic_id == Topic.id
+    ).join(Unit, Topic.unit_id == Unit.id
+    ).join(Subject, Unit.subject_id == Subject.id
+    ).join(User, Note.user_id == User.id)
+
+
+def document_params(row):
+    note_id, title, topic, subject, username, name = row
+    uploader = f"{username} {name}" if name else username
+    return {'note_id': note_id, 'title': title, 'topic': topic, 'subject': subject, 'uploader': uploader}
+
+
+def _fts5_match(tokens):
+    # Every term must match, the last one as a prefix so partial words still hit
+    match = ' '.join(f'"{t}"' for t in tokens[:-1])
+    return f'{match} "{tokens[-1]}"*'.strip()
+
+
+class SQLiteSearchBackend:
+    table = 'note_search'
+    content_table = 'note_content'
+
+    def ensure(self, conn):
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+            "USING fts5(title, topic, subject, uploader, tokenize='unicode61 remove_diacritics 2')"
+        ))
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.content_table} "
+            "USING fts5(body, tokenize='unicode61 remove_diacritics 2')"
+        ))
+
+    def upsert(self, rows):
+        db.session.execute(text(f"DELETE FROM {self.table} WHERE rowid = :note_id"), rows)
+        db.session.execute(text(
+            f"INSERT INTO {self.table} (rowid, title, topic, subject, uploader) "
+            "VALUES (:note_id, :title, :topic, :subject, :uploader)"
+        ), rows)
+
+    def remove(self, note_id):
+        db.session.execute(text(f"DELETE FROM {self.table} WHERE rowid = :note_id"), {'note_id': note_id})
+
+    def clear(self):
+        db.session.execute(text(f"DELETE FROM {self.table}"))
+
+    def hits(self, tokens):
+        # bm25() is lower-is-better, weight title hits over syllabus and uploader names
+        return text(
+            f"SELECT rowid AS note_id, -bm25({self.table}, 10.0, 4.0, 4.0, 1.0) AS score "
+            f"FROM {self.table} WHERE {self.table} MATCH :match"
+        ).bindparams(match=_fts5_match(tokens))
+
+    def upsert_content(self, blob_id, body):
+        self.remove_content(blob_id)
+        db.session.execute(text(f"INSERT INTO {self.content_table} (rowid, body) VALUES (:blob_id, :body)"),
+                           {'blob_id': blob_id, 'body': body})
+
+    def remove_content(self, blob_id):
+        db.session.execute(text(f"DELETE FROM {self.content_table} WHERE rowid = :blob_id"), {'blob_id': blob_id})
+
+    def content_hits(self, tokens):
+        return text(
+            f"SELECT rowid AS blob_id, -bm25({self.content_table}) AS score "
+            f"FROM {self.content_table} WHERE {self.content_table} MATCH :match"
+        ).bindparams(match=_fts5_match(tokens))
+
+
+class PostgresSearchBackend:
+    table = 'note_search'
+    content_table = 'note_content'
+    document = (
+        "setweight(to_tsvector('simple', coalesce(:title, '')), 'A') || "
+        "setweight(to_tsvector('simple', coalesce(:topic, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(:subject, '')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(:uploader, '')), 'C')"
+    )
+
+    def ensure(self, conn):
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {self.table} ("
+            "note_id INTEGER PRIMARY KEY REFERENCES note(id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{self.table}_document ON {self.table} USING GIN (document)"
+        ))
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {self.content_table} ("
+            "blob_id INTEGER PRIMARY KEY REFERENCES blob(id) ON DELETE CASCADE, "
+            "document TSVECTOR NOT NULL)"
+        ))
+        conn.execute(text(
+            f"CREATE INDEX IF NOT EXISTS ix_{self.content_table}_document ON {self.content_table} USING GIN (document)"
+        ))
+
+    def upsert(self, rows):
+        db.session.execute(text(
+            f"INSERT INTO {self.table} (note_id, document) VALUES (:note_id, {self.document}) "
+            f"ON CONFLICT (note_id) DO UPDATE SET document = EXCLUDED.document"
+        ), rows)
+
+    def remove(self, note_id):
+        db.session.execute(text(f"DELETE FROM {self.table} WHERE note_id = :note_id"), {'note_id': note_id})
+
+    def clear(self):
+        db.session.execute(text(f"TRUNCATE {self.table}"))
+
+    def hits(self, tokens):
+        match = ' & '.join(f"{t}:*" for t in tokens)
+        return text(
+            f"SELECT note_id, ts_rank(document, to_tsquery('simple', :match)) AS score "
+            f"FROM {self.table} WHERE document @@ to_tsquery('simple', :match)"
+        ).bindparams(match=match)
+
+    def upsert_content(self, blob_id, body):
+        db.session.execute(text(
+            f"INSERT INTO {self.content_table} (blob_id, document) VALUES (:blob_id, to_tsvector('simple', :body)) "
+            f"ON CONFLICT (blob_id) DO UPDATE SET document = EXCLUDED.document"
+        ), {'blob_id': blob_id, 'body': body})
+
+    def remove_content(self, blob_id):
+        db.session.execute(text(f"DELETE FROM {self.content_table} WHERE blob_id = :blob_id"), {'blob_id': blob_id})
+
+    def content_hits(self, tokens):
+        match = ' & '.join(f"{t}:*" for t in tokens)
+        return text(
+            f"SELECT blob_id, ts_rank(document, to_tsquery('simple', :match)) AS score "
+            f"FROM {self.content_table} WHERE document @@ to_tsquery('simple', :match)"
+        ).bindparams(match=match)
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backends = {}
+
+
+def get_backend():
+    """Returns the backend for the bound database, creating its index on first use."""
+    engine = db.engine
+    backend = _backends.get(engine.url)
+    if backend is None:
+        dialect = engine.dialect.name
+        if dialect not in BACKENDS:
+            raise RuntimeError(f"No search backend for database dialect '{dialect}'")
+        backend = BACKENDS[dialect]()
+        # Own transaction so a rolled back request can't take the DDL with it
+        with engine.begin() as conn:
+            backend.ensure(conn)
+        _backends[engine.url] = backend
+    return backend
+
+
+def index_note(note):
+    """Adds or refreshes one note in the index. Runs inside the caller's transaction."""
+    backend = get_backend()
+    db.session.flush()
+    row = document_query().filter(Note.id == note.id).first()
+    if row:
+        backend.upsert([document_params(row)])
+
+
+def remove_note(note_id):
+    """Drops one note from the index. Runs inside the caller's transaction."""
+    get_backend().remove(note_id)
+
+
+def search_hits(query):
+    """Returns a (note_id, score) subquery ranked by relevance, or None for an empty query."""
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    return get_backend().hits(tokens).columns(note_id=Integer, score=Float).subquery('search_hits')
+
+
+def index_content(blob_id, body):
+    """Adds or replaces the extracted text of one file. Runs inside the caller's transaction."""
+    get_backend().upsert_content(blob_id, body)
+
+
+def remove_content(blob_id):
+    get_backend().remove_content(blob_id)
+
+
+def content_hits(query):
+    """Returns a (blob_id, score) subquery of files whose text matches, or None for an empty query."""
+    tokens = tokenize(query)
+    if not tokens:
+        return None
+    return get_backend().content_hits(tokens).columns(blob_id=Integer, score=Float).subquery('content_hits')
+
+
+def rebuild_index(batch_size=1000):
+    """Drops every indexed document and re-reads the whole catalog in batches."""
+    backend = get_backend()
+    backend.clear()
+    count = 0
+    batch = []
+    for row in document_query().order_by(Note.id).yield_per(batch_size):
+        batch.append(document_params(row))
+        if len(batch) >= batch_size:
+            backend.upsert(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        backend.upsert(batch)
+        count += len(batch)
+    db.session.commit()
+    return count
@@ -0,0 +1,255 @@
+"""Near-duplicate detection for uploaded note files with MinHash and LSH.
+
+Each blob gets a MinHash signature: NUM_PERM minima of hashed shingles, which two
+files share in about the proportion of shingles they have in common (their Jaccard
+similarity). Documents are shingled by word (extraction.py signs their text in the
+pool). Other files are shingled by bytes: upload_note only queues them, and
+bin/worker.py signs them a batch at a time in the process pool. The signature is cut into BANDS
+bands of ROWS values and every band is hashed into an LshBucket row, so the
+candidates for a blob are the few blobs sharing one of its buckets: an index lookup,
+not a scan of every signature. Candidates are kept when their estimated similarity
+reaches SIMILARITY_THRESHOLD.
+"""
+import hashlib
+import zlib
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import current_app
+import numpy as np
+from sqlalchemy import and_, delete, update
+from sqlalchemy.orm import aliased
+from app import db
+from app import blobs
+from app.models import Blob, LshBucket, Note
+from app.utils import process_pool, reset_process_pool
+
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+SHINGLE_BYTES = 8
+# Byte shingles are sampled by value (1 in 16), which keeps the same shingles of every file
+BYTE_SAMPLE_MASK = 15
+# Bytes shingled per step, and shingles hashed per permutation step, to keep memory flat
+READ_BLOCK = 64 * 1024
+HASH_BLOCK = 1 << 20
+
+MERSENNE = np.uint64((1 << 61) - 1)
+_rng = np.random.RandomState(1)
+PERM_A = _rng.randint(1, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.randint(0, 1 << 32, size=NUM_PERM, dtype=np.uint64)
+
+
+def minhash(shingles):
+    """Returns the signature (uint32 array) of a set of 32-bit shingle hashes."""
+    if not len(shingles):
+        return None
+    x = np.unique(np.asarray(shingles, dtype=np.uint64))
+    signature = np.empty(NUM_PERM, dtype=np.uint32)
+    # a*x + b stays below 2**64 for 32-bit a, b and x; the permutations are applied a slice at a time
+    step = max(1, HASH_BLOCK // len(x))
+    for start in range(0, NUM_PERM, step):
+        a, b = PERM_A[start:start + step, None], PERM_B[start:start + step, None]
+        signature[start:start + step] = (((a * x + b) % MERSENNE) & np.uint64(0xffffffff)).min(axis=1)
+    return signature
+
+
+def text_signature(text):
+    """Signature of a text's overlapping SHINGLE_WORDS-word windows. Runs in pool processes."""
+    words = np.array([zlib.crc32(word.encode()) for word in text.lower().split()], dtype=np.uint64)
+    if len(words) < SHINGLE_WORDS:
+        return minhash(words)
+    shingles = np.zeros(len(words) - SHINGLE_WORDS + 1, dtype=np.uint64)
+    for offset in range(SHINGLE_WORDS):
+        shingles = (shingles * np.uint64(0x01000193) + words[offset:len(shingles) + offset]) & np.uint64(0xffffffff)
+    return minhash(shingles)
+
+
+def _byte_shingles(data):
+    """Sampled hashes of the SHINGLE_BYTES-byte windows of one block (uint8 array)."""
+    count = len(data) - SHINGLE_BYTES + 1
+    packed = np.zeros(count, dtype=np.uint64)
+    for offset in range(SHINGLE_BYTES):
+        packed |= data[offset:offset + count].astype(np.uint64) << np.uint64(8 * offset)
+    hashed = (packed * np.uint64(0x9e3779b97f4a7c15)) >> np.uint64(32)
+    return np.unique(hashed[(hashed & np.uint64(BYTE_SAMPLE_MASK)) == 0])
+
+
+def byte_signature(path, sample_bytes):
+    """Signature of the SHINGLE_BYTES-byte windows in the first sample_bytes of a file.
+    Reads READ_BLOCK bytes at a time. Runs in pool processes."""
+    parts, tail, read = [], b'', 0
+    with open(path, 'rb') as f:
+        while read < sample_bytes:
+            block = f.read(min(READ_BLOCK, sample_bytes - read))
+            if not block:
+                break
+            read += len(block)
+            # Windows spanning two blocks start in the previous block's tail
+            data = np.frombuffer(tail + block, dtype=np.uint8)
+            if len(data) >= SHINGLE_BYTES:
+                parts.append(_byte_shingles(data))
+            tail = (tail + block)[-(SHINGLE_BYTES - 1):]
+    shingles = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.uint64)
+    if not len(shingles):
+        # Tiny files, or no window survived the sampling
+        with open(path, 'rb') as f:
+            return minhash([zlib.crc32(f.read(sample_bytes))])
+    return minhash(shingles)
+
+
+def band_buckets(signature):
+    """The (band, bucket) keys of a signature; buckets are signed 64-bit for BigInteger columns."""
+    return [(band, int.from_bytes(hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(),
+                                                  digest_size=8).digest(), 'big', signed=True))
+            for band in range(BANDS)]
+
+
+def estimate(signature_a, signature_b):
+    """Estimated Jaccard similarity of two stored signatures."""
+    a = np.frombuffer(signature_a, dtype=np.uint32)
+    b = np.frombuffer(signature_b, dtype=np.uint32)
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def index(blob, signature):
+    """Stores a blob's signature and replaces its LSH buckets. The caller commits."""
+    remove(blob.id)
+    if signature is None:
+        blob.minhash = None
+        return
+    blob.minhash = signature.astype(np.uint32).tobytes()
+    db.session.add_all(LshBucket(band=band, bucket=bucket, blob_id=blob.id)
+                       for band, bucket in band_buckets(signature))
+
+
+def enqueue(blob, material_type):
+    """Queues an unsigned non-document blob for byte signing; documents are signed from their
+    text by extraction. The caller commits."""
+    from app.extraction import TEXT_TYPES
+
+    if material_type not in TEXT_TYPES and blob.minhash is None and blob.sign_status is None:
+        blob.sign_status = 'queued'
+        blob.sign_at = datetime.utcnow()
+
+
+def remove(blob_id):
+    db.session.execute(delete(LshBucket).where(LshBucket.blob_id == blob_id))
+
+
+def claim_batch():
+    """Marks up to one batch (two per pool process) of queued blobs as running and returns their ids."""
+    size = 2 * current_app.config.get('WORKER_PROCESSES', 2)
+    candidates = [blob_id for (blob_id,) in db.session.query(Blob.id).filter(
+        Blob.sign_status == 'queued').order_by(Blob.sign_at, Blob.id).limit(size)]
+    claimed = []
+    for blob_id in candidates:
+        if db.session.execute(
+            update(Blob).where(Blob.id == blob_id, Blob.sign_status == 'queued')
+            .values(sign_status='running', sign_at=datetime.utcnow())
+        ).rowcount:
+            claimed.append(blob_id)
+    db.session.commit()
+    return claimed
+
+
+def run_batch(blob_ids):
+    """Signs the claimed blobs in parallel and indexes their buckets. Returns how many succeeded."""
+    sample_bytes = current_app.config.get('SIMILARITY_SAMPLE_BYTES', 1024 * 1024)
+    futures = {}
+    for blob in Blob.query.filter(Blob.id.in_(blob_ids)):
+        futures[process_pool().submit(byte_signature, blobs.blob_path(blob.sha256), sample_bytes)] = blob
+
+    done = 0
+    for future in as_completed(futures):
+        blob = futures[future]
+        try:
+            index(blob, future.result())
+            blob.sign_status = 'done'
+            done += 1
+        except BrokenProcessPool:
+            reset_process_pool()
+            blob.sign_status = 'queued'
+        except Exception as e:
+            current_app.logger.warning(f"Signing blob {blob.id} failed: {e}")
+            blob.sign_status = 'failed'
+        blob.sign_at = datetime.utcnow()
+    db.session.commit()
+    return done
+
+
+def requeue_stale():
+    """Queues signings whose worker stopped. Returns the count."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_STALE_AFTER', 600))
+    count = db.session.execute(
+        update(Blob).where(Blob.sign_status == 'running', Blob.sign_at < cutoff)
+        .values(sign_status='queued')
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def similar_pairs(blob_ids=None):
+    """Returns {blob_id: {similar blob ids}} for the given blobs (all indexed blobs if None).
+    Candidates come from one join on shared buckets and are checked against the threshold."""
+    threshold = current_app.config.get('SIMILARITY_THRESHOLD', 0.8)
+    mine, other = aliased(LshBucket), aliased(LshBucket)
+    query = db.session.query(mine.blob_id, other.blob_id).join(
+        other, and_(other.band == mine.band, other.bucket == mine.bucket, other.blob_id != mine.blob_id)
+    ).distinct()
+    if blob_ids is not None:
+        if not blob_ids:
+            return {}
+        query = query.filter(mine.blob_id.in_(blob_ids))
+    candidates = query.all()
+
+    ids = {blob_id for pair in candidates for blob_id in pair}
+    signatures = dict(db.session.query(Blob.id, Blob.minhash).filter(Blob.id.in_(ids))) if ids else {}
+    pairs = {}
+    for a, b in candidates:
+        if signatures.get(a) and signatures.get(b) and estimate(signatures[a], signatures[b]) >= threshold:
+            pairs.setdefault(a, set()).add(b)
+    return pairs
+
+
+def duplicates_for_notes(notes):
+    """Returns {note id: [other notes of the same college with the same or a similar file]}."""
+    blob_ids = {note.blob_id for note in notes if note.blob_id}
+    if not blob_ids:
+        return {}
+    pairs = similar_pairs(blob_ids)
+    related = blob_ids.union(*pairs.values())
+    by_blob = {}
+    for other in Note.query.filter(Note.blob_id.in_(related)).order_by(Note.upload_date):
+        by_blob.setdefault(other.blob_id, []).append(other)
+
+    duplicates = {}
+    for note in notes:
+        if not note.blob_id:
+            continue
+        matches = [other for blob_id in [note.blob_id, *sorted(pairs.get(note.blob_id, ()))]
+                   for other in by_blob.get(blob_id, ())
+                   if other.id != note.id and other.college_id == note.college_id]
+        if matches:
+            duplicates[note.id] = matches
+    return duplicates
+
+
+def clusters():
+    """Groups every signed blob with its near-duplicates (transitively). Returns lists of blob ids."""
+    parent = {}
+
+    def find(blob_id):
+        while parent.setdefault(blob_id, blob_id) != blob_id:
+            parent[blob_id] = parent[parent[blob_id]]
+            blob_id = parent[blob_id]
+        return blob_id
+
+    for a, similar in similar_pairs().items():
+        for b in similar:
+            parent[find(a)] = find(b)
+    groups = {}
+    for blob_id in parent:
+        groups.setdefault(find(blob_id), []).append(blob_id)
+    return [sorted(group) for group in groups.values()]
@@ -0,0 +1,107 @@
+document.addEventListener('DOMContentLoaded', function () {
+    const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+
+    // Infinite scroll for the activity log pages. The server renders the first page and an
+    // "Older" link to the next one; with JS the following pages come from /api/logs instead.
+    const more = document.getElementById('logMore');
+    const rows = document.getElementById('logRows');
+    const template = document.getElementById('logRowTemplate');
+
+    if (more && rows && template) {
+        let cursor = more.dataset.cursor;
+        let loading = false;
+
+        function appendRow(log) {
+            const row = template.content.firstElementChild.cloneNode(true);
+            row.querySelectorAll('[data-field]').forEach(cell => {
+                cell.textContent = log[cell.dataset.field] || '';
+            });
+            rows.appendChild(row);
+        }
+
+        function loadMore() {
+            if (loading || !cursor) return;
+            loading = true;
+            const url = new URL(more.dataset.feed, window.location.origin);
+            url.searchParams.set('cursor', cursor);
+            fetch(url, { credentials: 'same-origin' })
+                .then(response => {
+                    if (!response.ok) throw new Error('Network response was not ok');
+                    return response.json();
+                })
+                .then(data => {
+                    data.logs.forEach(appendRow);
+                    cursor = data.next_cursor;
+                    if (!cursor) {
+                        observer.disconnect();
+                        more.remove();
+                    }
+                })
+                .catch(error => console.error('Error fetching logs:', error))
+                .finally(() => { loading = false; });
+        }
+
+        const observer = new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) loadMore();
+        }, { rootMargin: '400px' });
+        observer.observe(more);
+
+        more.addEventListener('click', event => {
+            event.preventDefault();
+            loadMore();
+        });
+    }
+
+    // Background exports: queue the job, poll its progress, then download the file
+    document.querySelectorAll('[data-export-url]').forEach(button => {
+        const label = button.innerHTML;
+
+        function poll(statusUrl) {
+            fetch(statusUrl, { credentials: 'same-origin' })
+                .then(response => response.json())
+                .then(job => {
+                    if (job.status === 'done') {
+                        button.innerHTML = label;
+                        button.disabled = false;
+                        window.location = job.download_url;
+                    } else if (job.status === 'failed' || job.status === 'expired') {
+                        button.innerHTML = label;
+                        button.disabled = false;
+                        alert('Export failed: ' + (job.error || job.status));
+                    } else {
+                        const percent = job.progress === null ? '' : ' ' + Math.round(job.progress * 100) + '%';
+                        button.textContent = (job.status === 'queued' ? 'Queued' : 'Exporting') + percent;
+                        setTimeout(() => poll(statusUrl), 2000);
+                    }
+                })
+                .catch(error => {
+                    console.error('Error polling export:', error);
+                    setTimeout(() => poll(statusUrl), 5000);
+                });
+        }
+
+        button.addEventListener('click', () => {
+            const body = new FormData();
+            body.append('format', button.dataset.format);
+            button.disabled = true;
+            button.textContent = 'Queued';
+            fetch(button.dataset.exportUrl, {
+                method: 'POST',
+                headers: { 'X-CSRFToken': csrfToken },
+                credentials: 'same-origin',
+                body: body
+            })
+                .then(response => {
+                    if (!response.ok) throw new Error('Network response was not ok');
+                    return response.json();
+                })
+                .then(job => poll(job.status_url))
+                .catch(error => {
+                    console.error('Error:', error);
+                    button.innerHTML = label;
+                    button.disabled = false;
+                    alert('Failed to start export.');
+                });
+        });
+    });
+});
@@ -16,54 +16,80 @@ document.addEventListener('DOMContentLoaded', function () {
         'topic': topicSelect
     };
 
+    // The whole college syllabus is fetched once and the dropdowns are filled from it.
+    // The endpoint sends an ETag, so reloads revalidate with a 304 instead of a new tree.
+    let syllabus = [];
+
+    function loadSyllabus() {
+        return fetch('/api/syllabus', { cache: 'no-cache', credentials: 'same-origin' })
+            .then(response => response.json())
+            .then(data => { syllabus = data; })
+            .catch(error => console.error('Error fetching syllabus:', error));
+    }
+
+    function findById(items, id) {
+        return items.find(item => String(item.id) === String(id));
+    }
+
+    // Children of the current selection at each level, walking down the tree
+    function courseItems() { return syllabus; }
+    function semesterItems() { const c = findById(syllabus, courseSelect.value); return c ? c.semesters : []; }
+    function subjectItems() { const s = findById(semesterItems(), semesterSelect.value); return s ? s.subjects : []; }
+    function unitItems() { const s = findById(subjectItems(), subjectSelect.value); return s ? s.units : []; }
+    function topicItems() { const u = findById(unitItems(), unitSelect.value); return u ? u.topics : []; }
+
     // Initial load
-    fetchData('/api/courses', courseSelect);
+    loadSyllabus().then(() => populate(courseSelect, courseItems()));
 
     // Event Listeners for changes
     courseSelect.addEventListener('change', () => {
         resetSelects(['semester', 'subject', 'unit', 'topic']);
         if (courseSelect.value) {
-            fetchData(`/api/courses/${courseSelect.value}/semesters`, semesterSelect);
+            populate(semesterSelect, semesterItems());
         }
     });
 
     semesterSelect.addEventListener('change', () => {
         resetSelects(['subject', 'unit', 'topic']);
         if (semesterSelect.value) {
-            fetchData(`/api/semesters/${semesterSelect.value}/subjects`, subjectSelect);
+            populate(subjectSelect, subjectItems());
         }
     });
 
     subjectSelect.addEventListener('change', () => {
         resetSelects(['unit', 'topic']);
         if (subjectSelect.value) {
-            fetchData(`/api/subjects/${subjectSelect.value}/units`, unitSelect);
+            populate(unitSelect, unitItems());
         }
     });
 
     unitSelect.addEventListener('change', () => {
         resetSelects(['topic']);
         if (unitSelect.value) {
-            fetchData(`/api/units/${unitSelect.value}/topics`, topicSelect);
+            populate(topicSelect, topicItems());
         }
     });
 
 
     // Helper Functions
-    function fetchData(url, selectElement) {
-        fetch(url)
-            .then(response => response.json())
-            .then(data => {
-                selectElement.innerHTML = '<option value="">Select...</option>';
-                data.forEach(item => {
-                    const option = document.createElement('option');
-                    option.value = item.id;
-                    option.textContent = item.name;
-                    selectElement.appendChild(option);
-                });
-                selectElement.disabled = false;
-            })
-            .catch(error => console.error('Error fetching data:', error));
+    function populate(selectElement, items) {
+        const current = selectElement.value;
+        selectElement.innerHTML = '<option value="">Select...</option>';
+        items.forEach(item => {
+            const option = document.createElement('option');
+            option.value = item.id;
+            option.textContent = item.name;
+            selectElement.appendChild(option);
+        });
+        if (findById(items, current)) {
+            selectElement.value = current;
+        }
+        selectElement.disabled = false;
+    }
+
+    // Re-fetch the tree after a create and refresh one dropdown, keeping the parents selected
+    function refresh(selectElement, itemsFn) {
+        loadSyllabus().then(() => populate(selectElement, itemsFn()));
     }
 
     function resetSelects(keys) {
@@ -82,28 +108,28 @@ document.addEventListener('DOMContentLoaded', function () {
         course_id: courseSelect.value
     }), () => {
         // Refresh semester list after adding
-        fetchData(`/api/courses/${courseSelect.value}/semesters`, semesterSelect);
+        refresh(semesterSelect, semesterItems);
     });
 
     handleModalForm('saveSubjectBtn', '/api/subjects', () => ({
         name: document.getElementById('newSubjectName').value,
         semester_id: semesterSelect.value
     }), () => {
-        fetchData(`/api/semesters/${semesterSelect.value}/subjects`, subjectSelect);
+        refresh(subjectSelect, subjectItems);
     });
 
     handleModalForm('saveUnitBtn', '/api/units', () => ({
         number: document.getElementById('newUnitName').value,
         subject_id: subjectSelect.value
     }), () => {
-        fetchData(`/api/subjects/${subjectSelect.value}/units`, unitSelect);
+        refresh(unitSelect, unitItems);
     });
 
     handleModalForm('saveTopicBtn', '/api/topics', () => ({
         name: document.getElementById('newTopicName').value,
         unit_id: unitSelect.value
     }), () => {
-        fetchData(`/api/units/${unitSelect.value}/topics`, topicSelect);
+        refresh(topicSelect, topicItems);
     });
 
 
@@ -145,7 +171,7 @@ document.addEventListener('DOMContentLoaded', function () {
                         successCallback();
                     } else if (url === '/api/courses') {
                         // Special case for top level
-                        fetchData('/api/courses', courseSelect);
+                        refresh(courseSelect, courseItems);
                     }
                 })
                 .catch(error => {
@@ -154,4 +180,117 @@ document.addEventListener('DOMContentLoaded', function () {
                 });
         });
     }
+
+    // Resumable chunked upload. The file is sent ahead to /api/uploads in parallel chunks and the
+    // form is then submitted with just the upload id. The id is remembered per file, so after a
+    // dropped connection or a reload, submitting the same file again only sends the missing chunks.
+    const uploadForm = document.getElementById('uploadForm');
+    const fileInput = document.getElementById('fileInput');
+    const uploadIdInput = uploadForm.querySelector('input[name="upload_id"]');
+    const submitButton = uploadForm.querySelector('input[type="submit"], button[type="submit"]');
+    const PARALLEL_CHUNKS = 4;
+    const CHUNK_RETRIES = 3;
+
+    function api(url, options) {
+        return fetch(url, Object.assign({ credentials: 'same-origin' }, options)).then(response => {
+            if (!response.ok) {
+                return response.json().catch(() => ({})).then(data => {
+                    const error = new Error(data.error || 'Upload failed');
+                    error.status = response.status;
+                    throw error;
+                });
+            }
+            return response.json();
+        });
+    }
+
+    function openUpload(file) {
+        const key = 'upload:' + [file.name, file.size, file.lastModified].join(':');
+        const saved = localStorage.getItem(key);
+        const create = () => api('/api/uploads', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json', 'X-CSRFToken': csrfToken },
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        }).then(upload => {
+            localStorage.setItem(key, upload.id);
+            return upload;
+        });
+        const resumed = saved ? api('/api/uploads/' + saved).catch(() => create()) : create();
+        return resumed.then(upload => ({ upload, key }));
+    }
+
+    function sendChunk(upload, file, index, attempt) {
+        const start = index * upload.chunk_size;
+        const end = Math.min(start + upload.chunk_size, file.size);
+        return api(upload.upload_url, {
+            method: 'PUT',
+            headers: {
+                'Content-Type': 'application/octet-stream',
+                'Content-Range': `bytes ${start}-${end - 1}/${file.size}`,
+                'X-CSRFToken': csrfToken
+            },
+            body: file.slice(start, end)
+        }).catch(error => {
+            if (attempt >= CHUNK_RETRIES || (error.status && error.status < 500)) throw error;
+            return new Promise(resolve => setTimeout(resolve, 1000 * 2 ** attempt))
+                .then(() => sendChunk(upload, file, index, attempt + 1));
+        });
+    }
+
+    function uploadFile(file, onProgress) {
+        return openUpload(file).then(({ upload, key }) => {
+            const done = new Set(upload.received);
+            const pending = [];
+            for (let i = 0; i < upload.chunks; i++) {
+                if (!done.has(i)) pending.push(i);
+            }
+            onProgress(done.size / upload.chunks);
+
+            // A few workers pull chunk indexes off the same queue
+            function worker() {
+                const index = pending.shift();
+                if (index === undefined) return Promise.resolve();
+                return sendChunk(upload, file, index, 0).then(() => {
+                    done.add(index);
+                    onProgress(done.size / upload.chunks);
+                    return worker();
+                });
+            }
+            const workers = [];
+            for (let i = 0; i < PARALLEL_CHUNKS; i++) workers.push(worker());
+
+            return Promise.all(workers)
+                .then(() => api(upload.finalize_url, { method: 'POST', headers: { 'X-CSRFToken': csrfToken } }))
+                .then(() => {
+                    localStorage.removeItem(key);
+                    return upload.id;
+                });
+        });
+    }
+
+    // An id left from an earlier attempt belongs to the previous file
+    fileInput.addEventListener('change', () => { uploadIdInput.value = ''; });
+
+    uploadForm.addEventListener('submit', event => {
+        const file = fileInput.files[0];
+        if (!file || uploadIdInput.value || document.getElementById('materialTypeSelect').value === 'url') return;
+        event.preventDefault();
+        const label = submitButton.value;
+        submitButton.disabled = true;
+        uploadFile(file, fraction => { submitButton.value = 'Uploading ' + Math.round(fraction * 100) + '%'; })
+            .then(uploadId => {
+                uploadIdInput.value = uploadId;
+                // The file has been sent already; do not post it a second time
+                fileInput.value = '';
+                submitButton.value = 'Saving...';
+                // The submit button is named "submit", which shadows form.submit()
+                HTMLFormElement.prototype.submit.call(uploadForm);
+            })
+            .catch(error => {
+                console.error('Upload error:', error);
+                submitButton.value = label;
+                submitButton.disabled = false;
+                alert(error.message + ' Submit again to resume the upload.');
+            });
+    });
 });
@@ -0,0 +1,171 @@
+"""Remote storage (the CDN) for note files.
+
+upload_note keeps every file in the local blob store and returns at once; it only
+queues a CdnPush for content the CDN does not have yet. bin/worker.py claims the
+pushes, uploads each blob through the configured backend with retries and backoff,
+and then points Note.file_url of every note on that blob at the CDN copy. CDN copies
+are named by content hash plus the extension of the upload, so the CDN serves them
+with the right type and a re-push of the same content lands on the same name.
+
+The backend is picked by STORAGE_BACKEND and built once per process, so the CDN
+client is configured once rather than on every upload.
+"""
+import os
+import shutil
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from app import blobs
+from app.models import Blob, CdnPush, Note
+
+
+class CloudinaryBackend:
+    def __init__(self, config):
+        import cloudinary
+
+        cloudinary.config(
+            cloud_name=config['CLOUDINARY_CLOUD_NAME'],
+            api_key=config['CLOUDINARY_API_KEY'],
+            api_secret=config['CLOUDINARY_API_SECRET']
+        )
+
+    def push(self, path, material_type, name):
+        import cloudinary.uploader
+
+        resource_type = 'auto'
+        if material_type == 'video':
+            resource_type = 'video'
+        elif material_type in ['pdf', 'docx', 'ppt']:
+            resource_type = 'raw'
+        result = cloudinary.uploader.upload(
+            path,
+            resource_type=resource_type,
+            folder="edustack_materials",
+            # Raw files keep the extension in their public id; Cloudinary adds the format to the others
+            public_id=name if resource_type == 'raw' else os.path.splitext(name)[0],
+            filename_override=name,
+            overwrite=False
+        )
+        return result['secure_url']
+
+
+class LocalBackend:
+    """Stand-in CDN for development and tests: copies files under a static folder."""
+
+    def __init__(self, config):
+        self.folder = config.get('STORAGE_LOCAL_FOLDER') or os.path.join(current_app.static_folder, 'cdn')
+        self.url = config.get('STORAGE_LOCAL_URL', '/static/cdn/')
+        os.makedirs(self.folder, exist_ok=True)
+
+    def push(self, path, material_type, name):
+        shutil.copyfile(path, os.path.join(self.folder, name))
+        return self.url + name
+
+
+BACKENDS = {
+    'cloudinary': CloudinaryBackend,
+    'local': LocalBackend,
+}
+
+_backends = {}
+
+
+def get_backend():
+    """Returns the configured backend (built on first use), or None if files stay local."""
+    name = current_app.config.get('STORAGE_BACKEND')
+    if not name:
+        return None
+    backend = _backends.get(name)
+    if backend is None:
+        if name not in BACKENDS:
+            raise RuntimeError(f"Unknown storage backend '{name}'")
+        backend = _backends[name] = BACKENDS[name](current_app.config)
+    return backend
+
+
+def cdn_name(sha256, extension):
+    """The name of a blob's CDN copy: its hash, plus the extension it was uploaded with."""
+    return f'{sha256}.{extension}' if extension else sha256
+
+
+def enqueue(blob, material_type, filename):
+    """Queues a blob for the CDN unless it is there already or no backend is configured.
+    Returns the CDN URL when it already exists. The caller commits."""
+    if blob.cdn_url or not current_app.config.get('STORAGE_BACKEND'):
+        return blob.cdn_url
+    push = CdnPush.query.filter_by(blob_id=blob.id).first()
+    if push is None:
+        extension = os.path.splitext(filename or '')[1][1:].lower()
+        db.session.add(CdnPush(blob_id=blob.id, material_type=material_type,
+                               extension=extension if 0 < len(extension) <= 10 else None))
+    elif push.status == 'failed':
+        # A new upload of the content gives it a fresh round of attempts
+        push.status = 'queued'
+        push.attempts = 0
+        push.next_attempt_at = datetime.utcnow()
+    return None
+
+
+def claim_next():
+    """Marks the oldest due push as running and returns it, or None if none is due."""
+    while True:
+        push_id = db.session.query(CdnPush.id).filter(
+            CdnPush.status == 'queued', CdnPush.next_attempt_at <= datetime.utcnow()
+        ).order_by(CdnPush.next_attempt_at, CdnPush.id).limit(1).scalar()
+        if push_id is None:
+            return None
+        claimed = db.session.execute(
+            update(CdnPush).where(CdnPush.id == push_id, CdnPush.status == 'queued')
+            .values(status='running', updated_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(CdnPush, push_id)
+
+
+def run(push):
+    """Uploads the blob and swaps the URL of its notes. Returns True on success; failures are
+    queued again with exponential backoff until CDN_PUSH_MAX_ATTEMPTS.
+
+    delete_note can release the blob, and its push, while the upload is in flight, so the
+    rows are only written through UPDATEs that find nothing once they are gone."""
+    blob = db.session.get(Blob, push.blob_id)
+    if blob is None:
+        # Deleted with its last note since the push was claimed
+        return True
+    push_id, blob_id, attempts = push.id, blob.id, push.attempts + 1
+    try:
+        url = get_backend().push(blobs.blob_path(blob.sha256), push.material_type,
+                                 cdn_name(blob.sha256, push.extension))
+    except Exception as e:
+        db.session.rollback()
+        now = datetime.utcnow()
+        values = {'attempts': attempts, 'error': str(e), 'updated_at': now, 'status': 'failed'}
+        if attempts < current_app.config.get('CDN_PUSH_MAX_ATTEMPTS', 5):
+            delay = current_app.config.get('CDN_PUSH_RETRY_DELAY', 30) * 2 ** (attempts - 1)
+            values.update(status='queued', next_attempt_at=now + timedelta(seconds=delay))
+        db.session.execute(update(CdnPush).where(CdnPush.id == push_id).values(**values))
+        db.session.commit()
+        return False
+
+    if not db.session.execute(update(Blob).where(Blob.id == blob_id).values(cdn_url=url)).rowcount:
+        # Released during the upload: nothing is left to point at the copy
+        db.session.rollback()
+        return True
+    Note.query.filter_by(blob_id=blob_id, file_url=None).update({'file_url': url}, synchronize_session=False)
+    db.session.execute(update(CdnPush).where(CdnPush.id == push_id).values(
+        status='done', attempts=attempts, error=None, updated_at=datetime.utcnow()))
+    db.session.commit()
+    return True
+
+
+def requeue_stale():
+    """Queues running pushes whose worker stopped reporting. Returns the count."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('JOB_STALE_AFTER', 600))
+    count = db.session.execute(
+        update(CdnPush).where(CdnPush.status == 'running', CdnPush.updated_at < cutoff)
+        .values(status='queued')
+    ).rowcount
+    db.session.commit()
+    return count
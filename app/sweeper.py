@@ -0,0 +1,197 @@
+"""Finds and removes files in UPLOAD_FOLDER and the blob store that no note references.
+
+Only delete_note releases blobs. Notes removed any other way (a course, subject, unit
+or topic deleted with its notes through the ORM cascade, or the clear scripts in bin/)
+leave blobs with stale reference counts and files nobody can reach, and legacy files
+adopted into the blob store stay under their old names. sweep() recounts blob
+references from the notes table and drops the blobs without notes, then walks the
+upload folder and the blob store (its 256 shard directories in parallel) and diffs them
+against the names still referenced, read in one query. Orphans are deleted, or moved
+under a quarantine folder (in uploads/ or blobs/, with their relative paths), in bulk. A dry run changes nothing and reports what
+would be reclaimed.
+
+Files younger than ORPHAN_MIN_AGE are skipped: an upload is on disk before the note
+that references it is committed. Directly in UPLOAD_FOLDER only names that notes
+referenced are candidates (copies left by adopt_legacy_files, or the names passed in
+by the caller); anything else there, like sample files, is not ours.
+"""
+import os
+import shutil
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import delete, func, literal, select, union_all, update
+from app import db
+from app import blobs, search
+from app.models import Blob, CdnPush, ChunkedUpload, LshBucket, Note
+
+WALK_THREADS = 8
+
+# kind is 'legacy' (a file directly in UPLOAD_FOLDER), 'blob', 'preview' (a blob's image folder) or 'temp'
+Orphan = namedtuple('Orphan', 'path kind size')
+SweepReport = namedtuple('SweepReport', 'orphans bytes by_kind released_blobs dry_run')
+
+
+def recount_blobs():
+    """Sets every blob's refcount to its number of notes and deletes the blobs left with
+    none, with their CDN pushes, content index rows and LSH buckets. Returns how many were
+    deleted. The caller commits."""
+    notes = select(func.count(Note.id)).where(Note.blob_id == Blob.id).scalar_subquery()
+    db.session.execute(update(Blob).values(refcount=notes).where(Blob.refcount != notes))
+    unreferenced = [blob_id for (blob_id,) in db.session.query(Blob.id).filter(Blob.refcount <= 0)]
+    if unreferenced:
+        db.session.execute(delete(CdnPush).where(CdnPush.blob_id.in_(unreferenced)))
+        db.session.execute(delete(LshBucket).where(LshBucket.blob_id.in_(unreferenced)))
+        for blob_id in unreferenced:
+            search.remove_content(blob_id)
+        db.session.execute(delete(Blob).where(Blob.id.in_(unreferenced)))
+    return len(unreferenced)
+
+
+def referenced_names():
+    """Returns {kind: set of names} for the blobs with notes, the legacy files of notes
+    stored before blobs, the names of notes now in the blob store ('stored') and the temp
+    files of open chunked uploads, in one query."""
+    query = union_all(
+        select(literal('blob').label('kind'), Blob.sha256.label('name'))
+        .where(Blob.id.in_(select(Note.blob_id))),
+        select(literal('legacy'), Note.filename)
+        .where(Note.blob_id.is_(None), Note.file_url.is_(None), Note.filename.isnot(None)),
+        select(literal('stored'), Note.filename).where(Note.blob_id.isnot(None)),
+        select(literal('temp'), literal('upload-') + ChunkedUpload.id),
+    )
+    names = {'blob': set(), 'legacy': set(), 'stored': set(), 'temp': set()}
+    for kind, name in db.session.execute(query):
+        names[kind].add(name)
+    return names
+
+
+def _tree_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return size
+
+
+def _scan_shard(path, shard, names, cutoff):
+    """Orphans in one <ab> (or tmp) directory of the blob store. Runs in a walker thread."""
+    orphans = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            stat = entry.stat(follow_symlinks=False)
+            if stat.st_mtime > cutoff:
+                continue
+            if shard == 'tmp':
+                if entry.name not in names['temp']:
+                    orphans.append(Orphan(entry.path, 'temp', stat.st_size))
+            elif entry.is_dir(follow_symlinks=False) and entry.name.endswith('.preview'):
+                if shard + entry.name[:-len('.preview')] not in names['blob']:
+                    orphans.append(Orphan(entry.path, 'preview', _tree_size(entry.path)))
+            elif shard + entry.name not in names['blob']:
+                orphans.append(Orphan(entry.path, 'blob', stat.st_size))
+    return orphans
+
+
+def find_orphans(names, min_age, released_names=()):
+    """Walks UPLOAD_FOLDER and the blob store and returns the Orphans not in referenced_names(). Top-level files
+    are only considered when a note with a blob, or one in `released_names`, had their name."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    cutoff = time.time() - min_age
+    candidates = (names['stored'] | set(released_names)) - names['legacy']
+    orphans = []
+    with os.scandir(upload_folder) as entries:
+        for entry in entries:
+            # Other folders under UPLOAD_FOLDER are not ours to judge
+            if entry.is_file(follow_symlinks=False) and entry.name in candidates:
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime <= cutoff:
+                    orphans.append(Orphan(entry.path, 'legacy', stat.st_size))
+
+    root = blobs.store_root()
+    if not os.path.isdir(root):
+        return orphans
+    shards = [entry.name for entry in os.scandir(root) if entry.is_dir(follow_symlinks=False)]
+    with ThreadPoolExecutor(max_workers=WALK_THREADS) as pool:
+        for found in pool.map(lambda shard: _scan_shard(os.path.join(root, shard), shard, names, cutoff), shards):
+            orphans.extend(found)
+    return orphans
+
+
+def _blob_hash(orphan):
+    # <store>/ab/cdef... or <store>/ab/cdef....preview
+    return os.path.basename(os.path.dirname(orphan.path)) + os.path.basename(orphan.path).removesuffix('.preview')
+
+
+def still_orphaned(orphans):
+    """Drops the blob files and previews that gained a note since referenced_names() was read."""
+    hashes = {_blob_hash(o) for o in orphans if o.kind in ('blob', 'preview')}
+    if not hashes:
+        return orphans
+    claimed = {sha256 for (sha256,) in db.session.query(Blob.sha256).filter(
+        Blob.sha256.in_(hashes), Blob.id.in_(select(Note.blob_id)))}
+    return [o for o in orphans if o.kind not in ('blob', 'preview') or _blob_hash(o) not in claimed]
+
+
+def _dispose(orphan, upload_folder, store, quarantine, cutoff):
+    """Deletes or quarantines one orphan in a walker thread. Returns True once it is gone,
+    False if it is in use again, or the OSError."""
+    try:
+        # store_temp touches a blob it reuses, so a file re-uploaded since the walk is young again
+        if orphan.kind == 'blob' and os.stat(orphan.path).st_mtime > cutoff:
+            return False
+        if quarantine:
+            base, folder = ('uploads', upload_folder) if orphan.kind == 'legacy' else ('blobs', store)
+            target = os.path.join(quarantine, base, os.path.relpath(orphan.path, folder))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(orphan.path, target)
+        elif orphan.kind == 'preview':
+            shutil.rmtree(orphan.path)
+        else:
+            os.remove(orphan.path)
+    except OSError as e:
+        return e
+    return True
+
+
+def sweep(dry_run=False, quarantine=None, min_age=None, released_names=()):
+    """Reclaims orphaned upload files (moving them under `quarantine` if given) and
+    returns a SweepReport. `released_names` are filenames of notes the caller deleted, whose
+    legacy files may sit directly in UPLOAD_FOLDER. A dry run reads the database and the folder only."""
+    if min_age is None:
+        min_age = current_app.config.get('ORPHAN_MIN_AGE', 3600)
+    if dry_run:
+        released = db.session.query(func.count(Blob.id)).filter(
+            Blob.id.notin_(select(Note.blob_id).where(Note.blob_id.isnot(None)))).scalar()
+    else:
+        released = recount_blobs()
+        db.session.commit()
+    orphans = find_orphans(referenced_names(), min_age, released_names)
+    if not dry_run:
+        # Uploads of the same content can reference a file again while the folder is walked
+        orphans = still_orphaned(orphans)
+
+    if not dry_run and orphans:
+        upload_folder, store = current_app.config['UPLOAD_FOLDER'], blobs.store_root()
+        cutoff = time.time() - min_age
+        if quarantine:
+            # One folder per sweep, so an earlier quarantined copy of a name is never merged into
+            quarantine = os.path.join(quarantine, time.strftime('%Y%m%d-%H%M%S'))
+        with ThreadPoolExecutor(max_workers=WALK_THREADS) as pool:
+            results = list(pool.map(lambda orphan: _dispose(orphan, upload_folder, store, quarantine, cutoff), orphans))
+        for orphan, result in zip(orphans, results):
+            if isinstance(result, OSError):
+                current_app.logger.warning(f"Could not remove orphan {orphan.path}: {result}")
+        orphans = [orphan for orphan, result in zip(orphans, results) if result is True]
+
+    by_kind = {}
+    for orphan in orphans:
+        count, size = by_kind.get(orphan.kind, (0, 0))
+        by_kind[orphan.kind] = (count + 1, size + orphan.size)
+    return SweepReport(orphans=orphans, bytes=sum(orphan.size for orphan in orphans),
+                       by_kind=by_kind, released_blobs=released, dry_run=dry_run)
+
@@ -0,0 +1,161 @@
+"""Helpers for the Course -> Semester -> Subject -> Unit -> Topic hierarchy."""
+import time
+from flask import current_app
+from flask_login import current_user
+from sqlalchemy import bindparam, update, select
+from app import db
+from app.models import College, Course, Semester, Subject, Unit, Topic, Note
+
+# Top-down order of the nodes that sit between a Course and a Note
+CHAIN = [Semester, Subject, Unit, Topic]
+
+# Note column that points at each node
+NOTE_COLUMNS = {
+    Semester: Note.semester_id,
+    Subject: Note.subject_id,
+    Unit: Note.unit_id,
+    Topic: Note.topic_id,
+}
+
+def college_of(model, node_id):
+    """Owning college of a syllabus node, read by primary key without walking its parents."""
+    if node_id is None:
+        return None
+    return db.session.query(model.college_id).filter(model.id == node_id).scalar()
+
+def is_owned(node, college_id=None):
+    """True if a Course/Semester/Subject/Unit/Topic belongs to `college_id` (default: current user's)."""
+    if college_id is None:
+        college_id = current_user.college_id
+    return node is not None and node.college_id is not None and node.college_id == college_id
+
+def _path_columns(model):
+    columns = [Semester.course_id.label('course_id'), Semester.id.label('semester_id'),
+               Semester.number.label('semester_number')]
+    if CHAIN.index(model) >= CHAIN.index(Subject):
+        columns.append(Subject.id.label('subject_id'))
+    if CHAIN.index(model) >= CHAIN.index(Unit):
+        columns.append(Unit.id.label('unit_id'))
+    return columns
+
+def _path_query(model):
+    query = db.session.query(*_path_columns(model)).select_from(Semester)
+    for parent, child in zip(CHAIN, CHAIN[1:CHAIN.index(model) + 1]):
+        query = query.join(child, getattr(child, f'{parent.__tablename__}_id') == parent.id)
+    return query
+
+def syllabus_path(model, node_id):
+    """Denormalized Note path (course_id, semester_id, ...) of a syllabus node, from one joined query.
+
+    Only the columns a node determines are returned: a Subject knows its semester and
+    course but not which unit a note hangs off, so `unit_id` is left out for it.
+    """
+    row = _path_query(model).filter(model.id == node_id).first()
+    return row._asdict() if row else {}
+
+def refresh_note_paths(model, node_id):
+    """Rewrites the denormalized path of every note under a re-parented syllabus node."""
+    db.session.flush()
+    path = syllabus_path(model, node_id)
+    if not path:
+        return 0
+    return Note.query.filter(NOTE_COLUMNS[model] == node_id).update(path, synchronize_session=False)
+
+def backfill_note_paths():
+    """Recomputes the path of every note, one batched UPDATE keyed by topic."""
+    path_keys = ['course_id', 'semester_id', 'semester_number', 'subject_id', 'unit_id']
+    query = _path_query(Topic).add_columns(Topic.id.label('topic_id'))
+    # Bind names must not clash with the SET columns, hence the prefix
+    rows = [{f'p_{key}': value for key, value in row._asdict().items()} for row in query]
+    if not rows:
+        return 0
+    note = Note.__table__
+    stmt = update(note).where(note.c.topic_id == bindparam('p_topic_id')).values(
+        {key: bindparam(f'p_{key}') for key in path_keys}
+    )
+    db.session.execute(stmt, rows)
+    return len(rows)
+
+def touch(college_id):
+    """Marks a college's syllabus as changed. Call from every syllabus create/edit/delete."""
+    if college_id is None:
+        return
+    College.query.filter_by(id=college_id).update(
+        {College.syllabus_version: College.syllabus_version + 1}, synchronize_session=False)
+    _topic_choices.pop(college_id, None)
+
+def version(college_id):
+    return db.session.query(College.syllabus_version).filter(College.id == college_id).scalar() or 0
+
+def tree(college_id):
+    """Whole Course -> Semester -> Subject -> Unit -> Topic tree of a college from one query."""
+    rows = db.session.query(
+        Course.id, Course.name, Semester.id, Semester.number, Subject.id, Subject.name,
+        Unit.id, Unit.number, Topic.id, Topic.name
+    ).outerjoin(Semester, Semester.course_id == Course.id
+    ).outerjoin(Subject, Subject.semester_id == Semester.id
+    ).outerjoin(Unit, Unit.subject_id == Subject.id
+    ).outerjoin(Topic, Topic.unit_id == Unit.id
+    ).filter(Course.college_id == college_id
+    ).order_by(Course.id, Semester.id, Subject.id, Unit.id, Topic.id).all()
+
+    courses = {}
+    semesters = {}
+    subjects = {}
+    units = {}
+    for c_id, c_name, sem_id, sem_num, sub_id, sub_name, unit_id, unit_num, topic_id, topic_name in rows:
+        if c_id not in courses:
+            courses[c_id] = {'id': c_id, 'name': c_name, 'semesters': []}
+        if sem_id is not None and sem_id not in semesters:
+            semesters[sem_id] = {'id': sem_id, 'name': f"Semester {sem_num}", 'subjects': []}
+            courses[c_id]['semesters'].append(semesters[sem_id])
+        if sub_id is not None and sub_id not in subjects:
+            subjects[sub_id] = {'id': sub_id, 'name': sub_name, 'units': []}
+            semesters[sem_id]['subjects'].append(subjects[sub_id])
+        if unit_id is not None and unit_id not in units:
+            units[unit_id] = {'id': unit_id, 'name': f"Unit {unit_num}", 'topics': []}
+            subjects[sub_id]['units'].append(units[unit_id])
+        if topic_id is not None:
+            units[unit_id]['topics'].append({'id': topic_id, 'name': topic_name})
+    return list(courses.values())
+
+def backfill_college_ids():
+    """Copies college_id down the hierarchy, one UPDATE per level, parents first."""
+    count = 0
+    for parent, child in zip([Course] + CHAIN, CHAIN):
+        fk = getattr(child, f'{parent.__tablename__}_id')
+        owner = select(parent.college_id).where(parent.id == fk).scalar_subquery()
+        count += child.query.update({child.college_id: owner}, synchronize_session=False)
+    return count
+
+# Per-process cache of upload form topic labels: college_id -> (version, checked_at, choices).
+# touch() drops the entry in this worker; other workers notice the version bump once the
+# entry is older than SYLLABUS_CACHE_TTL and they re-read it.
+_topic_choices = {}
+
+def _build_topic_choices(college_id):
+    rows = db.session.query(
+        Topic.id, Course.name, Semester.number, Subject.name, Unit.number, Topic.name
+    ).join(Unit, Topic.unit_id == Unit.id
+    ).join(Subject, Unit.subject_id == Subject.id
+    ).join(Semester, Subject.semester_id == Semester.id
+    ).join(Course, Semester.course_id == Course.id
+    ).filter(Topic.college_id == college_id
+    ).order_by(Topic.id).all()
+    return [(t_id, f"{course} - Sem {sem} - {subject} - Unit {unit} - {topic}")
+            for t_id, course, sem, subject, unit, topic in rows]
+
+def topic_choices(college_id):
+    """(topic_id, "Course - Sem n - Subject - Unit n - Topic") choices for a college, cached."""
+    now = time.monotonic()
+    entry = _topic_choices.get(college_id)
+    if entry and now - entry[1] < current_app.config.get('SYLLABUS_CACHE_TTL', 30):
+        return entry[2]
+
+    current = version(college_id)
+    if entry and entry[0] == current:
+        choices = entry[2]
+    else:
+        choices = _build_topic_choices(college_id)
+    _topic_choices[college_id] = (current, now, choices)
+    return choices
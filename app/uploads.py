@@ -0,0 +1,151 @@
+"""Resumable chunked uploads for note files.
+
+The browser opens an upload with the file's name and size, PUTs fixed-size chunks
+(in parallel, in any order) with a Content-Range header, and finalizes once every
+chunk is in. Each chunk is streamed straight to its offset in one preallocated temp
+file next to the blob store, so nothing is reassembled or held in memory, and a
+dropped connection only costs the chunks in flight: GET the upload to see which
+arrived. Finalizing hashes the file; upload_note then moves it into app.blobs.
+"""
+import os
+import re
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app, url_for
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+from app import db
+from app import blobs
+from app.forms import NOTE_FILE_EXTENSIONS
+from app.models import ChunkedUpload, UploadChunk
+
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class UploadError(ValueError):
+    """The request does not fit the upload; the message is safe to show."""
+
+
+def temp_path(upload):
+    return os.path.join(blobs.temp_dir(), f"upload-{upload.id}")
+
+
+def chunk_count(upload):
+    return max(1, -(-upload.size // upload.chunk_size))
+
+
+def create(user_id, filename, size):
+    """Opens an upload and preallocates its temp file. Raises UploadError for a bad name or size."""
+    filename = secure_filename(filename or '')
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension not in NOTE_FILE_EXTENSIONS:
+        raise UploadError('Allowed formats: PDF, DOCX, PPT, MP4, MKV')
+    max_size = current_app.config.get('MAX_CONTENT_LENGTH')
+    if not isinstance(size, int) or size <= 0 or (max_size and size > max_size):
+        raise UploadError('File is empty or too large.')
+
+    upload = ChunkedUpload(id=uuid.uuid4().hex, user_id=user_id, filename=filename, size=size,
+                           chunk_size=current_app.config.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    with open(temp_path(upload), 'wb') as f:
+        f.truncate(size)
+    db.session.add(upload)
+    db.session.commit()
+    return upload
+
+
+def received(upload):
+    return sorted(index for (index,) in db.session.query(UploadChunk.index).filter_by(upload_id=upload.id))
+
+
+def status(upload):
+    """What the client needs to (re)start sending chunks."""
+    return {
+        'id': upload.id,
+        'filename': upload.filename,
+        'size': upload.size,
+        'chunk_size': upload.chunk_size,
+        'chunks': chunk_count(upload),
+        'received': received(upload),
+        'complete': upload.sha256 is not None,
+        'upload_url': url_for('api.put_upload_chunk', upload_id=upload.id),
+        'finalize_url': url_for('api.finalize_upload', upload_id=upload.id),
+    }
+
+
+def write_chunk(upload, content_range, stream):
+    """Streams one chunk from the request body to its offset. Chunks must start on a chunk
+    boundary and be whole (the last one may be short); a chunk sent twice is rewritten."""
+    match = CONTENT_RANGE.match(content_range or '')
+    if not match:
+        raise UploadError('A Content-Range header of the form "bytes start-end/size" is required.')
+    start, end, total = (int(g) for g in match.groups())
+    if total != upload.size or start % upload.chunk_size or end < start:
+        raise UploadError('Content-Range does not match this upload.')
+    index = start // upload.chunk_size
+    if end != min(start + upload.chunk_size, upload.size) - 1:
+        raise UploadError('Chunks must be whole.')
+    if upload.sha256 is not None:
+        raise UploadError('Upload is already finalized.')
+
+    length = end - start + 1
+    written = 0
+    with open(temp_path(upload), 'r+b') as f:
+        f.seek(start)
+        while written < length:
+            block = stream.read(min(blobs.CHUNK_SIZE, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+    if written != length:
+        # The connection dropped mid-chunk; it is not marked received, so the client resends it
+        raise UploadError('Chunk body is shorter than its Content-Range.')
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(UploadChunk(upload_id=upload.id, index=index))
+    except IntegrityError:
+        pass
+    upload.updated_at = datetime.utcnow()
+    db.session.commit()
+    return index
+
+
+def finalize(upload):
+    """Checks every chunk arrived and records the file's digest. Safe to call again."""
+    if upload.sha256 is None:
+        missing = chunk_count(upload) - len(received(upload))
+        if missing:
+            raise UploadError(f'{missing} chunks are still missing.')
+        upload.sha256 = blobs.hash_file(temp_path(upload))
+        upload.updated_at = datetime.utcnow()
+        db.session.commit()
+    return upload
+
+
+def claim(upload_id, user_id):
+    """Turns a finished upload into a referenced Blob for a new note and closes the upload.
+    Returns (blob, filename); the caller commits."""
+    upload = db.session.get(ChunkedUpload, upload_id)
+    if upload is None or upload.user_id != user_id:
+        raise UploadError('Upload not found. Please upload the file again.')
+    finalize(upload)
+    blob = blobs.store_temp(temp_path(upload), upload.sha256, upload.size)
+    filename = upload.filename
+    UploadChunk.query.filter_by(upload_id=upload.id).delete()
+    db.session.delete(upload)
+    return blob, filename
+
+
+def cleanup_expired():
+    """Drops uploads nobody has touched for UPLOAD_SESSION_TTL seconds. Returns the count."""
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config.get('UPLOAD_SESSION_TTL', 86400))
+    uploads = ChunkedUpload.query.filter(ChunkedUpload.updated_at < cutoff).all()
+    for upload in uploads:
+        path = temp_path(upload)
+        if os.path.exists(path):
+            os.remove(path)
+        UploadChunk.query.filter_by(upload_id=upload.id).delete()
+        db.session.delete(upload)
+    db.session.commit()
+    return len(uploads)
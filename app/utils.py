@@ -1,12 +1,24 @@
+import base64
+import csv
+import io
+import json
+from datetime import datetime
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import tuple_, DateTime
 from app import db
-from app.models import ActivityLog
+from app.activity import writer as activity_writer
 from flask_login import current_user
 
 def log_activity(action, details=None):
+    # Queued for the batched writer in app/activity.py rather than committed here
     if current_user.is_authenticated:
-        log = ActivityLog(user_id=current_user.id, action=action, details=details)
-        db.session.add(log)
-        db.session.commit()
+        activity_writer.record({
+            'user_id': current_user.id,
+            'role_id': current_user.role_id,
+            'college_id': current_user.college_id,
+            'action': action,
+            'details': details,
+        })
 
 def parse_college_id(cid_str):
     """Parses 'CIDA001' or '1' into integer 1. Returns None if invalid."""
@@ -25,3 +37,86 @@ def format_college_id(cid_int):
     if cid_int is None:
         return "N/A"
     return f"CIDA{cid_int:03d}"
+
+def encode_cursor(values):
+    """Packs keyset values into an opaque URL-safe token."""
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(token, keys):
+    """Unpacks a cursor token for the given key columns. Returns None if it is malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(keys):
+            return None
+        return [datetime.fromisoformat(v) if isinstance(k.type, DateTime) else v for k, v in zip(keys, values)]
+    except (ValueError, TypeError):
+        return None
+
+def keyset_paginate(query, keys, cursor=None, per_page=25):
+    """Returns one page of `query` ordered by `keys` descending, plus the cursor of the next page.
+
+    The key columns are appended to the selected entities so the page boundary can be read
+    back from the last row; the rows handed back have them stripped again.
+    """
+    values = decode_cursor(cursor, keys)
+    query = query.add_columns(*keys)
+    if values is not None:
+        query = query.filter(tuple_(*keys) < tuple_(*values))
+    rows = query.order_by(*[k.desc() for k in keys]).limit(per_page + 1).all()
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1][-len(keys):])
+    items = [row[0] if len(row) == len(keys) + 1 else tuple(row[:-len(keys)]) for row in rows]
+    return items, next_cursor
+
+def iter_keyset(query, keys, batch_size=1000):
+    """Yields every row of `query` ordered by `keys` descending, one keyset page per query."""
+    cursor = None
+    while True:
+        items, cursor = keyset_paginate(query, keys, cursor=cursor, per_page=batch_size)
+        yield from items
+        if cursor is None:
+            return
+
+def csv_response(rows, filename, flush_every=500):
+    """Streams `rows` (an iterable of lists) as a CSV attachment.
+
+    Lines are sent in chunks of `flush_every` rows while `rows` is still being consumed, so
+    the first byte goes out straight away and memory does not grow with the export size.
+    """
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+            # The first line goes out on its own, before the export query has even run
+            if count == 1 or count % flush_every == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    response = Response(stream_with_context(generate()), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+_process_pool = None
+
+def process_pool():
+    """The process pool bin/worker.py runs CPU-bound jobs in (PDF previews, text extraction)."""
+    global _process_pool
+    if _process_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _process_pool = ProcessPoolExecutor(max_workers=current_app.config.get('WORKER_PROCESSES', 2))
+    return _process_pool
+
+def reset_process_pool():
+    """Forgets a pool broken by a crashed child; the next process_pool() call starts a fresh one."""
+    global _process_pool
+    _process_pool = None
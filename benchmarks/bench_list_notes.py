@@ -0,0 +1,162 @@
+"""Benchmark for the notes listing page on a large catalog.
+
+Seeds a throwaway SQLite database with N verified notes (100k by default) and
+compares the old "load everything and lazy-load each card" listing with the
+keyset-paginated, eager-loaded /notes page. Prints query count and latency.
+
+    python benchmarks/bench_list_notes.py --notes 100000
+"""
+import argparse
+import os
+import re
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import event
+from config import Config
+
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._hit)
+
+    def _hit(self, *args):
+        self.count += 1
+
+
+def seed(db, models, n_notes):
+    Role, User, College, Course, Semester, Subject, Unit, Topic, Note = models
+    college = College(name='Bench College')
+    db.session.add(college)
+    db.session.commit()
+    student_role = Role(name='Student')
+    teacher_role = Role(name='Teacher')
+    db.session.add_all([student_role, teacher_role])
+    db.session.commit()
+
+    teachers = []
+    for i in range(50):
+        teachers.append(User(username=f'teacher{i}', email=f'teacher{i}@bench.edu', password_hash='x',
+                             role_id=teacher_role.id, college_id=college.id, is_verified=True))
+    student = User(username='student', email='student@bench.edu', password_hash='x',
+                   role_id=student_role.id, college_id=college.id, is_verified=True)
+    db.session.add_all(teachers + [student])
+    db.session.commit()
+
+    topics = []
+    for c in range(4):
+        course = Course(name=f'Course {c}', college_id=college.id)
+        db.session.add(course)
+        for s in range(1, 7):
+            sem = Semester(number=s, course=course, college_id=college.id)
+            for sub_idx in range(5):
+                sub = Subject(name=f'Subject {c}-{s}-{sub_idx}', semester=sem, college_id=college.id)
+                for u in range(1, 4):
+                    unit = Unit(number=u, subject=sub, college_id=college.id)
+                    for t in range(3):
+                        topic = Topic(name=f'Topic {c}-{s}-{sub_idx}-{u}-{t}', unit=unit, college_id=college.id)
+                        topics.append(topic)
+                        db.session.add(topic)
+    db.session.commit()
+
+    from app.syllabus import syllabus_path
+    paths = [syllabus_path(Topic, topic.id) for topic in topics]
+
+    base = datetime(2024, 1, 1)
+    batch = []
+    for i in range(n_notes):
+        batch.append(dict(
+            title=f'Lecture notes {i}', filename=f'bench_{i}.pdf', material_type='pdf',
+            user_id=teachers[i % len(teachers)].id, topic_id=topics[i % len(topics)].id,
+            college_id=college.id, upload_date=base + timedelta(seconds=i * 37), is_verified=True,
+            **paths[i % len(topics)]
+        ))
+        if len(batch) == 10000:
+            db.session.execute(Note.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Note.__table__.insert(), batch)
+    db.session.commit()
+    return student.id
+
+
+def legacy_listing(db, Note, Topic, Unit, Subject, Semester, college_id):
+    """The pre-pagination behaviour: every note, then lazy loads for each card."""
+    notes = Note.query.filter_by(is_verified=True).join(Topic, Note.topic_id == Topic.id) \
+        .filter(Note.college_id == college_id).order_by(Note.upload_date.desc()).all()
+    for note in notes:
+        note.topic.unit.subject.semester.course.name
+        note.uploader.username
+        note.topic.unit.subject.name
+        note.topic.name
+    return len(notes)
+
+
+def measure(label, counter, fn):
+    counter.count = 0
+    start = time.perf_counter()
+    result = fn()
+    elapsed = (time.perf_counter() - start) * 1000
+    print(f"{label:<38} {counter.count:>8} {elapsed:>10.1f} ms   {result}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--notes', type=int, default=100000)
+    parser.add_argument('--per-page', type=int, default=24)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bisna_bench_')
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+        UPLOAD_FOLDER = os.path.join(tmpdir, 'uploads')
+        WTF_CSRF_ENABLED = False
+
+    from app import create_app, db
+    from app.models import Role, User, College, Course, Semester, Subject, Unit, Topic, Note
+
+    app = create_app(BenchConfig)
+    with app.app_context():
+        db.create_all()
+        print(f"Seeding {args.notes} notes into {tmpdir} ...")
+        student_id = seed(db, (Role, User, College, Course, Semester, Subject, Unit, Topic, Note), args.notes)
+        college_id = db.session.get(User, student_id).college_id
+        counter = QueryCounter(db.engine)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(student_id)
+            session['_fresh'] = True
+
+        def page(url):
+            response = client.get(url)
+            assert response.status_code == 200, response.status_code
+            return response
+
+        print(f"\n{'scenario':<38} {'queries':>8} {'latency':>13}   rows")
+        db.session.remove()
+        measure('legacy: all notes + lazy loads', counter,
+                lambda: legacy_listing(db, Note, Topic, Unit, Subject, Semester, college_id))
+        db.session.remove()
+
+        measure('/notes first page', counter,
+                lambda: page(f'/notes?per_page={args.per_page}') and f'{args.per_page} per page')
+
+        # Walk 100 pages deep to show the cost does not grow with the offset
+        url = f'/notes?per_page={args.per_page}'
+        for _ in range(100):
+            match = re.search(rb'href="([^"]*cursor=[^"]*)"', page(url).data)
+            url = match.group(1).decode().replace('&amp;', '&')
+        measure('/notes page 101 (cursor)', counter, lambda: page(url) and f'{args.per_page} per page')
+        measure('/notes filtered by subject', counter,
+                lambda: page(f'/notes?per_page={args.per_page}&subject_id=1') and f'{args.per_page} per page')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Benchmark for the bulk activity log CSV export.
+
+Seeds a throwaway SQLite database with N activity log rows (500k by default) and
+downloads /admin/download_logs/Teacher two ways: the old export that loaded every
+ActivityLog, lazy-loaded each row's user and built the CSV in a StringIO, and the
+streamed export. Each scenario runs in its own process so the peak RSS figures
+do not include the other one.
+
+    python benchmarks/bench_log_export.py --logs 1000000
+"""
+import argparse
+import csv
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+
+
+def make_app(tmpdir):
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'bench.db')
+        UPLOAD_FOLDER = os.path.join(tmpdir, 'uploads')
+        ACTIVITY_LOG_SPOOL_DIR = os.path.join(tmpdir, 'spool')
+        WTF_CSRF_ENABLED = False
+
+    from app import create_app
+    return create_app(BenchConfig)
+
+
+def seed(tmpdir, n_logs):
+    from app import db
+    from app.models import ActivityLog, College, Role, User
+
+    app = make_app(tmpdir)
+    with app.app_context():
+        db.create_all()
+        college = College(name='Bench College')
+        db.session.add(college)
+        db.session.commit()
+        admin_role = Role(name='Admin')
+        teacher_role = Role(name='Teacher')
+        db.session.add_all([admin_role, teacher_role])
+        db.session.commit()
+
+        admin = User(username='admin', email='admin@bench.edu', password_hash='x',
+                     role_id=admin_role.id, college_id=college.id, is_verified=True)
+        teachers = [User(username=f'teacher{i}', email=f'teacher{i}@bench.edu', password_hash='x',
+                         role_id=teacher_role.id, college_id=college.id, is_verified=True) for i in range(200)]
+        db.session.add_all([admin] + teachers)
+        db.session.commit()
+
+        base = datetime(2024, 1, 1)
+        batch = []
+        for i in range(n_logs):
+            batch.append(dict(
+                user_id=teachers[i % len(teachers)].id, role_id=teacher_role.id, college_id=college.id,
+                action='Upload Material', details=f'Uploaded pdf material "Lecture notes {i}" for topic {i % 90}',
+                timestamp=base + timedelta(seconds=i * 11),
+            ))
+            if len(batch) == 10000:
+                db.session.execute(ActivityLog.__table__.insert(), batch)
+                batch = []
+        if batch:
+            db.session.execute(ActivityLog.__table__.insert(), batch)
+        db.session.commit()
+
+
+def legacy_export(college_id, teacher_role_id):
+    """The pre-streaming export: every row as an ORM object, user lazy-loaded, whole CSV in memory."""
+    from app.models import ActivityLog
+
+    logs = ActivityLog.query.filter(
+        ActivityLog.college_id == college_id, ActivityLog.role_id == teacher_role_id
+    ).order_by(ActivityLog.timestamp.desc()).all()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['Timestamp', 'User', 'Email', 'Action', 'Details'])
+    for log in logs:
+        writer.writerow([log.timestamp.strftime('%Y-%m-%d %H:%M:%S'), log.user.username, log.user.email,
+                         log.action, log.details or ''])
+    body = output.getvalue()
+    return len(body)
+
+
+def run_scenario(tmpdir, scenario):
+    """Runs in a child process and prints 'first_byte_ms total_ms bytes peak_rss_kb'."""
+    from app import db
+    from app.models import Role, User
+
+    app = make_app(tmpdir)
+    with app.app_context():
+        admin = User.query.filter_by(username='admin').one()
+        teacher_role_id = Role.query.filter_by(name='Teacher').one().id
+        admin_id, college_id = admin.id, admin.college_id
+        db.session.remove()
+
+        start = time.perf_counter()
+        if scenario == 'legacy':
+            size = legacy_export(college_id, teacher_role_id)
+            first_byte = time.perf_counter()
+        else:
+            client = app.test_client()
+            with client.session_transaction() as session:
+                session['_user_id'] = str(admin_id)
+                session['_fresh'] = True
+            response = client.get('/admin/download_logs/Teacher', buffered=False)
+            size = 0
+            first_byte = None
+            for chunk in response.response:
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                size += len(chunk)
+            response.close()
+        total = time.perf_counter() - start
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak_kb //= 1024
+    print(f"{(first_byte - start) * 1000:.1f} {total * 1000:.1f} {size} {peak_kb}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logs', type=int, default=500000)
+    parser.add_argument('--scenario', choices=['legacy', 'streamed'])
+    parser.add_argument('--tmpdir')
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_scenario(args.tmpdir, args.scenario)
+        return
+
+    tmpdir = tempfile.mkdtemp(prefix='bisna_bench_')
+    print(f"Seeding {args.logs} activity log rows into {tmpdir} ...")
+    seed(tmpdir, args.logs)
+
+    print(f"\n{'scenario':<28} {'first byte':>12} {'total':>12} {'size':>12} {'peak RSS':>12}")
+    for scenario in ('legacy', 'streamed'):
+        output = subprocess.run(
+            [sys.executable, __file__, '--scenario', scenario, '--tmpdir', tmpdir],
+            check=True, capture_output=True, text=True
+        ).stdout.split()
+        first_byte, total, size, peak_kb = output[-4:]
+        print(f"{scenario:<28} {float(first_byte):>9.1f} ms {float(total):>9.1f} ms "
+              f"{int(size) / 1e6:>9.1f} MB {int(peak_kb) / 1024:>9.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
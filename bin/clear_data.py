@@ -1,4 +1,9 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
 from app import create_app, db
+from app import sweeper
 from app.models import User, College, StudentRegistry, Course, Semester, Subject, Unit, Topic, Note, VerificationStatus, ActivityLog
 
 def clear_all_college_data():
@@ -7,6 +12,8 @@ def clear_all_college_data():
         print("Starting data cleanup...")
         
         try:
+            # Names of the notes about to go: their legacy files sit among unrelated ones in UPLOAD_FOLDER
+            filenames = {name for (name,) in db.session.query(Note.filename).filter(Note.filename.isnot(None))}
             # 1. Delete Activity Logs
             num_logs = ActivityLog.query.delete()
             print(f"Deleted {num_logs} ActivityLogs.")
@@ -51,6 +58,9 @@ def clear_all_college_data():
             
             db.session.commit()
             print("Cleanup completed successfully.")
+            # Bulk deletes skip blobs.release(); drop the blobs and files the notes held
+            report = sweeper.sweep(min_age=0, released_names=filenames)
+            print(f"Removed {len(report.orphans)} uploaded files ({report.bytes} bytes).")
             
         except Exception as e:
             db.session.rollback()
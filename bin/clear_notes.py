@@ -1,17 +1,27 @@
-"""Clear only the note and verification_status tables. Frontend will reflect after refresh."""
+"""Clear only the note and verification_status tables, and the uploaded files. Frontend will reflect after refresh."""
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
 from app import create_app, db
+from app import sweeper
 from app.models import Note, VerificationStatus
 
 def clear_notes():
     app = create_app()
     with app.app_context():
         try:
+            # Names of the notes about to go: their legacy files sit among unrelated ones in UPLOAD_FOLDER
+            filenames = {name for (name,) in db.session.query(Note.filename).filter(Note.filename.isnot(None))}
             num_verifications = VerificationStatus.query.delete()
             print(f"Deleted {num_verifications} VerificationStatus rows.")
             num_notes = Note.query.delete()
             print(f"Deleted {num_notes} Note rows.")
             db.session.commit()
             print("Note table cleared. Refresh the notes page in your browser.")
+            # Bulk deletes skip blobs.release(); drop the blobs and files the notes held
+            report = sweeper.sweep(min_age=0, released_names=filenames)
+            print(f"Removed {len(report.orphans)} uploaded files ({report.bytes} bytes).")
         except Exception as e:
             db.session.rollback()
             print(f"Failed: {e}")
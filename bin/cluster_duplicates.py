@@ -0,0 +1,70 @@
+"""Report clusters of duplicate and near-duplicate notes in every college.
+
+Signs the stored files that have no MinHash signature yet (uploads made before
+near-duplicate detection, or documents whose text could not be read) in the process
+pool, then groups notes whose files are identical or similar (app/similarity.py).
+
+    python bin/cluster_duplicates.py
+"""
+import os
+import sys
+from concurrent.futures import as_completed
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db
+from app import blobs, extraction, similarity
+from app.models import Blob, College, Note
+from app.utils import process_pool
+
+def sign_missing(config):
+    unsigned = Blob.query.filter(Blob.minhash.is_(None), Blob.id.in_(db.session.query(Note.blob_id))).all()
+    futures = {}
+    for blob in unsigned:
+        future = process_pool().submit(extraction.sign, blobs.blob_path(blob.sha256),
+                                       config.get('CONTENT_MAX_CHARS', 200000),
+                                       config.get('SIMILARITY_SAMPLE_BYTES', 1024 * 1024))
+        futures[future] = blob
+    signed = 0
+    for future in as_completed(futures):
+        try:
+            similarity.index(futures[future], future.result())
+            signed += 1
+        except OSError as e:
+            print(f"Could not sign blob {futures[future].id}: {e}")
+    db.session.commit()
+    return signed
+
+def cluster_duplicates():
+    app = create_app()
+    with app.app_context():
+        try:
+            print(f"Signed {sign_missing(app.config)} files.")
+            groups = [set(group) for group in similarity.clusters()]
+            # Notes sharing one blob are exact duplicates even when nothing is similar to them
+            shared = db.session.query(Note.blob_id).filter(Note.blob_id.isnot(None)).group_by(
+                Note.blob_id).having(db.func.count(Note.id) > 1)
+            clustered = set().union(*groups)
+            groups += [{blob_id} for (blob_id,) in shared if blob_id not in clustered]
+
+            colleges = dict(db.session.query(College.id, College.name))
+            found = 0
+            for group in groups:
+                by_college = {}
+                for note in Note.query.filter(Note.blob_id.in_(group)).order_by(Note.upload_date):
+                    by_college.setdefault(note.college_id, []).append(note)
+                for college_id, notes in by_college.items():
+                    if len(notes) < 2:
+                        continue
+                    found += 1
+                    print(f"\n{colleges.get(college_id, college_id)}: {len(notes)} notes")
+                    for note in notes:
+                        state = 'verified' if note.is_verified else 'pending'
+                        print(f"  #{note.id} {note.title} ({note.material_type}, {state}, blob {note.blob_id})")
+            print(f"\n{found} duplicate clusters.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Clustering failed: {e}")
+            raise
+
+if __name__ == "__main__":
+    cluster_duplicates()
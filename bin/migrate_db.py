@@ -0,0 +1,75 @@
+"""Bring an existing database up to the current models without dropping data.
+
+Creates missing tables, adds missing columns and indexes, then runs the data
+backfills for denormalized columns. Safe to run repeatedly.
+"""
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
+from app import create_app, db
+from app import activity, blobs, extraction, previews, syllabus
+
+def add_missing_columns():
+    engine = db.engine
+    inspector = inspect(engine)
+    added = []
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                spec = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {spec}'))
+                added.append(f'{table.name}.{column.name}')
+    return added
+
+def add_missing_indexes():
+    engine = db.engine
+    inspector = inspect(engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(engine)
+                created.append(index.name)
+    return created
+
+# (description, callable returning a row count), run in order after the schema changes
+BACKFILLS = [
+    ('Note syllabus path columns', syllabus.backfill_note_paths),
+    ('Syllabus node owning colleges', syllabus.backfill_college_ids),
+    ('Activity log actor roles and colleges', activity.backfill_actor_scope),
+    ('Blob store out of the static folder', blobs.move_static_store),
+    ('Local note files into the content-addressed store', blobs.adopt_legacy_files),
+    ('PDF previews queued for existing uploads', previews.queue_missing),
+    ('Document text extraction queued for existing uploads', extraction.queue_missing),
+]
+
+def migrate():
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        for name in add_missing_columns():
+            print(f"Added column {name}")
+        for name in add_missing_indexes():
+            print(f"Created index {name}")
+        try:
+            for description, backfill in BACKFILLS:
+                count = backfill()
+                db.session.commit()
+                print(f"Backfilled {description}: {count}")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Backfill failed: {e}")
+            raise
+        print("Database is up to date.")
+
+if __name__ == "__main__":
+    migrate()
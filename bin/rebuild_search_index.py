@@ -0,0 +1,23 @@
+"""Rebuild the notes full-text search index from scratch (FTS5 on SQLite, tsvector on Postgres)."""
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db
+from app import search
+
+def rebuild_search_index():
+    app = create_app()
+    with app.app_context():
+        try:
+            backend = search.get_backend()
+            print(f"Rebuilding search index using {type(backend).__name__}...")
+            count = search.rebuild_index()
+            print(f"Indexed {count} notes.")
+        except Exception as e:
+            db.session.rollback()
+            print(f"Rebuild failed: {e}")
+            raise
+
+if __name__ == "__main__":
+    rebuild_search_index()
@@ -4,6 +4,7 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from app import create_app, db
 from app.models import Role, User, College, Course, Semester, Subject, Unit, Topic, Note, VerificationStatus
+from app.syllabus import syllabus_path
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 import random
@@ -67,16 +68,16 @@ def seed_final_data():
                 course = Course(name=course_name, college_id=college.id)
                 db.session.add(course)
                 db.session.commit()
-                sem = Semester(number=1, course=course)
+                sem = Semester(number=1, course=course, college_id=college.id)
                 db.session.add(sem)
                 db.session.commit()
-                sub = Subject(name=f"Systems Architecture", semester=sem)
+                sub = Subject(name=f"Systems Architecture", semester=sem, college_id=college.id)
                 db.session.add(sub)
                 db.session.commit()
-                unit = Unit(number=1, subject=sub)
+                unit = Unit(number=1, subject=sub, college_id=college.id)
                 db.session.add(unit)
                 db.session.commit()
-                topic = Topic(name=f"Kernel Structures", unit=unit)
+                topic = Topic(name=f"Kernel Structures", unit=unit, college_id=college.id)
                 db.session.add(topic)
                 db.session.commit()
             else:
@@ -151,7 +152,8 @@ def seed_final_data():
                             uploader=teacher,
                             topic=topic,
                             college_id=college.id,
-                            is_verified=True
+                            is_verified=True,
+                            **syllabus_path(Topic, topic.id)
                         )
                         db.session.add(note)
                         db.session.commit()
@@ -11,6 +11,10 @@ app = create_app()
 with app.app_context():
     # Only create tables if they don't exist. db.drop_all() is removed for safety.
     db.create_all()
+
+    # Full-text search index lives outside the ORM metadata
+    from app import search
+    search.get_backend()
     
     # Seed Roles
     roles = ['Super Admin', 'Admin', 'Teacher', 'Senior Student', 'Student']
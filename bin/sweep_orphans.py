@@ -0,0 +1,47 @@
+"""Reclaim files in UPLOAD_FOLDER and the blob store that no note references (app/sweeper.py).
+
+Reports by default; nothing is changed without --delete or --quarantine.
+
+    python bin/sweep_orphans.py                      # dry run: what would be reclaimed
+    python bin/sweep_orphans.py --delete             # delete orphans
+    python bin/sweep_orphans.py --quarantine DIR     # move orphans under DIR/<timestamp> instead
+    python bin/sweep_orphans.py --delete --min-age 0 # include files younger than ORPHAN_MIN_AGE
+"""
+import argparse
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db
+from app import sweeper
+
+def print_report(report, verbose=False):
+    verb = 'Would reclaim' if report.dry_run else 'Reclaimed'
+    for kind, (count, size) in sorted(report.by_kind.items()):
+        print(f"  {kind}: {count} ({size / 1024 / 1024:.1f} MB)")
+    if verbose:
+        for orphan in report.orphans:
+            print(f"  {orphan.path} ({orphan.size} bytes)")
+    blobs = 'would be dropped' if report.dry_run else 'dropped'
+    print(f"{verb} {len(report.orphans)} orphaned files, {report.bytes} bytes "
+          f"({report.bytes / 1024 / 1024:.1f} MB); {report.released_blobs} unreferenced blob rows {blobs}.")
+
+def sweep_orphans(args):
+    app = create_app()
+    with app.app_context():
+        try:
+            report = sweeper.sweep(dry_run=not (args.delete or args.quarantine),
+                                   quarantine=args.quarantine, min_age=args.min_age)
+            print_report(report, verbose=args.verbose)
+        except Exception as e:
+            db.session.rollback()
+            print(f"Sweep failed: {e}")
+            raise
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--delete', action='store_true', help='delete orphaned files')
+    parser.add_argument('--quarantine', metavar='DIR', help='move orphaned files under DIR instead of deleting them')
+    parser.add_argument('--min-age', type=int, default=None, help='seconds; defaults to ORPHAN_MIN_AGE')
+    parser.add_argument('--verbose', action='store_true', help='list every orphaned file')
+    sweep_orphans(parser.parse_args())
@@ -0,0 +1,111 @@
+"""Run queued background jobs: exports (app/exports.py), large registry imports (app/registry.py),
+CDN pushes of uploaded notes (app/storage.py), PDF previews (app/previews.py),
+document text extraction for content search (app/extraction.py) and near-duplicate
+signatures of other uploads (app/similarity.py).
+
+Polls the job tables, runs one job at a time and deletes expired export artifacts
+and abandoned resumable uploads. With ORPHAN_SWEEP_INTERVAL set it also sweeps
+unreferenced files out of UPLOAD_FOLDER and the blob store (app/sweeper.py).
+Start as many workers as needed (a pool of them pushes uploads to the CDN in parallel);
+each job is claimed by exactly one of them.
+
+    python bin/worker.py          # run until interrupted
+    python bin/worker.py --once   # drain the queue and exit
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app import create_app, db
+from app import exports, extraction, previews, registry, similarity, storage, sweeper, uploads
+
+# Seconds between stale job, expired artifact and abandoned upload sweeps
+CLEANUP_INTERVAL = 300
+
+# (label, claim the next job or return None, run it and return True on success)
+QUEUES = [
+    ('export', exports.claim_next, exports.run),
+    ('registry import', registry.claim_next, registry.run),
+    ('CDN push', storage.claim_next, storage.run),
+]
+
+# CPU-bound work on uploaded files, claimed a batch at a time and run in the process pool:
+# (label, claim a batch of blob ids, run them and return how many succeeded)
+BATCHES = [
+    ('PDF previews', previews.claim_batch, previews.run_batch),
+    ('text extractions', extraction.claim_batch, extraction.run_batch),
+    ('file signatures', similarity.claim_batch, similarity.run_batch),
+]
+
+def work(once=False):
+    app = create_app()
+    with app.app_context():
+        poll = app.config.get('EXPORT_POLL_INTERVAL', 2)
+        last_cleanup = 0
+        last_sweep = time.monotonic()
+        sweep_interval = app.config.get('ORPHAN_SWEEP_INTERVAL', 0)
+        print(f"Worker {os.getpid()} started.")
+        while True:
+            if time.monotonic() - last_cleanup > CLEANUP_INTERVAL:
+                requeued = (exports.requeue_stale() + registry.requeue_stale() + storage.requeue_stale()
+                            + previews.requeue_stale() + extraction.requeue_stale()
+                            + similarity.requeue_stale())
+                expired = exports.cleanup_expired()
+                abandoned = uploads.cleanup_expired()
+                if requeued or expired or abandoned:
+                    print(f"Requeued {requeued} stale jobs, removed {expired} expired exports "
+                          f"and {abandoned} abandoned uploads.")
+                last_cleanup = time.monotonic()
+
+            if sweep_interval and time.monotonic() - last_sweep > sweep_interval:
+                report = sweeper.sweep(quarantine=app.config.get('ORPHAN_QUARANTINE_FOLDER'))
+                if report.orphans or report.released_blobs:
+                    print(f"Swept {len(report.orphans)} orphaned files ({report.bytes} bytes) "
+                          f"and {report.released_blobs} unreferenced blobs.")
+                db.session.remove()
+                last_sweep = time.monotonic()
+
+            ran = False
+            for label, claim_next, run in QUEUES:
+                try:
+                    job = claim_next()
+                    if job is None:
+                        continue
+                    ran = True
+                    job_id = job.id
+                    print(f"Running {label} {job_id}...")
+                    if run(job):
+                        rows = getattr(job, 'rows_done', None)
+                        print(f"{label[0].upper()}{label[1:]} {job_id} done" + (f": {rows} rows." if rows is not None else "."))
+                    else:
+                        print(f"{label[0].upper()}{label[1:]} {job_id} failed: {job.error}")
+                except Exception:
+                    # A job that dies mid-run stays 'running' until requeue_stale picks it up
+                    db.session.rollback()
+                    app.logger.exception(f"{label[0].upper()}{label[1:]} crashed")
+                db.session.remove()
+
+            for label, claim_batch, run_batch in BATCHES:
+                try:
+                    batch = claim_batch()
+                    if not batch:
+                        continue
+                    ran = True
+                    print(f"Finished {run_batch(batch)} of {len(batch)} {label}.")
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception(f"Batch of {label} crashed")
+                db.session.remove()
+
+            if not ran:
+                if once:
+                    break
+                db.session.remove()
+                time.sleep(poll)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    work(once=parser.parse_args().once)
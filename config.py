@@ -5,7 +5,47 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///site.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'app', 'static', 'uploads')
+    BLOB_STORE = None  # Content-addressed note files and their previews, kept out of the static folder; defaults to <instance>/blobs
     MAX_CONTENT_LENGTH = 500 * 1024 * 1024  # 500MB max upload for videos and large files
+    UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Bytes per PUT in the resumable upload protocol
+    UPLOAD_SESSION_TTL = 24 * 3600  # Seconds an unfinished resumable upload is kept for resuming
+    SENDFILE_HEADER = os.environ.get('SENDFILE_HEADER')  # 'X-Accel-Redirect' (nginx) or 'X-Sendfile' (Apache) to offload note downloads
+    SENDFILE_ACCEL_PREFIX = '/protected-uploads/'  # nginx internal location aliased to UPLOAD_FOLDER
+    SENDFILE_BLOB_PREFIX = '/protected-blobs/'  # nginx internal location aliased to BLOB_STORE
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND') or ('cloudinary' if os.environ.get('CLOUDINARY_CLOUD_NAME') else None)  # Where bin/worker.py pushes note files: 'cloudinary', 'local' or None to keep them local
+    STORAGE_LOCAL_FOLDER = None  # Target of the 'local' stand-in backend; defaults to app/static/cdn
+    STORAGE_LOCAL_URL = '/static/cdn/'  # URL prefix the 'local' backend hands out
+    CDN_PUSH_MAX_ATTEMPTS = 5  # Failed pushes are retried this many times in total
+    CDN_PUSH_RETRY_DELAY = 30  # Seconds before the first retry; doubles on each further attempt
+    WORKER_PROCESSES = 2  # Processes bin/worker.py renders PDF previews and extracts document text in
+    PREVIEW_PAGES = 3  # Leading pages rendered as images for the preview page
+    PREVIEW_THUMB_WIDTH = 320  # Pixel width of the listing thumbnail (first page)
+    PREVIEW_PAGE_WIDTH = 900  # Pixel width of each preview page image
+    PREVIEW_JPEG_QUALITY = 70
+    CONTENT_MAX_CHARS = 200000  # Extracted document text kept in the content search index
+    SIMILARITY_THRESHOLD = 0.8  # Estimated Jaccard similarity at which two files are flagged as near-duplicates
+    SIMILARITY_SAMPLE_BYTES = 1024 * 1024  # Leading bytes shingled for files without extractable text
+    NOTE_LINK_TTL = 3600  # Signed note file links stay valid for between one and two of these periods (seconds)
+    ORPHAN_MIN_AGE = 3600  # Seconds before an unreferenced upload or blob file may be swept (uploads land before their note)
+    ORPHAN_SWEEP_INTERVAL = 0  # Seconds between orphan sweeps run by bin/worker.py (0 disables them)
+    ORPHAN_QUARANTINE_FOLDER = None  # Where swept files are moved instead of deleted; None deletes them
+    PRESENCE_FLUSH_INTERVAL = 15  # Seconds between batched last_active writes (0 writes through)
+    PRESENCE_THROTTLE = 60  # Skip presence updates for users marked active this recently
+    ACTIVITY_LOG_SYNC = False  # Write audit events inline (for tests) instead of through the batched writer
+    ACTIVITY_LOG_BATCH_SIZE = 200  # Queued events that trigger an immediate flush
+    ACTIVITY_LOG_FLUSH_INTERVAL = 2  # Seconds between background flushes
+    ACTIVITY_LOG_SPOOL_DIR = None  # Defaults to <instance>/activity_spool
+    EXPORT_FOLDER = None  # Finished export files; defaults to <instance>/exports
+    EXPORT_TTL = 24 * 3600  # Seconds a finished export stays downloadable
+    EXPORT_POLL_INTERVAL = 2  # Seconds bin/worker.py waits when its queues are empty
+    EXPORT_PROGRESS_EVERY = 5000  # Rows between progress updates on a running export
+    JOB_STALE_AFTER = 600  # Seconds without progress before a running export or import is requeued
+    REGISTRY_UPLOAD_FOLDER = None  # Saved registry uploads while they import; defaults to <instance>/registry_imports
+    REGISTRY_CHUNK_SIZE = 5000  # Registry rows read, checked and committed per chunk
+    REGISTRY_INLINE_MAX_BYTES = 5 * 1024 * 1024  # Larger registry files are imported by bin/worker.py
+    USER_CACHE_TTL = 60  # Seconds a worker reuses a cached login identity
+    USER_CACHE_SIZE = 2048  # Identities kept per worker (least recently used are dropped)
+    SYLLABUS_CACHE_TTL = 30  # Seconds a worker trusts its cached syllabus labels before rechecking the version
     
     # Cloudinary Config
     CLOUDINARY_CLOUD_NAME = os.environ.get('CLOUDINARY_CLOUD_NAME')
@@ -0,0 +1,66 @@
+"""Signed note links on pages open to anonymous visitors.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import pytest
+from config import Config
+
+
+@pytest.fixture
+def app(tmp_path):
+    from app import create_app, db
+
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'test.db')
+        UPLOAD_FOLDER = str(tmp_path / 'uploads')
+        ACTIVITY_LOG_SYNC = True
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def seed_blob_note(db):
+    from app.models import Blob, College, Course, Note, Role, Semester, Subject, Topic, Unit, User
+    from app.syllabus import syllabus_path
+
+    college = College(name='Test College')
+    role = Role(name='Teacher')
+    db.session.add_all([college, role])
+    db.session.commit()
+    teacher = User(username='teacher', email='teacher@test.edu', password_hash='x',
+                   role_id=role.id, college_id=college.id, is_verified=True)
+    course = Course(name='CS', college_id=college.id)
+    semester = Semester(number=1, course=course, college_id=college.id)
+    subject = Subject(name='Operating Systems', semester=semester, college_id=college.id)
+    unit = Unit(number=1, subject=subject, college_id=college.id)
+    topic = Topic(name='Kernels', unit=unit, college_id=college.id)
+    blob = Blob(sha256='ab' * 32, size=10, refcount=1)
+    db.session.add_all([teacher, topic, blob])
+    db.session.commit()
+    note = Note(title='Kernel notes', filename='kernels.pdf', material_type='pdf', user_id=teacher.id,
+                topic_id=topic.id, college_id=college.id, is_verified=True, blob_id=blob.id,
+                **syllabus_path(Topic, topic.id))
+    db.session.add(note)
+    db.session.commit()
+    return note
+
+
+def test_anonymous_listing_uses_note_id_links(app):
+    from app import db
+
+    note = seed_blob_note(db)
+    response = app.test_client().get('/notes')
+    assert response.status_code == 200
+    html = response.get_data(as_text=True)
+    assert f'/notes/view/{note.id}/kernels.pdf' in html
+    assert '/notes/files/' not in html